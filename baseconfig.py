@@ -10,6 +10,7 @@ CONF.PATH.CONFIG = os.path.join(CONF.PATH.BASE, "configs")
 
 # Data
 CONF.PATH.DATA = os.path.join(CONF.PATH.BASE, "data")
+CONF.PATH.CACHE = os.path.join(CONF.PATH.DATA, "cache")
 
 # Outputs
 CONF.PATH.OUTPUT = os.path.join(CONF.PATH.BASE, 'outputs')
@@ -0,0 +1,65 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+from torchvision import transforms
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) #Hack add ROOT DIR
+from utils.augment import BatchAugment, AugmentedLoader
+
+
+MEAN, STD = (0.4914, 0.4822, 0.4465), (0.2470, 0.2435, 0.2616)
+
+
+class PerSampleDataset(torch.utils.data.Dataset):
+    """Crop, flip and normalize in __getitem__, as the torchvision transform pipeline does"""
+    def __init__(self, X, Y):
+        self.X, self.Y = X, Y
+        self.transform = transforms.Compose([
+            transforms.RandomCrop(32, padding=4),
+            transforms.RandomHorizontalFlip(),
+            transforms.Normalize(MEAN, STD),
+        ])
+
+    def __len__(self):
+        return len(self.X)
+
+    def __getitem__(self, idx):
+        return self.transform(self.X[idx]), self.Y[idx]
+
+
+def epoch_time(loader):
+    start = time.perf_counter()
+    for x, y in loader:
+        pass
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time of one augmented epoch over a CIFAR-shaped pool, per-sample transforms in the "
+                                                 "DataLoader workers vs BatchAugment on whole batches.")
+    parser.add_argument('--n_samples', type=int, default=10000)
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--num_workers', type=int, nargs='+', default=[0, 2])
+    args = parser.parse_args()
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    X = torch.rand(args.n_samples, 3, 32, 32)
+    Y = torch.from_numpy(np.random.randint(0, 10, args.n_samples))
+
+    for num_workers in args.num_workers:
+        loader = DataLoader(PerSampleDataset(X, Y), batch_size=args.batch_size, shuffle=True, num_workers=num_workers)
+        print("per-sample num_workers={} {:.2f}s".format(num_workers, epoch_time(loader)))
+
+    normalized = (X - torch.tensor(MEAN).view(1, 3, 1, 1)) / torch.tensor(STD).view(1, 3, 1, 1)
+    fill = [-m / s for m, s in zip(MEAN, STD)]
+    for num_workers in args.num_workers:
+        loader = DataLoader(TensorDataset(normalized, Y), batch_size=args.batch_size, shuffle=True, num_workers=num_workers)
+        loader = AugmentedLoader(loader, BatchAugment(crop_padding=4, flip=True, fill=fill), device)
+        print("batched    num_workers={} {:.2f}s".format(num_workers, epoch_time(loader)))
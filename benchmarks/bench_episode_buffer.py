@@ -0,0 +1,79 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import time
+import argparse
+
+import torch
+from torch.nn.functional import one_hot, log_softmax
+from torch.distributions import Categorical
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) #Hack add ROOT DIR
+from networks.controller import Policy
+from networks.episode_buffer import EpisodeBuffer
+
+# steps per epoch of the CIFAR10 loaders used by the mixup policies (50000 samples, drop_last=True)
+cifar10_batch_sizes = [32, 64, 128]
+cifar10_n_train = 50000
+
+
+def select_action(policy, state, action_space):
+    episode_logits = policy(state)
+    action_index = Categorical(logits=episode_logits).sample().unsqueeze(1)
+    mask = one_hot(action_index, num_classes=action_space)
+    episode_log_probs = torch.sum(mask.float() * log_softmax(episode_logits, dim=1), dim=1)
+    return action_index, episode_logits, episode_log_probs
+
+
+def run_cat(policy, n_steps, action_space, device):
+    state = torch.tensor([[0, 1.0, 1.0]], device=device)
+    for step in range(n_steps):
+        action_index, episode_logits, episode_log_probs = select_action(policy, state, action_space)
+        if step == 0:
+            episode_logits_all = episode_logits
+            episode_log_probs_all = episode_log_probs
+        else:
+            episode_logits_all = torch.cat((episode_logits_all, episode_logits), 0)
+            episode_log_probs_all = torch.cat((episode_log_probs_all, episode_log_probs), 0)
+    loss = -torch.sum(episode_log_probs_all) + episode_logits_all.mean()
+    loss.backward()
+
+
+def run_buffer(policy, n_steps, action_space, device):
+    state = torch.tensor([[0, 1.0, 1.0]], device=device)
+    episode_buffer = EpisodeBuffer(n_steps, state.shape[1], action_space, device=device)
+    for step in range(n_steps):
+        action_index, episode_logits, episode_log_probs = select_action(policy, state, action_space)
+        episode_buffer.push(state, action_index, episode_logits, episode_log_probs)
+    loss = -torch.sum(episode_buffer.log_probs()) + episode_buffer.logits().mean()
+    loss.backward()
+
+
+def timeit(fn, *args, repeats=3):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(*args)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-episode overhead of the policy gradient trajectory storage.")
+    parser.add_argument('--n_pg_epochs', type=int, default=3)
+    parser.add_argument('--action_space', type=int, default=3)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    policy = Policy().to(device)
+
+    print("{:>10} {:>10} {:>12} {:>12} {:>8}".format('batch', 'steps', 'cat [s]', 'buffer [s]', 'speedup'))
+    for batch_size in cifar10_batch_sizes:
+        n_steps = args.n_pg_epochs * (cifar10_n_train // batch_size)
+        t_cat = timeit(run_cat, policy, n_steps, args.action_space, device, repeats=args.repeats)
+        t_buffer = timeit(run_buffer, policy, n_steps, args.action_space, device, repeats=args.repeats)
+        print("{:>10d} {:>10d} {:>12.4f} {:>12.4f} {:>7.2f}x".format(batch_size, n_steps, t_cat, t_buffer, t_cat / t_buffer))
@@ -0,0 +1,60 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import time
+import argparse
+import types
+
+import torch
+from torch.utils.data import TensorDataset, DataLoader
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) #Hack add ROOT DIR
+import networks
+from networks.parallel_envs import make_environments
+
+
+def time_steps(envs, student, n_envs, n_steps):
+    envs.reset(student.state_dict())
+    actions = torch.full((n_envs,), 0.5)
+    start = time.perf_counter()
+    for _ in range(n_steps):
+        envs.step(actions)
+    envs.val()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wall-clock of B student trainings played by the parallel environments.")
+    parser.add_argument('--backend', type=str, default='auto')
+    parser.add_argument('--model', type=str, default='NET')
+    parser.add_argument('--n_steps', type=int, default=100)
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--n_envs', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    # synthetic CIFAR10-shaped data, the loaders are materialized into shared memory anyway
+    X = torch.randn(args.batch_size * args.n_steps, 3, 32, 32)
+    Y = torch.randint(0, 10, (len(X),))
+    train_loader = DataLoader(TensorDataset(X, Y), batch_size=args.batch_size, shuffle=True, drop_last=True)
+    val_loader = DataLoader(TensorDataset(X[:1000], Y[:1000]), batch_size=args.batch_size)
+
+    if args.model == "NET":
+        student = networks.NET(n_in=1024, in_channels=3, num_classes=10)
+    else:
+        student = networks.CNN(args.model, in_channels=3, num_classes=10)
+
+    opt = types.SimpleNamespace(seed=0, batch_size=args.batch_size, lr=1e-3, n_classes=10)
+
+    # speedup: episodes per second relative to the first n_envs
+    print("{:>8} {:>12} {:>14} {:>10}".format('n_envs', 'time [s]', 'per env [s]', 'speedup'))
+    base = None
+    for n_envs in args.n_envs:
+        envs = make_environments(opt, student, train_loader, val_loader, n_envs, device, backend=args.backend)
+        t = time_steps(envs, student, n_envs, args.n_steps)
+        envs.close()
+        if base is None:
+            base = t / n_envs
+        print("{:>8d} {:>12.3f} {:>14.3f} {:>10.2f}".format(n_envs, t, t / n_envs, base / (t / n_envs)))
@@ -0,0 +1,56 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import time
+import argparse
+
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) #Hack add ROOT DIR
+from utils.projection import make_projection
+
+
+def timeit(fn, n_repeats):
+    fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(n_repeats):
+        fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / n_repeats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Projection and unprojection throughput of the random projections.")
+    parser.add_argument('--in_dim', type=int, default=784)
+    parser.add_argument('--dims', type=int, nargs='+', default=[24, 100, 784])
+    parser.add_argument('--batch_size', type=int, default=4096)
+    parser.add_argument('--n_repeats', type=int, default=10)
+    args = parser.parse_args()
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    x = torch.randn(args.batch_size, args.in_dim, device=device)
+
+    print("{:>10} {:>6} {:>16} {:>16} {:>14} {:>16}".format('kind', 'dim', 'project [x/s]', 'unproject [x/s]', 'pinv [s]', 'dense pinv [s]'))
+    for dim in args.dims:
+        for kind in ['gaussian', 'sparse', 'hadamard']:
+            projection = make_projection(kind, args.in_dim, dim, seed=0).to(device)
+            y = x @ projection
+
+            t_project = timeit(lambda: x @ projection, args.n_repeats)
+
+            # first call factorizes the Gram matrix, the following ones only solve
+            start = time.perf_counter()
+            projection.unproject(y[:1])
+            t_pinv = time.perf_counter() - start
+            t_unproject = timeit(lambda: projection.unproject(y), args.n_repeats)
+
+            # what utils/visualize.py used to do for every call
+            P = projection.matrix()
+            t_dense = timeit(lambda: torch.linalg.pinv(P), 1)
+
+            print("{:>10} {:>6d} {:>16.0f} {:>16.0f} {:>14.4f} {:>16.4f}".format(
+                kind, dim, args.batch_size / t_project, args.batch_size / t_unproject, t_pinv, t_dense))
@@ -0,0 +1,60 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import time
+import argparse
+import resource
+import tempfile
+
+import numpy as np
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) #Hack add ROOT DIR
+from datasets.stream import StreamingArray, iterate_batches
+
+
+MEAN, STD = (0.4914, 0.4822, 0.4465), (0.2470, 0.2435, 0.2616)
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def scoring_pass(X, Y, batch_size):
+    """Stand-in for the IMT candidate scoring: one reduction per batch"""
+    best = float('inf')
+    for i, x, y in iterate_batches(X, Y, batch_size):
+        best = min(best, x.pow(2).mean().item())
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Peak RSS and time of a full pass over a CIFAR-shaped pool, dense vs streamed. "
+                                                 "Run each mode in its own process, the peak RSS is per process.")
+    parser.add_argument('--mode', type=str, default='stream', help="dense or stream")
+    parser.add_argument('--n_samples', type=int, default=50000)
+    parser.add_argument('--chunk_size', type=int, default=2048)
+    parser.add_argument('--batch_size', type=int, default=128)
+    args = parser.parse_args()
+
+    # raw uint8 pool on disk, as in the dataset cache
+    path = os.path.join(tempfile.mkdtemp(), 'X.npy')
+    raw = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(args.n_samples, 32, 32, 3))
+    raw[:] = np.random.randint(0, 256, size=raw.shape[1:], dtype=np.uint8)
+    raw.flush()
+    del raw
+    raw = np.load(path, mmap_mode='r')
+    Y = torch.zeros(args.n_samples, dtype=torch.long)
+
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    if args.mode == 'dense':
+        X = StreamingArray(raw, MEAN, STD)[:]
+    else:
+        X = StreamingArray(raw, MEAN, STD, chunk_size=args.chunk_size)
+    scoring_pass(X, Y, args.batch_size)
+    t = time.perf_counter() - start
+
+    print("{} n_samples={} time={:.2f}s peak RSS={:.0f}MB (+{:.0f}MB)".format(
+        args.mode, args.n_samples, t, peak_rss_mb(), peak_rss_mb() - rss_before))
@@ -0,0 +1,35 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import time
+import argparse
+import resource
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) #Hack add ROOT DIR
+from baseconfig import CONF
+from datasets.synthetic import synthetic_data
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generation time and peak RSS of the synthetic datasets, written into a "
+                                                 "temporary dataset cache.")
+    parser.add_argument('--name', type=str, default='gaussian')
+    parser.add_argument('--n_samples', type=int, default=1000000)
+    parser.add_argument('--dim', type=int, default=100)
+    args = parser.parse_args()
+
+    CONF.PATH.CACHE = tempfile.mkdtemp()
+
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    X, Y = synthetic_data(args.name, args.n_samples, args.dim)
+    t = time.perf_counter() - start
+
+    print("{} n_samples={} dim={} size={:.0f}MB time={:.2f}s ({:.0f} samples/s) peak RSS +{:.0f}MB".format(
+        args.name, args.n_samples, args.dim, X.nbytes / 2 ** 20, t, args.n_samples / t, peak_rss_mb() - rss_before))
@@ -1 +1,4 @@
 from .base_dataset import *
+from .class_index import *
+from .stream import *
+from .synthetic import *
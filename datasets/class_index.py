@@ -0,0 +1,100 @@
+import numpy as np
+import torch
+from torch.utils.data import Subset
+
+from utils.cache import DatasetCache
+
+
+def dataset_targets(dataset):
+    """Labels of a torchvision dataset, a BaseDataset or a Subset of them, without loading any sample"""
+    if isinstance(dataset, Subset):
+        return dataset_targets(dataset.dataset)[np.asarray(dataset.indices)]
+    if hasattr(dataset, 'targets'):
+        targets = dataset.targets
+    else:
+        targets = dataset.labels
+    if torch.is_tensor(targets):
+        targets = targets.numpy()
+    return np.asarray(targets).astype(np.int64)
+
+
+class ClassIndex:
+    """Per-class index of a dataset split: class -> sorted sample indices.
+
+    The sample indices are stored sorted by class (then by position) in one array with the offset
+    of every class, so the indices of a class are a slice and every query is independent of the
+    size of the split.
+    """
+    def __init__(self, order, classes, offsets):
+        self.order = order
+        self.classes = classes
+        self.offsets = offsets
+        self._position = {int(c): i for i, c in enumerate(classes)}
+
+    @classmethod
+    def from_targets(cls, targets):
+        targets = np.asarray(targets)
+        order = np.argsort(targets, kind='stable')
+        classes, counts = np.unique(targets[order], return_counts=True)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        return cls(order, classes, offsets)
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        return cls.from_targets(dataset_targets(dataset))
+
+    @classmethod
+    def load_or_build(cls, dataset_name, split, targets_fn):
+        """Index of a whole dataset split, built once and kept in the dataset cache"""
+        key = {'index': 'class', 'dataset': dataset_name, 'split': split}
+
+        def create():
+            index = cls.from_targets(targets_fn())
+            return {'order': index.order, 'classes': index.classes, 'offsets': index.offsets}
+
+        return cls(*DatasetCache().get_or_create(key, create, names=('order', 'classes', 'offsets')))
+
+    def __len__(self):
+        return len(self.order)
+
+    def count(self, c):
+        i = self._position[int(c)]
+        return int(self.offsets[i + 1] - self.offsets[i])
+
+    def indices(self, c):
+        """Sorted sample indices of class c"""
+        i = self._position[int(c)]
+        return self.order[self.offsets[i]:self.offsets[i + 1]]
+
+    def pair(self, class_1, class_2):
+        """Sorted sample indices of the union of two classes, in dataset order"""
+        return np.sort(np.concatenate((self.indices(class_1), self.indices(class_2))))
+
+    def k_per_class(self, k, classes=None, replace=False, rng=None):
+        """
+        k random sample indices of every class, shape (len(classes), k)
+        :param rng: numpy RandomState or Generator of the draws, RandomState(0) by default, never the global one
+        """
+        rng = np.random.RandomState(0) if rng is None else rng
+        if classes is None:
+            classes = self.classes
+        return np.stack([rng.choice(self.indices(c), k, replace=replace) for c in classes], axis=0)
+
+    def stratified_sample(self, n, replace=False, rng=None):
+        """n random sample indices with classes represented in proportion to their size, drawn from rng as in k_per_class"""
+        rng = np.random.RandomState(0) if rng is None else rng
+        counts = np.diff(self.offsets)
+        n_per_class = np.floor(counts * n / counts.sum()).astype(np.int64)
+        # hand the remaining samples to the classes with the largest fractional part
+        remainder = n - n_per_class.sum()
+        if remainder > 0:
+            n_per_class[np.argsort(-(counts * n / counts.sum() - n_per_class))[:remainder]] += 1
+        idx = [rng.choice(self.indices(c), m, replace=replace) for c, m in zip(self.classes, n_per_class) if m > 0]
+        return rng.permutation(np.concatenate(idx))
+
+
+def query_set(dataset, index, classes, k, rng=None):
+    """Stack k examples of every class of a dataset, shape (len(classes), k, *sample_shape), drawn from rng"""
+    idx = index.k_per_class(k, classes=classes, rng=rng)
+    samples = [torch.stack([dataset[int(i)][0] for i in row], dim=0) for row in idx]
+    return torch.stack(samples, dim=0)
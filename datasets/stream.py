@@ -0,0 +1,188 @@
+import sys
+import queue
+import threading
+
+import numpy as np
+import torch
+import torchvision
+
+sys.path.append('..') #Hack add ROOT DIR
+from baseconfig import CONF
+from utils.cache import DatasetCache
+from utils.utils import ChannelStats
+
+
+RAW_DATASETS = {
+    'mnist': torchvision.datasets.MNIST,
+    'cifar10': torchvision.datasets.CIFAR10,
+    'cifar100': torchvision.datasets.CIFAR100,
+}
+
+
+def raw_data(dataset_name, split='train'):
+    """Raw uint8 samples and int64 labels of a torchvision dataset split, memory-mapped from the dataset cache"""
+    key = {'dataset': dataset_name, 'split': split, 'transform': ['raw']}
+
+    def create():
+        dataset = RAW_DATASETS[dataset_name](root=CONF.PATH.DATA, train=(split == 'train'), download=True)
+        X = dataset.data.numpy() if torch.is_tensor(dataset.data) else np.asarray(dataset.data)
+        Y = dataset.targets.numpy() if torch.is_tensor(dataset.targets) else np.asarray(dataset.targets)
+        return {'X': X.astype(np.uint8), 'Y': Y.astype(np.int64)}
+
+    return DatasetCache().get_or_create(key, create)
+
+
+def dataset_mean_and_std(dataset_name, split='train', decimals=4, chunk_size=10000):
+    """
+    Per-channel mean and std of the ToTensor() samples of a dataset split, the constants of its Normalize transform.
+    Computed once in one streamed pass over the raw array and kept in the dataset cache.
+    :return: a tuple (mean, std) of tuples of floats, rounded to decimals
+    """
+    key = {'stats': dataset_name, 'split': split}
+
+    def create():
+        X_raw, _ = raw_data(dataset_name, split)
+        n_channels = 1 if X_raw.ndim == 3 else X_raw.shape[3]
+        X = StreamingArray(X_raw, [0.] * n_channels, [1.] * n_channels, chunk_size=chunk_size)
+        stats = ChannelStats()
+        for _, x in X.chunks():
+            stats.update(x)
+        return {'mean': stats.mean.numpy(), 'std': stats.std.numpy()}
+
+    mean, std = DatasetCache().get_or_create(key, create, names=('mean', 'std'))
+    return tuple(round(float(m), decimals) for m in mean), tuple(round(float(s), decimals) for s in std)
+
+
+def prefetch(iterator, size=2):
+    """Run iterator in a background thread, at most size items ahead of the consumer"""
+    items = queue.Queue(maxsize=size)
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterator:
+                while not stop.is_set():
+                    try:
+                        items.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+        except Exception as e:
+            items.put(e)
+        items.put(done)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # the consumer stopped early (break, exception), let the producer exit
+        stop.set()
+
+
+class StreamingArray:
+    """Normalized float32 view of a raw uint8 image array, (N, H, W) or (N, H, W, C), read on demand.
+
+    Indexing returns the normalized samples as a (n, C, H, W) tensor on the device of the view, so
+    it can replace a dense X in the slicing code of the teaching policies (X[i_min:i_max].cuda(),
+    X.size(0), ...) while only the raw bytes of the requested rows are read. chunks() streams the
+    whole array in fixed-size chunks, normalized in a background thread through a bounded queue,
+    so a full pass never holds more than a few chunks in memory, whatever the dataset size.
+    """
+    def __init__(self, raw, mean, std, start=0, stop=None, device='cpu', chunk_size=1024, n_prefetch=2):
+        self.raw = raw
+        self.mean = torch.tensor(mean, dtype=torch.float).view(1, -1, 1, 1)
+        self.std = torch.tensor(std, dtype=torch.float).view(1, -1, 1, 1)
+        self.start = start
+        self.stop = len(raw) if stop is None else stop
+        self.device = torch.device(device)
+        self.chunk_size = chunk_size
+        self.n_prefetch = n_prefetch
+
+    @property
+    def shape(self):
+        if self.raw.ndim == 3:
+            return (len(self), 1) + tuple(self.raw.shape[1:])
+        return (len(self), self.raw.shape[3]) + tuple(self.raw.shape[1:3])
+
+    def size(self, dim=None):
+        return self.shape if dim is None else self.shape[dim]
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def _view(self, start, stop, device):
+        return StreamingArray(self.raw, self.mean.view(-1).tolist(), self.std.view(-1).tolist(), start=start, stop=stop,
+                              device=device, chunk_size=self.chunk_size, n_prefetch=self.n_prefetch)
+
+    def subset(self, start, stop):
+        """Lazy view of the rows [start, stop)"""
+        stop = min(stop, len(self))
+        return self._view(self.start + start, self.start + stop, self.device)
+
+    def to(self, device):
+        return self._view(self.start, self.stop, device)
+
+    def cuda(self):
+        return self.to('cuda')
+
+    def cpu(self):
+        return self.to('cpu')
+
+    def normalize(self, raw):
+        """Same arithmetic as transforms.ToTensor() + transforms.Normalize() on a batch of raw samples"""
+        x = torch.from_numpy(np.array(raw))
+        x = x.unsqueeze(1) if x.dim() == 3 else x.permute(0, 3, 1, 2)
+        return x.float().div_(255).sub_(self.mean).div_(self.std)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            raw = self.raw[self.start + start:self.start + stop:step]
+        elif isinstance(idx, (int, np.integer)):
+            if idx < 0:
+                idx += len(self)
+            raw = self.raw[self.start + idx:self.start + idx + 1]
+            return self.normalize(raw)[0].to(self.device)
+        else:
+            idx = idx.cpu().numpy() if torch.is_tensor(idx) else np.asarray(idx)
+            raw = self.raw[self.start + idx]
+        return self.normalize(raw).to(self.device)
+
+    def _raw_chunks(self, chunk_size):
+        for i_min in range(0, len(self), chunk_size):
+            i_max = min(i_min + chunk_size, len(self))
+            yield i_min, self.normalize(self.raw[self.start + i_min:self.start + i_max])
+
+    def chunks(self, chunk_size=None):
+        """Yield (offset, normalized chunk on device) over the whole view, prefetched in a background thread"""
+        chunk_size = self.chunk_size if chunk_size is None else chunk_size
+        for i_min, x in prefetch(self._raw_chunks(chunk_size), size=self.n_prefetch):
+            yield i_min, x.to(self.device, non_blocking=True)
+
+
+def iterate_batches(X, Y, batch_size):
+    """Yield (i, x, y) for the consecutive full batches of (X, Y), streamed chunk by chunk when X is a StreamingArray"""
+    nb_batch = int(X.size(0) / batch_size)
+    if not isinstance(X, StreamingArray):
+        for i in range(nb_batch):
+            yield i, X[i * batch_size:(i + 1) * batch_size], Y[i * batch_size:(i + 1) * batch_size]
+        return
+
+    # whole batches per chunk so that no batch straddles two chunks
+    chunk_size = max(X.chunk_size // batch_size, 1) * batch_size
+    for i_min, x in X.chunks(chunk_size):
+        for j in range(x.shape[0] // batch_size):
+            i = i_min // batch_size + j
+            if i >= nb_batch:
+                return
+            yield i, x[j * batch_size:(j + 1) * batch_size], Y[i * batch_size:(i + 1) * batch_size]
@@ -0,0 +1,106 @@
+import numpy as np
+
+from utils.cache import DatasetCache
+
+
+# rows x dim values generated at once, 16M float32 values = 64MB per chunk whatever the dimension
+CHUNK_VALUES = 2 ** 24
+
+
+class GaussianMixture:
+    """Two classes of n_components isotropic Gaussians each, of identity covariance.
+
+    With one component per class the classes are N(0.5, I) (label 1) and N(-0.5, I) (label 0), the
+    Gaussian data of the teaching policies. More components are spread around the class mean with
+    a standard deviation of spread.
+    """
+    def __init__(self, rng, dim, n_components=1, spread=1.0):
+        means = np.array([-0.5, 0.5], dtype=np.float32).reshape(2, 1, 1)
+        self.centers = np.repeat(np.repeat(means, n_components, axis=1), dim, axis=2)
+        if n_components > 1:
+            self.centers += spread * rng.standard_normal((2, n_components, dim), dtype=np.float32)
+        self.n_components = n_components
+
+    def sample(self, rng, X, Y):
+        n = X.shape[0]
+        Y[:] = rng.integers(0, 2, n)
+        component = rng.integers(0, self.n_components, n)
+        rng.standard_normal(dtype=np.float32, out=X)
+        X += self.centers[Y, component]
+
+
+class LinearlySeparable:
+    """N(0, I) samples labeled by the side of a random hyperplane through the origin, then pushed
+    margin / 2 away from it on their side, so that the two classes are separated by a gap of margin"""
+    def __init__(self, rng, dim, margin=1.0):
+        w = rng.standard_normal(dim).astype(np.float32)
+        self.w = w / np.linalg.norm(w)
+        self.margin = margin
+
+    def sample(self, rng, X, Y):
+        rng.standard_normal(dtype=np.float32, out=X)
+        Y[:] = X @ self.w > 0
+        X += ((2 * Y - 1) * (self.margin / 2)).astype(np.float32)[:, None] * self.w
+
+
+class Moons:
+    """sklearn.datasets.make_moons embedded in dim dimensions.
+
+    The two half circles are drawn in the plane of a random orthonormal pair of directions (the
+    first two axes in 2D, where this is make_moons) and the noise is isotropic in all dimensions.
+    """
+    def __init__(self, rng, dim, noise=0.2):
+        if dim == 2:
+            self.basis = np.eye(2, dtype=np.float32)
+        else:
+            q, _ = np.linalg.qr(rng.standard_normal((dim, 2)))
+            self.basis = q.T.astype(np.float32)
+        self.noise = noise
+
+    def sample(self, rng, X, Y):
+        n = X.shape[0]
+        Y[:] = rng.integers(0, 2, n)
+        t = rng.uniform(0, np.pi, n)
+        plane = np.where(Y[:, None] == 0,
+                         np.stack([np.cos(t), np.sin(t)], axis=1),
+                         np.stack([1 - np.cos(t), 0.5 - np.sin(t)], axis=1)).astype(np.float32)
+        rng.standard_normal(dtype=np.float32, out=X)
+        X *= self.noise
+        X += plane @ self.basis
+
+
+SYNTHETIC_DATASETS = {
+    'gaussian': GaussianMixture,
+    'linearly_seperable': LinearlySeparable,
+    'moon': Moons,
+}
+
+
+def synthetic_key(name, n_samples, dim, seed=0, **params):
+    chunk_size = max(CHUNK_VALUES // dim, 1)
+    return {'synthetic': name, 'n_samples': n_samples, 'dim': dim, 'seed': seed, 'chunk_size': chunk_size, 'params': params}
+
+
+def synthetic_data(name, n_samples, dim, seed=0, **params):
+    """
+    Seeded synthetic binary classification data of any size, generated once into the dataset cache.
+    The samples are generated chunk by chunk, each chunk from its own generator seeded by (seed, chunk),
+    and appended to the .npy files of the cache entry, which are then loaded memory-mapped, so neither
+    the generation nor the loading ever holds more than one chunk in memory.
+    :param name: a key of SYNTHETIC_DATASETS
+    :param params: keyword arguments of the generator, e.g. n_components, margin or noise
+    :return: a tuple (X, Y) of memory-mapped arrays, float32 (n_samples, dim) and int64 (n_samples,)
+    """
+    key = synthetic_key(name, n_samples, dim, seed, **params)
+    chunk_size = key['chunk_size']
+
+    def chunks():
+        dataset = SYNTHETIC_DATASETS[name](np.random.default_rng([seed, 0]), dim, **params)
+        for c, i_min in enumerate(range(0, n_samples, chunk_size)):
+            n = min(chunk_size, n_samples - i_min)
+            X, Y = np.empty((n, dim), dtype=np.float32), np.empty(n, dtype=np.int64)
+            dataset.sample(np.random.default_rng([seed, 1, c]), X, Y)
+            yield {'X': X, 'Y': Y}
+
+    arrays = {'X': ((n_samples, dim), np.float32), 'Y': ((n_samples,), np.int64)}
+    return DatasetCache().get_or_create_streamed(key, arrays, chunks)
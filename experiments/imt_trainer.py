@@ -5,6 +5,8 @@ import os
 import csv
 import sys
 from tqdm import tqdm
+from utils.trace import trace_recorder
+from utils.evaluation import Evaluator
 
 
 def plot_classifier(model, max, min):
@@ -41,11 +43,11 @@ class IMTTrainer(nn.Module):
                 logwriter = csv.writer(logfile, delimiter=',')
                 logwriter.writerow(['iter', 'test acc', 'w diff'])
 
-        res_baseline = []
         a_baseline = []
         b_baseline = []
-        w_diff_baseline = []
 
+        evaluator = Evaluator(self.opt, self.X_test, self.Y_test, w_star, logname)
+        trace = trace_recorder(self.opt, self.opt.n_iter - 1, self.opt.experiment)
         for t in tqdm(range(self.opt.n_iter)):
             if t != 0:
                 if self.opt.experiment == "IMT_Baseline":
@@ -58,57 +60,17 @@ class IMTTrainer(nn.Module):
 
                 if self.data is not None:
                     selected_sample, selected_label = self.data[i]
-                    if t == 1:
-                        selected_samples = selected_sample.unsqueeze(0).cpu().detach().numpy()  # [np.newaxis, :]
-                        selected_labels = selected_label.unsqueeze(0).unsqueeze(1).cpu().detach().numpy()  # [np.newaxis, :]
-                    else:
-                        selected_samples = np.concatenate((selected_samples, selected_sample.unsqueeze(0).cpu().detach().numpy()), axis=0)
-                        selected_labels = np.concatenate((selected_labels, selected_label.unsqueeze(0).unsqueeze(1).cpu().detach().numpy()), axis=0)
+                    trace.record(selected_sample.unsqueeze(0), selected_label.unsqueeze(0).unsqueeze(1))
                 else:
-                    if t == 1:
-                        selected_samples = best_sample.cpu().detach().numpy()  # [np.newaxis, :]
-                        selected_labels = best_label.unsqueeze(1).cpu().detach().numpy()  # [np.newaxis, :]
-                    else:
-                        selected_samples = np.concatenate((selected_samples, best_sample.cpu().detach().numpy()), axis=0)
-                        selected_labels = np.concatenate((selected_labels, best_label.unsqueeze(1).cpu().detach().numpy()), axis=0)
+                    trace.record(best_sample, best_label.unsqueeze(1))
 
                 model.update(best_sample, best_label.unsqueeze(1))
 
-            model.eval()
-            test = model(self.X_test.cuda()).cpu()
+            evaluator(model, t)
 
-            # a, b = plot_classifier(model, X.max(axis=0), X.min(axis=0))
-            # a_baseline.append(a)
-            # b_baseline.append(b)
-
-            if self.opt.data_mode == "mnist" or self.opt.data_mode == "gaussian" or self.opt.data_mode == "moon" or self.opt.data_mode == "linearly_seperable" or self.opt.data_mode == "covid":
-                tmp = torch.where(test > 0.5, torch.ones(1), torch.zeros(1))
-                nb_correct = torch.where(tmp.view(-1) == self.Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-            elif self.opt.data_mode == "cifar10":
-                tmp = torch.max(test, dim=1).indices
-                nb_correct = torch.where(tmp == self.Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-            else:
-                sys.exit()
-            acc_base = nb_correct / self.X_test.size(0)
-            res_baseline.append(acc_base)
-
-            w = model.lin.weight
-            w = w / torch.norm(w)
-            diff = torch.linalg.norm(w_star - w, ord=2) ** 2
-            w_diff_baseline.append(diff.detach().clone().cpu())
-
-            print("acc", acc_base)
-
-            # sys.stdout.write("\r" + str(t) + "/" + str(self.opt.n_iter) + ", idx=" + str(i) + " " * 100)
-            # sys.stdout.flush()
-
-            print("Base line trained\n")
-
-            with open(logname, 'a') as logfile:
-                logwriter = csv.writer(logfile, delimiter=',')
-                logwriter.writerow([t, acc_base, diff.item()])
-
-        return selected_samples, selected_labels
+        evaluator.flush()
+        trace.save()
+        return trace.samples, trace.labels
 
     def data_sampler(self, X, Y, i):
         i_min = i * self.opt.batch_size
@@ -5,6 +5,8 @@ import os
 import csv
 import sys
 from tqdm import tqdm
+from utils.trace import trace_recorder
+from utils.evaluation import Evaluator
 
 
 def plot_classifier(model, max, min):
@@ -44,13 +46,13 @@ class SGDTrainer(nn.Module):
                 logwriter = csv.writer(logfile, delimiter=',')
                 logwriter.writerow(['iter', 'test acc', 'w diff'])
 
-        res_sgd = []
         a_example = []
         b_example = []
-        w_diff_sgd = []
 
         nb_batch = int(self.opt.nb_train / self.opt.batch_size)
 
+        evaluator = Evaluator(self.opt, self.X_test, self.Y_test, w_star, logname)
+        trace = trace_recorder(self.opt, self.opt.n_iter - 1, self.opt.experiment)
         for idx in tqdm(range(self.opt.n_iter)):
             if idx != 0:
                 i = torch.randint(0, nb_batch, size=(1,)).item()
@@ -58,51 +60,17 @@ class SGDTrainer(nn.Module):
 
                 if self.data is not None:
                     random_sample, random_label = self.data[i]
-                    if idx == 1:
-                        random_samples = random_sample.unsqueeze(0).cpu().detach().numpy()  # [np.newaxis, :]
-                        random_labels = random_label.unsqueeze(0).unsqueeze(1).cpu().detach().numpy()  # [np.newaxis, :]
-                    else:
-                        random_samples = np.concatenate((random_samples, random_sample.unsqueeze(0).cpu().detach().numpy()), axis=0)
-                        random_labels = np.concatenate((random_labels, random_label.unsqueeze(0).unsqueeze(1).cpu().detach().numpy()), axis=0)
+                    trace.record(random_sample.unsqueeze(0), random_label.unsqueeze(0).unsqueeze(1))
                 else:
-                    if idx == 1:
-                        random_samples = sample.cpu().detach().numpy()  # [np.newaxis, :]
-                        random_labels = label.unsqueeze(1).cpu().detach().numpy()  # [np.newaxis, :]
-                    else:
-                        random_samples = np.concatenate((random_samples, sample.cpu().detach().numpy()), axis=0)
-                        random_labels = np.concatenate((random_labels, label.unsqueeze(1).cpu().detach().numpy()), axis=0)
+                    trace.record(sample, label.unsqueeze(1))
 
                 model.update(sample, label.unsqueeze(1))
 
-            model.eval()
-            test = model(self.X_test.cuda()).cpu()
+            evaluator(model, idx)
 
-            # a, b = plot_classifier(model, self.X_train.max(axis=0), self.X_train.min(axis=0))
-            # a_example.append(a)
-            # b_example.append(b)
-
-            if self.opt.data_mode == "mnist" or self.opt.data_mode == "gaussian" or self.opt.data_mode == "moon" or self.opt.data_mode == "covid":
-                tmp = torch.where(test > 0.5, torch.ones(1), torch.zeros(1))
-                nb_correct = torch.where(tmp.view(-1) == self.Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-            elif self.opt.data_mode == "cifar10":
-                tmp = torch.max(test, dim=1).indices
-                nb_correct = torch.where(tmp == self.Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-            else:
-                sys.exit()
-
-            acc = nb_correct / self.X_test.size(0)
-            res_sgd.append(acc)
-
-            w = model.lin.weight
-            w = w / torch.norm(w)
-            diff = torch.linalg.norm(w_star - w, ord=2) ** 2
-            w_diff_sgd.append(diff.detach().clone().cpu())
-
-            with open(logname, 'a') as logfile:
-                logwriter = csv.writer(logfile, delimiter=',')
-                logwriter.writerow([idx, acc, diff.item()])
-
-        return random_samples, random_labels
+        evaluator.flush()
+        trace.save()
+        return trace.samples, trace.labels
 
     def data_sampler(self, X, Y, i):
         i_min = i * self.opt.batch_size
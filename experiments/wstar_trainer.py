@@ -6,6 +6,7 @@ import csv
 import sys
 from tqdm import tqdm
 import matplotlib as plt
+from utils.results import results_writer, flush_results
 
 
 def plot_classifier(model, max, min):
@@ -39,6 +40,8 @@ class WSTARTrainer(nn.Module):
         self.opt.experiment = "WSTAR"
         print("Start training {} ...".format(self.opt.experiment))
         logname = os.path.join(self.opt.log_path, 'results' + '_' + self.opt.experiment + '_' + str(self.opt.seed) + '.csv')
+        # rows still buffered from an earlier run of this stage go to the old file
+        flush_results(logname)
         if os.path.exists(logname):
             os.remove(logname)
         if not os.path.exists(logname):
@@ -78,11 +81,7 @@ class WSTARTrainer(nn.Module):
             if acc > 0.6 and n == 0:
                 sys.exit()
 
-            with open(logname, 'a') as logfile:
-                logwriter = csv.writer(logfile, delimiter=',')
-                logwriter.writerow([n, acc])
-
-        torch.save(model.state_dict(), 'teacher_wstar.pth')
+            results_writer(logname).writerow([n, acc])
 
         if visualize == True:
             fig = plt.figure()
@@ -50,6 +50,8 @@ from torch.autograd import Variable
 import torchvision
 import torchvision.transforms as transforms
 
+from utils.augment import BatchAugment, mixup_loss, mixup_correct
+
 """##  Set random seed
 
 Executing `set_seed(seed=seed)` you are setting the seed
@@ -153,53 +155,10 @@ torchvision_transforms = False  # True/False if you want use torchvision augment
 ## Cutout
 Randomly mask out one or more patches from an image.
 
-`Cutout` Augmentation class
+Cutout (code from: https://github.com/uoguelph-mlrg/Cutout) is `batch_augment.cutout()`, which cuts n_holes
+squares of side length out of every image of a batch at once, in the training loop.
 """
 
-# @markdown `Cutout` Augmentation class
-
-class Cutout(object):
-  """
-  code from: https://github.com/uoguelph-mlrg/Cutout
-
-  Randomly mask out one or more patches from an image.
-  Args:
-      n_holes (int): Number of patches to cut out of each image.
-      length (int): The length (in pixels) of each square patch.
-  """
-  def __init__(self, n_holes, length):
-    self.n_holes = n_holes
-    self.length = length
-
-  def __call__(self, img):
-    """
-    Args:
-        img (Tensor): Tensor image of size (C, H, W).
-    Returns:
-        Tensor: Image with n_holes of dimension length x length cut out of it.
-    """
-    h = img.size(1)
-    w = img.size(2)
-
-    mask = np.ones((h, w), np.float32)
-
-    for n in range(self.n_holes):
-      y = np.random.randint(h)
-      x = np.random.randint(w)
-
-      y1 = np.clip(y - self.length // 2, 0, h)
-      y2 = np.clip(y + self.length // 2, 0, h)
-      x1 = np.clip(x - self.length // 2, 0, w)
-      x2 = np.clip(x + self.length // 2, 0, w)
-
-      mask[y1: y2, x1: x2] = 0.
-
-    mask = torch.from_numpy(mask)
-    mask = mask.expand_as(img)
-    img = img * mask
-
-    return img
-
 """## Mixup
 
 Mixup is a data augmentation technique that combines pairs of examples via a convex combination of the images and the labels. Given images $x_i$ and $x_j$ with labels $y_i$ and $y_j$, respectively, and $\lambda \in [0, 1]$, mixup creates a new image $\hat{x}$ with label $\hat{y}$ the following way:
@@ -217,23 +176,11 @@ You may check the [original paper](https://arxiv.org/abs/1710.09412) and [code r
 # @markdown `mixup_data` Augmentation function
 
 def mixup_data(x, y, alpha=1.0, use_cuda=True):
-  '''Compute the mixup data. Return mixed inputs, pairs of targets, and lambda
+  '''Compute the mixup data. Return mixed inputs, pairs of targets, and one lambda per sample
       - https://github.com/hongyi-zhang/mixup
+      The lambdas and the permutation of the batch are drawn in one call by batch_augment, on the device of x.
   '''
-  if alpha > 0.:
-    lam = np.random.beta(alpha, alpha)
-  else:
-    lam = 1.
-  batch_size = x.size()[0]
-  if use_cuda:
-    index = torch.randperm(batch_size).cuda()
-  else:
-    index = torch.randperm(batch_size)
-
-  mixed_x = lam * x + (1 - lam) * x[index, :]
-  y_a, y_b = y, y[index]
-
-  return mixed_x, y_a, y_b, lam
+  return batch_augment.mixup(x, y, alpha)
 
 """---
 # Data
@@ -268,13 +215,15 @@ std = (0.3081,)
 
 # torchvision transforms
 transform_train = transforms.Compose([])
-if torchvision_transforms:
-  transform_train.transforms.append(transforms.RandomCrop(32, padding=4))
-  transform_train.transforms.append(transforms.RandomHorizontalFlip())
-
 transform_train.transforms.append(transforms.ToTensor())
 transform_train.transforms.append(transforms.Normalize(mean, std))
 
+# random crops, flips and cutout are applied to whole normalized batches in the training loop,
+# the padding of the crops is the normalized black pixel as in transforms.RandomCrop
+batch_augment = BatchAugment(crop_padding=4 if torchvision_transforms else 0, flip=torchvision_transforms,
+                             n_holes=n_holes if cutout else 0, cutout_length=length,
+                             fill=[-m / s for m, s in zip(mean, std)], seed=2021)
+
 transform_test = transforms.Compose([
     transforms.ToTensor(),
     transforms.Normalize(mean, std),
@@ -383,13 +332,9 @@ if mixup:
                                       alpha=alpha, use_cuda=use_cuda)
   plot_mixed_images(mixed_x[:4])
 
-# Mixup Visualization
-if cutout:
-  plot_mixed_images(batch_X[:4])
-
-# Torchvision Visualization
-if torchvision_transforms:
-  plot_mixed_images(batch_X[:4])
+# Cutout and Torchvision Visualization
+if cutout or torchvision_transforms:
+  plot_mixed_images(batch_augment(batch_X[:4]))
 
 """---
 # Model
@@ -575,14 +520,13 @@ def train_mixup(epoch, alpha, use_cuda=False):
   for batch_idx, (inputs, targets) in enumerate(trainloader):
     if use_cuda:
       inputs, targets = inputs.cuda(), targets.cuda()
+    inputs = batch_augment(inputs)
     optimizer_mixup.zero_grad()
     if mixup:
-      # generate mixed inputs, two one-hot label vectors and mixing coefficient
+      # generate mixed inputs, two one-hot label vectors and one mixing coefficient per sample
       inputs, targets_a, targets_b, lam = mixup_data(inputs, targets, alpha, use_cuda)
-      inputs, targets_a, targets_b = Variable(inputs), Variable(targets_a), Variable(targets_b)
       outputs = net_mixup(inputs)
-      loss_func = mixup_criterion(targets_a.long(), targets_b.long(), lam)
-      loss_mixup = loss_func(criterion, outputs)
+      loss_mixup = mixup_loss(outputs, targets_a.long(), targets_b.long(), lam)
     else:
       inputs, targets = Variable(inputs), Variable(targets)
       outputs = net_mixup(inputs)
@@ -595,7 +539,7 @@ def train_mixup(epoch, alpha, use_cuda=False):
     _, predicted = torch.max(outputs.data, 1)
     total_mixup += targets.size(0)
     if mixup:
-      correct_mixup += lam * predicted.eq(targets_a.data).cpu().sum() + (1 - lam) * predicted.eq(targets_b.data).cpu().sum()
+      correct_mixup += mixup_correct(predicted, targets_a.data, targets_b.data, lam)
     else:
       correct_mixup += predicted.eq(targets.data).cpu().sum()
 
@@ -614,6 +558,7 @@ def train_baseline(epoch, alpha, use_cuda=False):
   for batch_idx, (inputs, targets) in enumerate(trainloader):
     if use_cuda:
       inputs, targets = inputs.cuda(), targets.cuda()
+    inputs = batch_augment(inputs)
 
     optimizer_baseline.zero_grad()
     outputs = net_baseline(inputs)
@@ -22,6 +22,8 @@ import os
 
 import copy
 
+from utils.run import RunContext
+
 
 def approx_fprime(xk, f, epsilon, args=(), f0=None):
     """
@@ -246,7 +248,7 @@ class UnrolledBlackBoxOptimizer(nn.Module):
         with torch.no_grad():
             # for param1 in self.generator.parameters():
             #    param1 = weight
-            self.fc.load_state_dict(torch.load(os.path.join(self.opt.log_path, 'tmp_fc.pth')))
+            self.fc.load_state_dict(RunContext(self.opt).load('tmp_fc.pth'))
             # self.teacher.load_state_dict(torch.load('teacher_wstar.pth'))
             # self.student.load_state_dict(torch.load('teacher_w0.pth'))
             # for param1 in self.student.parameters():
@@ -393,7 +395,7 @@ class UnrolledBlackBoxOptimizer(nn.Module):
         with torch.no_grad():
             # for param1 in self.generator.parameters():
             #    param1 = weight
-            self.fc.load_state_dict(torch.load(os.path.join(self.opt.log_path, 'tmp_fc.pth')))
+            self.fc.load_state_dict(RunContext(self.opt).load('tmp_fc.pth'))
             # self.teacher.load_state_dict(torch.load('teacher_wstar.pth'))
             # self.student.load_state_dict(torch.load('teacher_w0.pth'))
             # for param1 in self.student.parameters():
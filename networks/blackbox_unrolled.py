@@ -12,6 +12,7 @@ from torch.autograd import Variable
 import numpy as np
 
 from tqdm import tqdm
+from utils.cache import load_teacher
 
 
 def mixup_data(gt_x, generated_x, gt_y, generated_y, alpha=1.0, use_cuda=True):
@@ -341,8 +342,8 @@ class UnrolledBlackBoxOptimizer_moon(nn.Module):
             # for param2 in self.teacher.parameters():
             #     param2 = w_star
             self.generator.load_state_dict(weight)
-            self.teacher.load_state_dict(torch.load('teacher_wstar.pth'))
-            self.student.load_state_dict(torch.load('teacher_w0.pth'))
+            self.teacher.load_state_dict(load_teacher(self.opt.teacher_wstar_path))
+            self.student.load_state_dict(load_teacher(self.opt.teacher_w0_path))
 
         loss_stu = 0
         w_loss = 0
@@ -448,8 +449,8 @@ class UnrolledBlackBoxOptimizer(nn.Module):
             # for param1 in self.generator.parameters():
             #    param1 = weight
             self.generator.load_state_dict(weight)
-            self.teacher.load_state_dict(torch.load('teacher_wstar.pth'))
-            self.student.load_state_dict(torch.load('teacher_w0.pth'))
+            self.teacher.load_state_dict(load_teacher(self.opt.teacher_wstar_path))
+            self.student.load_state_dict(load_teacher(self.opt.teacher_w0_path))
             # for param1 in self.student.parameters():
             #     param1 = w_init
             # for param2 in self.teacher.parameters():
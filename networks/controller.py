@@ -2,6 +2,7 @@ import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.distributions import Categorical
 
 
 class Agent(nn.Module):
@@ -28,8 +29,16 @@ class Agent(nn.Module):
         self.hidden = self.init_hidden()
 
     def forward(self, input):
+        """
+            Unroll the controller for num_steps
+            input: (B, input_size), one row per independent agent
+            Returns:
+                logits of every step, (num_steps, B, num_filter_option) or (num_steps, num_filter_option) for B = 1
+        """
         outputs = []
         h_t, c_t = self.hidden
+        if input.size(0) != h_t.size(0):
+            h_t, c_t = self.init_hidden(input.size(0))
 
         for i in range(self.num_steps):
             # input_data = self.embedding(step_data)
@@ -44,9 +53,28 @@ class Agent(nn.Module):
 
         return outputs
 
-    def init_hidden(self):
-        h_t = torch.zeros(1, self.nhid, dtype=torch.float, device=self.DEVICE)
-        c_t = torch.zeros(1, self.nhid, dtype=torch.float, device=self.DEVICE)
+    def sample(self, input, n_samples=1):
+        """
+            Sample n_samples action sequences for every agent with a single unroll
+            input: (B, input_size)
+            Returns:
+                actions: (B, n_samples, num_steps)
+                log_probs: log-prob of every sequence summed over the steps, (B, n_samples)
+                logits: (num_steps, B, num_filter_option)
+        """
+        logits = self.forward(input)
+        if logits.dim() == 2:
+            logits = logits.unsqueeze(1)
+
+        m = Categorical(logits=logits)
+        actions = m.sample((n_samples,))
+        log_probs = m.log_prob(actions).sum(dim=1)
+
+        return actions.permute(2, 0, 1), log_probs.t(), logits
+
+    def init_hidden(self, batch_size=1):
+        h_t = torch.zeros(batch_size, self.nhid, dtype=torch.float, device=self.DEVICE)
+        c_t = torch.zeros(batch_size, self.nhid, dtype=torch.float, device=self.DEVICE)
 
         return (h_t, c_t)
 
@@ -0,0 +1,106 @@
+import numpy as np
+import torch
+
+
+class EpisodeBuffer:
+    """Fixed-size storage for one policy gradient episode.
+
+    The length of an episode is known in advance (n_pg_epochs * len(train_loader)),
+    so the per-step states, actions, rewards, logits and log-probs are written into
+    preallocated slots instead of being grown with torch.cat on every step.
+
+    The logits and log-probs returned by the policy carry the autograd graph, writing
+    them into a preallocated tensor in place would chain one CopySlices node per step
+    (and clone the full buffer gradient for each of them in backward). They are kept
+    as a list of per-step tensors and stacked once when the episode is consumed by
+    calculate_loss, detached copies are written into the preallocated slots for analysis.
+    """
+    def __init__(self, n_steps, state_dim, action_space, device='cpu'):
+        self.n_steps = n_steps
+        self.state_dim = state_dim
+        self.action_space = action_space
+        self.device = device
+
+        self._states = torch.zeros(n_steps, state_dim, dtype=torch.float, device=device)
+        self._actions = torch.zeros(n_steps, dtype=torch.long, device=device)
+        self._rewards = torch.zeros(n_steps, dtype=torch.float, device=device)
+        self._logits = torch.zeros(n_steps, action_space, dtype=torch.float, device=device)
+        self._log_probs = torch.zeros(n_steps, dtype=torch.float, device=device)
+
+        self._logits_graph = []
+        self._log_probs_graph = []
+
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def reset(self):
+        self._logits_graph = []
+        self._log_probs_graph = []
+        self._rewards.zero_()
+        self.size = 0
+
+    def push(self, state, action_index, logits, log_probs):
+        """Store one step of the episode
+        state: model features the action was selected from, shape (1, state_dim)
+        action_index: index of the sampled action, shape (1, 1)
+        logits: policy output for this step, shape (1, action_space)
+        log_probs: log-prob of the sampled action, shape (1,) or the masked log_softmax of
+            select_action, shape (1, action_space), that sums to it
+        """
+        if self.size >= self.n_steps:
+            raise IndexError("Episode buffer is full ({} steps)".format(self.n_steps))
+
+        i = self.size
+        self._states[i] = torch.as_tensor(state, dtype=torch.float).view(-1)
+        self._actions[i] = action_index.view(-1)[0]
+        self._logits[i] = logits.detach().view(-1)
+        self._log_probs[i] = log_probs.detach().sum()
+
+        self._logits_graph.append(logits)
+        self._log_probs_graph.append(log_probs)
+
+        self.size += 1
+
+    def set_reward(self, reward, step=None):
+        """Set the reward of a step, defaults to the last pushed one"""
+        if step is None:
+            step = self.size - 1
+        self._rewards[step] = reward
+
+    @property
+    def states(self):
+        return self._states[:self.size]
+
+    @property
+    def actions(self):
+        return self._actions[:self.size]
+
+    @property
+    def rewards(self):
+        return self._rewards[:self.size]
+
+    def logits(self):
+        """Logits of every step with the autograd graph, shape (size, action_space)"""
+        if self.size == 0:
+            return self._logits[:0]
+        return torch.cat(self._logits_graph, dim=0)
+
+    def log_probs(self):
+        """Log-probs of every step with the autograd graph, shape (size,)"""
+        if self.size == 0:
+            return self._log_probs[:0]
+        return torch.cat(self._log_probs_graph, dim=0)
+
+    def to_numpy(self):
+        return {
+            'states': self.states.cpu().numpy(),
+            'actions': self.actions.cpu().numpy(),
+            'rewards': self.rewards.cpu().numpy(),
+            'logits': self._logits[:self.size].cpu().numpy(),
+            'log_probs': self._log_probs[:self.size].cpu().numpy(),
+        }
+
+    def save(self, path):
+        np.savez(path, **self.to_numpy())
@@ -0,0 +1,264 @@
+import copy
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+import torch.multiprocessing as mp
+from torch.nn.functional import one_hot, log_softmax
+
+try:
+    from torch.func import functional_call, stack_module_state, vmap
+    has_vmap = True
+except ImportError:
+    has_vmap = False
+
+
+def materialize_loader(data_loader):
+    """Collect a data loader into two tensors placed in shared memory"""
+    inputs_all = []
+    targets_all = []
+    for (inputs, targets) in data_loader:
+        inputs_all.append(inputs)
+        targets_all.append(targets.long())
+    X = torch.cat(inputs_all, dim=0).share_memory_()
+    Y = torch.cat(targets_all, dim=0).share_memory_()
+    return X, Y
+
+
+def is_vmappable(model, max_params=1e6):
+    """Small students without batch norm can be trained as one vmap-batched functional model"""
+    if not has_vmap:
+        return False
+    for m in model.modules():
+        if isinstance(m, nn.modules.batchnorm._BatchNorm):
+            return False
+    return sum(p.numel() for p in model.parameters()) <= max_params
+
+
+class BatchSampler:
+    """Draws the batch indices of one environment, reshuffled every epoch (drop_last)"""
+    def __init__(self, n_samples, batch_size, generator):
+        self.n_samples = n_samples
+        self.batch_size = batch_size
+        self.generator = generator
+        self.steps_per_epoch = n_samples // batch_size
+        self.reset()
+
+    def reset(self):
+        self.perm = torch.randperm(self.n_samples, generator=self.generator)
+        self.cursor = 0
+
+    def next_indices(self):
+        if self.cursor == self.steps_per_epoch:
+            self.reset()
+        i_min = self.cursor * self.batch_size
+        i_max = (self.cursor + 1) * self.batch_size
+        self.cursor += 1
+        return self.perm[i_min:i_max]
+
+
+def mixup_loss(outputs, targets_a, targets_b, action, n_classes):
+    """Same loss as play_episode: action * CE(outputs, y_a) + (1 - action) * CE(outputs, y_b), batch mean"""
+    log_p = log_softmax(outputs, dim=-1)
+    loss_a = -torch.sum(one_hot(targets_a, n_classes).float() * log_p, dim=-1).mean(dim=-1)
+    loss_b = -torch.sum(one_hot(targets_b, n_classes).float() * log_p, dim=-1).mean(dim=-1)
+    return action * loss_a + (1 - action) * loss_b
+
+
+class VmapEnvironments:
+    """B copies of a small student trained in lockstep as one vmap-batched functional model.
+
+    The parameters of all copies are stacked along a leading env dimension, the summed loss
+    gives every copy its own gradient and Adam being elementwise, a single optimizer over
+    the stacked parameters is exactly B independent Adam optimizers.
+    """
+    def __init__(self, opt, student, X, Y, X_val, Y_val, n_envs, device):
+        self.opt = opt
+        self.n_envs = n_envs
+        self.device = device
+
+        self.X, self.Y = X, Y
+        self.X_val, self.Y_val = X_val, Y_val
+
+        self.student = copy.deepcopy(student).to(device)
+        self.base = copy.deepcopy(student).to('meta')
+
+        self.generators = [torch.Generator().manual_seed(self.opt.seed + rank) for rank in range(n_envs)]
+        self.samplers = [BatchSampler(len(X), self.opt.batch_size, g) for g in self.generators]
+        self.steps_per_epoch = self.samplers[0].steps_per_epoch
+
+        self.params, self.buffers = None, None
+        self.optimizer = None
+
+    def _forward(self, params, buffers, x):
+        return functional_call(self.base, (params, buffers), (x,))
+
+    def reset(self, state_dict):
+        self.student.load_state_dict(state_dict)
+        self.student.train()
+        self.params, self.buffers = stack_module_state([self.student] * self.n_envs)
+        self.optimizer = optim.Adam(self.params.values(), lr=self.opt.lr)
+        for sampler in self.samplers:
+            sampler.reset()
+
+    def step(self, actions):
+        idx = torch.stack([sampler.next_indices() for sampler in self.samplers], dim=0)
+        perm = torch.stack([torch.randperm(idx.shape[1], generator=g) for g in self.generators], dim=0)
+
+        inputs = self.X[idx].to(self.device)
+        targets = self.Y[idx].to(self.device)
+        env_idx = torch.arange(self.n_envs, device=self.device).unsqueeze(1)
+        perm = perm.to(self.device)
+        inputs_b, targets_b = inputs[env_idx, perm], targets[env_idx, perm]
+
+        action = actions.to(self.device).view(-1, *([1] * (inputs.dim() - 1)))
+        mixed_x = action * inputs + (1 - action) * inputs_b
+
+        outputs = vmap(self._forward, randomness='different')(self.params, self.buffers, mixed_x)
+        loss = mixup_loss(outputs, targets, targets_b, actions.to(self.device), self.opt.n_classes)
+
+        self.optimizer.zero_grad()
+        loss.sum().backward()
+        self.optimizer.step()
+
+        return loss.detach()
+
+    def val(self):
+        """Accuracy and loss of every copy on the validation set, same reduction as PolicyGradient.val"""
+        correct = torch.zeros(self.n_envs, device=self.device)
+        test_loss = torch.zeros(self.n_envs, device=self.device)
+        n_batches = 0
+        forward = vmap(self._forward, in_dims=(0, 0, None), randomness='different')
+        with torch.no_grad():
+            for i_min in range(0, len(self.X_val), self.opt.batch_size):
+                inputs = self.X_val[i_min:i_min + self.opt.batch_size].to(self.device)
+                targets = self.Y_val[i_min:i_min + self.opt.batch_size].to(self.device)
+
+                outputs = forward(self.params, self.buffers, inputs)
+                correct += (outputs.argmax(dim=-1) == targets).sum(dim=-1)
+                test_loss += nn.functional.cross_entropy(outputs.transpose(1, 2), targets.unsqueeze(0).expand(self.n_envs, -1), reduction='none').mean(dim=-1)
+                n_batches += 1
+
+        acc = 100 * correct / len(self.X_val)
+        return acc.cpu(), (test_loss / n_batches).cpu()
+
+    def close(self):
+        pass
+
+
+def _env_worker(rank, opt, student, X, Y, X_val, Y_val, device, conn):
+    torch.set_num_threads(1)
+
+    student = student.to(device)
+    generator = torch.Generator().manual_seed(opt.seed + rank)
+    sampler = BatchSampler(len(X), opt.batch_size, generator)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = None
+
+    while True:
+        cmd, arg = conn.recv()
+        if cmd == 'reset':
+            student.load_state_dict(arg)
+            student.train()
+            optimizer = optim.Adam(student.parameters(), lr=opt.lr)
+            sampler.reset()
+            conn.send(None)
+
+        elif cmd == 'step':
+            idx = sampler.next_indices()
+            perm = torch.randperm(len(idx), generator=generator)
+            inputs, targets = X[idx].to(device), Y[idx].to(device)
+
+            mixed_x = arg * inputs + (1 - arg) * inputs[perm.to(device)]
+            outputs = student(mixed_x)
+            loss = mixup_loss(outputs, targets, targets[perm.to(device)], arg, opt.n_classes)
+
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            conn.send(loss.item())
+
+        elif cmd == 'val':
+            correct = 0
+            test_loss = 0
+            n_batches = 0
+            with torch.no_grad():
+                for i_min in range(0, len(X_val), opt.batch_size):
+                    inputs = X_val[i_min:i_min + opt.batch_size].to(device)
+                    targets = Y_val[i_min:i_min + opt.batch_size].to(device)
+                    outputs = student(inputs)
+                    correct += (outputs.argmax(dim=1) == targets).sum().item()
+                    test_loss += criterion(outputs, targets).item()
+                    n_batches += 1
+            conn.send((100 * correct / len(X_val), test_loss / n_batches))
+
+        elif cmd == 'close':
+            conn.close()
+            break
+
+
+class ProcessEnvironments:
+    """B copies of a larger student, one worker process each.
+
+    The training and validation tensors live in shared memory, so the workers only receive
+    the mixup action of every step and send back the training loss.
+    """
+    def __init__(self, opt, student, X, Y, X_val, Y_val, n_envs, device):
+        self.opt = opt
+        self.n_envs = n_envs
+        self.device = device
+        self.steps_per_epoch = len(X) // self.opt.batch_size
+
+        ctx = mp.get_context('spawn')
+        self.conns = []
+        self.workers = []
+        student = copy.deepcopy(student).cpu()
+        for rank in range(n_envs):
+            parent_conn, child_conn = ctx.Pipe()
+            worker = ctx.Process(target=_env_worker, args=(rank, opt, student, X, Y, X_val, Y_val, device, child_conn), daemon=True)
+            worker.start()
+            self.conns.append(parent_conn)
+            self.workers.append(worker)
+
+    def _broadcast(self, cmd, args):
+        for conn, arg in zip(self.conns, args):
+            conn.send((cmd, arg))
+        return [conn.recv() for conn in self.conns]
+
+    def reset(self, state_dict):
+        state_dict = {k: v.cpu() for k, v in state_dict.items()}
+        self._broadcast('reset', [state_dict] * self.n_envs)
+
+    def step(self, actions):
+        loss = self._broadcast('step', actions.cpu().tolist())
+        return torch.tensor(loss)
+
+    def val(self):
+        results = self._broadcast('val', [None] * self.n_envs)
+        acc, test_loss = zip(*results)
+        return torch.tensor(acc), torch.tensor(test_loss)
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(('close', None))
+        for worker in self.workers:
+            worker.join()
+
+
+def make_environments(opt, student, train_loader, val_loader, n_envs, device, backend='auto'):
+    """Create the parallel environments used by PolicyGradient.play_episodes
+
+    backend: 'vmap', 'process' or 'auto' (vmap for small students without batch norm)
+    """
+    X, Y = materialize_loader(train_loader)
+    X_val, Y_val = materialize_loader(val_loader)
+
+    if backend == 'auto':
+        backend = 'vmap' if is_vmappable(student) else 'process'
+
+    if backend == 'vmap':
+        return VmapEnvironments(opt, student, X, Y, X_val, Y_val, n_envs, device)
+    elif backend == 'process':
+        return ProcessEnvironments(opt, student, X, Y, X_val, Y_val, n_envs, device)
+    else:
+        raise ValueError("Unknown environment backend: {}".format(backend))
@@ -7,6 +7,11 @@ from torch.nn.functional import one_hot, log_softmax, softmax, normalize
 from torch.distributions import Categorical
 from torch.utils.tensorboard import SummaryWriter
 from .controller import Agent, Policy, Generator
+from .episode_buffer import EpisodeBuffer
+from .parallel_envs import make_environments
+from .trajectory_store import TrajectoryStore
+from utils.validation import validation_estimator
+from datasets.class_index import ClassIndex, query_set
 from collections import deque
 # from model import NASModel
 import networks
@@ -77,47 +82,43 @@ class PolicyGradient:
         self.init_feat_sim = 0
         self.query_set_1, self.query_set_2 = self.get_query_set()
 
+        # subsampled validation for the in-episode state features, full passes at epoch end, built by the
+        # first play_episode only (the parallel environments validate their own students)
+        self.val_estimator = None
+
         self.best_final_acc = 0
 
+        # play n_envs episodes at once and update the policy with all their returns
+        self.n_envs = getattr(self.opt, 'n_envs', 1)
+        self.envs = None
+        if self.n_envs > 1:
+            self.envs = make_environments(self.opt, self.student, self.train_loader, self.val_loader, self.n_envs, self.DEVICE,
+                                          backend=getattr(self.opt, 'env_backend', 'auto'))
+
+        # keep the played trajectories and reuse them with clipped importance weights
+        self.replay_ratio = getattr(self.opt, 'replay_ratio', 0)
+        self.trajectory_store = None
+        if self.replay_ratio > 0:
+            episode_length = self.opt.n_pg_epochs * len(self.train_loader)
+            self.trajectory_store = TrajectoryStore(os.path.join(self.opt.log_path, 'trajectories'),
+                                                    episode_length * (self.opt.replay_window + self.n_envs), self.INPUT_SIZE)
+
     def get_activation(self, name):
         def hook(model, input, output):
             activation[name] = output.detach()
         return hook
 
     def get_query_set(self):
-        """decrease the learning rate at 100 and 150 epoch"""
+        """two examples of every class of the validation set, looked up in the per-class index"""
         query_set_1 = torch.empty(self.opt.n_query_classes, self.opt.channels, self.opt.img_size, self.opt.img_size)
         query_set_2 = torch.empty(self.opt.n_query_classes, self.opt.channels, self.opt.img_size, self.opt.img_size)
-        val_iter = iter(self.val_loader)
-        for i in tqdm(range(self.opt.n_classes)):
-            while True:
-                try:
-                    (inputs, targets) = val_iter.next()
-                except:
-                    val_iter = iter(self.val_loader)
-                    (inputs, targets) = val_iter.next()
-                idx = ((targets == i).nonzero(as_tuple=True)[0])
-                if idx.nelement() == 0:
-                    pass
-                else:
-                    idx = idx[0]
-                    query_set_1[i, :] = inputs[idx, :]
-                    break
 
-        for i in tqdm(range(self.opt.n_classes)):
-            while True:
-                try:
-                    (inputs, targets) = val_iter.next()
-                except:
-                    val_iter = iter(self.val_loader)
-                    (inputs, targets) = val_iter.next()
-                idx = ((targets == i).nonzero(as_tuple=True)[0])
-                if idx.nelement() == 0:
-                    pass
-                else:
-                    idx = idx[0]
-                    query_set_2[i, :] = inputs[idx, :]
-                    break
+        self.val_class_index = ClassIndex.from_dataset(self.val_loader.dataset)
+        # drawn from a generator of their own, the global numpy stream stays the one of the run
+        self.query_rng = np.random.RandomState(self.opt.seed)
+        samples = query_set(self.val_loader.dataset, self.val_class_index, classes=range(self.opt.n_classes), k=2, rng=self.query_rng)
+        query_set_1[:self.opt.n_classes] = samples[:, 0]
+        query_set_2[:self.opt.n_classes] = samples[:, 1]
 
         return query_set_1.cuda(), query_set_2.cuda()
 
@@ -176,9 +177,37 @@ class PolicyGradient:
         # action_space = torch.tensor([[0.2, 0.3, 1.0], [0.2, 0.3, 1.0], [0.2, 0.3, 1.0], [0.2, 0.3, 1.0]], device=self.DEVICE)
 
         action = torch.gather(action_space, 1, action_index).squeeze(1)
-        return action.item(), episode_logits, episode_log_probs
+        return action.item(), action_index, episode_logits, episode_log_probs
+
+    def select_actions(self, states):
+        """Batched select_action, one row of states per environment"""
+        episode_logits = self.agent(states)
+
+        action_index = Categorical(logits=episode_logits).sample().unsqueeze(1)
+
+        mask = one_hot(action_index.squeeze(1), num_classes=self.ACTION_SPACE)
+
+        episode_log_probs = torch.sum(mask.float() * log_softmax(episode_logits, dim=1), dim=1)
+
+        action_space = torch.tensor([0, 0.5, 1.0], device=self.DEVICE)
+        actions = action_space[action_index.squeeze(1)]
+        return actions, action_index, episode_logits, episode_log_probs
+
+    def finish_episode(self, episode_log_probs=None, episode_logits=None, returns=None):
+        """
+            Update the policy
+            With the episodes of the parallel environments (lists of per-episode log-probs and logits and
+            their returns), all of them are consumed by a single policy update.
+        """
+        if returns is not None:
+            weighted_log_probs = torch.stack([torch.sum(log_probs * R) for log_probs, R in zip(episode_log_probs, returns)])
+            loss, entropy = self.calculate_loss(epoch_logits=torch.cat(episode_logits, dim=0),
+                                                weighted_log_probs=weighted_log_probs)
+            self.adam.zero_grad()
+            loss.backward()
+            self.adam.step()
+            return entropy
 
-    def finish_episode(self):
         optimizer = optim.Adam(self.agent.parameters(), lr=1e-2)
         eps = np.finfo(np.float32).eps.item()
         R = 0
@@ -200,6 +229,48 @@ class PolicyGradient:
         del self.agent.rewards[:]
         del self.agent.saved_log_probs[:]
 
+    def replay_log_probs(self, states, actions):
+        """Log-probs of the actions in eval mode, without the dropout of the policy, so that the
+        importance ratio of replay_update is 1 for a policy that has not changed"""
+        self.agent.eval()
+        episode_logits = self.agent(states)
+        self.agent.train()
+        return episode_logits, log_softmax(episode_logits, dim=1).gather(1, actions.unsqueeze(1)).squeeze(1)
+
+    def store_episode(self, episode_buffer, episode_return, i_episode):
+        """Add an episode to the trajectory store, with the log-probs of the policy that just played it"""
+        with torch.no_grad():
+            _, log_probs = self.replay_log_probs(episode_buffer.states, episode_buffer.actions)
+        self.trajectory_store.add_episode(episode_buffer, episode_return, i_episode, log_probs=log_probs.cpu().numpy())
+
+    def replay_update(self):
+        """
+            Off-policy updates on recently played trajectories with a PPO clipped surrogate,
+            replay_ratio of them per on-policy update (the fractional part is drawn at random).
+            The advantage of a step is the return of its episode, as in the on-policy update.
+        """
+        if self.trajectory_store is None:
+            return
+
+        n_updates = int(self.replay_ratio)
+        if np.random.rand() < self.replay_ratio - n_updates:
+            n_updates += 1
+
+        for _ in range(n_updates):
+            batch = self.trajectory_store.sample(self.opt.replay_episodes, self.opt.replay_window, device=self.DEVICE)
+            if batch is None:
+                return
+            states, actions, old_log_probs, returns = batch
+
+            episode_logits, log_probs = self.replay_log_probs(states, actions)
+            ratio = torch.exp(log_probs - old_log_probs)
+            surrogate = torch.min(ratio * returns, torch.clamp(ratio, 1 - self.opt.ppo_clip, 1 + self.opt.ppo_clip) * returns)
+
+            loss, _ = self.calculate_loss(epoch_logits=episode_logits, weighted_log_probs=surrogate)
+            self.adam.zero_grad()
+            loss.backward()
+            self.adam.step()
+
     def query_model(self):
         _ = self.student(self.query_set_1)
         act1 = activation['latent'].squeeze()
@@ -246,6 +317,9 @@ class PolicyGradient:
         return train_loss
 
     def solve_environment(self):
+        if self.envs is not None:
+            return self.solve_environment_parallel()
+
         # init the episode and the epoch
         i_episode = 0
 
@@ -266,6 +340,9 @@ class PolicyGradient:
                 # after each episode append the sum of total rewards to the deque
                 self.total_rewards.append(sum_of_episode_rewards)
 
+                if self.trajectory_store is not None:
+                    self.store_episode(self.episode_buffer, sum_of_episode_rewards, i_episode)
+
                 # append the weighted log-probabilities of actions
                 epoch_weighted_log_probs = torch.cat((epoch_weighted_log_probs, episode_weighted_log_prob_trajectory), dim=0)
 
@@ -288,6 +365,8 @@ class PolicyGradient:
             # update the parameters
             self.adam.step()
 
+            self.replay_update()
+
             # feedback
             print("\r", f"Epoch: {i_episode}, Final Test Accuracy: {acc:.2f}",
                   end="",
@@ -303,6 +382,35 @@ class PolicyGradient:
             i_episode += 1
 
 
+    def solve_environment_parallel(self):
+        i_episode = 0
+
+        while i_episode < self.NUM_TRIES:
+            episode_log_probs, episode_logits, returns = self.play_episodes()
+
+            for b, R in enumerate(returns.tolist()):
+                self.total_rewards.append(R)
+                if self.trajectory_store is not None:
+                    self.store_episode(self.episode_buffers[b], R, i_episode)
+
+            acc = returns.mean().item()
+
+            # save policy network weights
+            self.save_policy_net(i_episode, acc)
+
+            self.finish_episode(episode_log_probs, episode_logits, returns.to(self.DEVICE))
+
+            self.replay_update()
+
+            # feedback
+            print("\r", f"Epoch: {i_episode}, Final Test Accuracy: {acc:.2f} ({self.n_envs} episodes)",
+                  end="",
+                  flush=True)
+
+            i_episode += 1
+
+        self.envs.close()
+
     '''
     def solve_environment(self):
         # init the episode and the epoch
@@ -401,6 +509,8 @@ class PolicyGradient:
         avg_train_loss = 0.0
         train_loss = 0.0
         rewards = []
+
+        self.episode_buffer = EpisodeBuffer(self.opt.n_pg_epochs * len(self.train_loader), len(state[0]), self.ACTION_SPACE, device=self.DEVICE)
         # self.opt.n_epochs = 1
         for epoch in tqdm(range(self.opt.n_pg_epochs)):  # loop over the dataset multiple times
             for batch_idx, (inputs, targets) in enumerate(self.train_loader):
@@ -416,14 +526,8 @@ class PolicyGradient:
                 inputs_a, inputs_b = inputs, inputs[index, :]
 
                 # action: mixup variable lambda
-                action, episode_logits, episode_log_probs = self.select_action(state, inputs_a, inputs_b, targets_a, targets_b)
-
-                if self.step == 1:
-                    episode_logits_all = episode_logits
-                    episode_log_probs_all = episode_log_probs
-                else:
-                    episode_logits_all = torch.cat((episode_logits_all, episode_logits), 0)
-                    episode_log_probs_all = torch.cat((episode_log_probs_all, episode_log_probs), 0)
+                action, action_index, episode_logits, episode_log_probs = self.select_action(state, inputs_a, inputs_b, targets_a, targets_b)
+                self.episode_buffer.push(state, action_index, episode_logits, episode_log_probs)
                 # print('state', state)
                 # action = self.select_action(state)
 
@@ -458,7 +562,7 @@ class PolicyGradient:
                     # feat_sim = torch.ones(self.opt.n_query_classes).cuda()
                     # print(self.init_feat_sim.mean())
 
-                    _ = self.val(self.student, criterion)
+                    _ = self.val_estimate(self.student)
 
                     self.init_train_loss = train_loss / self.step
                     avg_train_loss = self.init_train_loss
@@ -470,10 +574,11 @@ class PolicyGradient:
                     state = self.model_features(avg_train_loss)
 
                 if self.step % 100 == 0:
-                    _ = self.val(self.student, criterion)
+                    _ = self.val_estimate(self.student)
 
             acc = self.val(self.student, criterion)
             rewards.append(acc)
+            self.episode_buffer.set_reward(acc)
 
         print('Finished Training')
 
@@ -499,10 +604,66 @@ class PolicyGradient:
         #     i_max = (i + 1) * data_size
         #     episode_weighted_log_probs[i_min:i_max] = episode_log_probs_all[i_min:i_max] * rewards[i]
 
-        episode_weighted_log_probs = episode_log_probs_all * reward
+        episode_weighted_log_probs = self.episode_buffer.log_probs() * reward
         sum_weighted_log_probs = torch.sum(episode_weighted_log_probs).unsqueeze(dim=0)
 
-        return sum_weighted_log_probs, episode_logits_all, reward, acc
+        return sum_weighted_log_probs, self.episode_buffer.logits(), reward, acc
+
+    def play_episodes(self):
+        """
+            Plays n_envs episodes of the environment in lockstep, same schedule as play_episode.
+            Returns:
+                episode_log_probs: list of the log-probs of every step, one tensor per episode
+                episode_logits: list of the logits of every step, one tensor per episode
+                returns: final validation accuracy of every episode
+        """
+        B = self.n_envs
+        self.envs.reset(torch.load(os.path.join(self.opt.log_path, 'teacher_w0.pth')))
+
+        n_steps = self.opt.n_pg_epochs * self.envs.steps_per_epoch
+        states = torch.tensor([[0, 1.0, 1.0]], device=self.DEVICE).repeat(B, 1)
+        self.episode_buffers = episode_buffers = [EpisodeBuffer(n_steps, states.shape[1], self.ACTION_SPACE, device=self.DEVICE) for _ in range(B)]
+
+        train_loss = torch.zeros(B)
+        best_test_loss = torch.full((B,), 1000.0)
+        init_train_loss = torch.ones(B)
+        init_test_loss = torch.ones(B)
+
+        step = 0
+        for epoch in tqdm(range(self.opt.n_pg_epochs)):
+            for batch_idx in range(self.envs.steps_per_epoch):
+                step = step + 1
+
+                actions, action_index, episode_logits, episode_log_probs = self.select_actions(states)
+                for b in range(B):
+                    episode_buffers[b].push(states[b:b + 1], action_index[b:b + 1], episode_logits[b:b + 1], episode_log_probs[b:b + 1])
+
+                train_loss += self.envs.step(actions.detach()).cpu()
+
+                if step == 1:
+                    _, test_loss = self.envs.val()
+                    best_test_loss = torch.minimum(best_test_loss, test_loss)
+                    init_train_loss = train_loss / step
+                    init_test_loss = best_test_loss.clone()
+
+                current_iter = torch.full((B,), step / n_steps)
+                states = torch.stack([current_iter, (train_loss / step) / init_train_loss, best_test_loss / init_test_loss], dim=1).to(self.DEVICE)
+
+                if step % 100 == 0:
+                    _, test_loss = self.envs.val()
+                    best_test_loss = torch.minimum(best_test_loss, test_loss)
+
+            acc, test_loss = self.envs.val()
+            best_test_loss = torch.minimum(best_test_loss, test_loss)
+            for b in range(B):
+                episode_buffers[b].set_reward(acc[b].item())
+
+        returns, _ = self.envs.val()
+
+        episode_log_probs = [buffer.log_probs() for buffer in episode_buffers]
+        episode_logits = [buffer.logits() for buffer in episode_buffers]
+
+        return episode_log_probs, episode_logits, returns
 
     def train(self, net, criterion):
         # evaluate the model
@@ -552,6 +713,14 @@ class PolicyGradient:
         # print('Accuracy of the network on the 10000 test images: {}'.format(acc))
         return acc
 
+    def val_estimate(self, net):
+        # estimate of val on a stratified subsample, exact when it cannot tell if best_test_loss improved
+        acc, test_loss, _ = validation_estimator(self, self.DEVICE).estimate(net, reference=self.best_test_loss)
+        if self.best_test_loss > test_loss:
+            self.best_test_loss = test_loss
+
+        return 100 * acc
+
     def test(self, net, criterion):
         # evaluate the model
         correct = 0
@@ -0,0 +1,103 @@
+import os
+import json
+
+import numpy as np
+import torch
+
+
+class TrajectoryStore:
+    """Persistent, memory-mapped store of the (state, action, log-prob, reward) trajectories played
+    by the policy gradient teacher.
+
+    Steps are written into fixed-size memmaps used as a ring buffer, the episodes that are still
+    complete in it are listed in meta.json together with their return and the policy update
+    they were played at. Reopening the same root continues the existing store.
+    """
+    def __init__(self, root, capacity, state_dim):
+        self.root = root
+        self.capacity = capacity
+        self.state_dim = state_dim
+
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+
+        self.meta_path = os.path.join(self.root, 'meta.json')
+        if os.path.isfile(self.meta_path):
+            with open(self.meta_path, 'r') as f:
+                self.meta = json.load(f)
+            assert self.meta['capacity'] == capacity and self.meta['state_dim'] == state_dim, \
+                "Trajectory store at {} was created with a different layout".format(self.root)
+            mode = 'r+'
+        else:
+            self.meta = {'capacity': capacity, 'state_dim': state_dim, 'cursor': 0, 'episodes': []}
+            mode = 'w+'
+
+        self.states = np.memmap(os.path.join(self.root, 'states.dat'), dtype=np.float32, mode=mode, shape=(capacity, state_dim))
+        self.actions = np.memmap(os.path.join(self.root, 'actions.dat'), dtype=np.int64, mode=mode, shape=(capacity,))
+        self.log_probs = np.memmap(os.path.join(self.root, 'log_probs.dat'), dtype=np.float32, mode=mode, shape=(capacity,))
+        self.rewards = np.memmap(os.path.join(self.root, 'rewards.dat'), dtype=np.float32, mode=mode, shape=(capacity,))
+
+    def __len__(self):
+        return len(self.meta['episodes'])
+
+    def _write_meta(self):
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def add_episode(self, episode_buffer, episode_return, i_update, log_probs=None):
+        """Append the steps of an EpisodeBuffer, overwriting the oldest episodes when full, with the
+        log-probs given instead of the ones of the buffer if any"""
+        trajectory = episode_buffer.to_numpy()
+        if log_probs is not None:
+            trajectory['log_probs'] = log_probs
+        n = len(trajectory['actions'])
+        if n == 0 or n > self.capacity:
+            return
+
+        start = self.meta['cursor']
+        if start + n > self.capacity:
+            start = 0
+        end = start + n
+
+        # drop the episodes overlapping the slots about to be written
+        self.meta['episodes'] = [e for e in self.meta['episodes'] if e['start'] + e['length'] <= start or e['start'] >= end]
+
+        self.states[start:end] = trajectory['states']
+        self.actions[start:end] = trajectory['actions']
+        self.log_probs[start:end] = trajectory['log_probs']
+        self.rewards[start:end] = trajectory['rewards']
+        for array in [self.states, self.actions, self.log_probs, self.rewards]:
+            array.flush()
+
+        self.meta['episodes'].append({'start': start, 'length': n, 'return': float(episode_return), 'update': i_update})
+        self.meta['cursor'] = end
+        self._write_meta()
+
+    def recent_episodes(self, n_episodes):
+        return self.meta['episodes'][-n_episodes:]
+
+    def sample(self, n_episodes, window, device='cpu'):
+        """Sample n_episodes among the last window ones
+        Returns:
+            states, actions, old log-probs of every sampled step and the return of its episode
+        """
+        episodes = self.recent_episodes(window)
+        if len(episodes) == 0:
+            return None
+        chosen = np.random.choice(len(episodes), min(n_episodes, len(episodes)), replace=False)
+
+        states, actions, log_probs, returns = [], [], [], []
+        for i in chosen:
+            e = episodes[i]
+            s = slice(e['start'], e['start'] + e['length'])
+            states.append(np.asarray(self.states[s]))
+            actions.append(np.asarray(self.actions[s]))
+            log_probs.append(np.asarray(self.log_probs[s]))
+            returns.append(np.full(e['length'], e['return'], dtype=np.float32))
+
+        return (torch.from_numpy(np.concatenate(states)).to(device),
+                torch.from_numpy(np.concatenate(actions)).to(device),
+                torch.from_numpy(np.concatenate(log_probs)).to(device),
+                torch.from_numpy(np.concatenate(returns)).to(device))
@@ -10,6 +10,7 @@ import torch.nn.functional as F
 from torch.autograd import Variable
 
 import numpy as np
+from utils.cache import load_teacher
 
 
 class Generator_old_mnist(nn.Module):
@@ -310,8 +311,8 @@ class UnrolledOptimizer(nn.Module):
             # for param1 in self.generator.parameters():
             #    param1 = weight
             self.generator.load_state_dict(weight)
-            self.teacher.load_state_dict(torch.load('teacher_wstar.pth'))
-            self.student.load_state_dict(torch.load('teacher_w0.pth'))
+            self.teacher.load_state_dict(load_teacher(self.opt.teacher_wstar_path))
+            self.student.load_state_dict(load_teacher(self.opt.teacher_w0_path))
 
         loss_stu = 0
         w_loss = 0
@@ -443,8 +444,8 @@ class UnrolledOptimizer_moon(nn.Module):
             # for param1 in self.generator.parameters():
             #    param1 = weight
             self.generator.load_state_dict(weight)
-            self.student.load_state_dict(torch.load('teacher_w0.pth'))
-            self.teacher.load_state_dict(torch.load('teacher_wstar.pth'))
+            self.student.load_state_dict(load_teacher(self.opt.teacher_w0_path))
+            self.teacher.load_state_dict(load_teacher(self.opt.teacher_wstar_path))
             # for param1 in self.student.parameters():
             #     param1 = w_init
             # for param2 in self.teacher.parameters():
@@ -10,6 +10,7 @@ import torch.nn.functional as F
 from torch.autograd import Variable
 
 import numpy as np
+from utils.cache import load_teacher
 
 
 class Generator(nn.Module):
@@ -238,11 +239,11 @@ class UnrolledOptimizer_moon(nn.Module):
         # self.student.lin.weight = w_init
 
         with torch.no_grad():
-            self.teacher.load_state_dict(torch.load('teacher_wstar.pth'))
+            self.teacher.load_state_dict(load_teacher(self.opt.teacher_wstar_path))
             # for param1 in self.generator.parameters():
             #    param1 = weight
             self.generator.load_state_dict(weight)
-            self.student.load_state_dict(torch.load('teacher_w0.pth'))
+            self.student.load_state_dict(load_teacher(self.opt.teacher_w0_path))
             # for param1 in self.student.parameters():
             #     param1 = w_init
             # for param2 in self.teacher.parameters():
@@ -358,11 +359,11 @@ class UnrolledOptimizer(nn.Module):
         # self.student.lin.weight = w_init
 
         with torch.no_grad():
-            self.teacher.load_state_dict(torch.load('teacher_wstar.pth'))
+            self.teacher.load_state_dict(load_teacher(self.opt.teacher_wstar_path))
             # for param1 in self.generator.parameters():
             #    param1 = weight
             self.generator.load_state_dict(weight)
-            self.student.load_state_dict(torch.load('teacher_w0.pth'))
+            self.student.load_state_dict(load_teacher(self.opt.teacher_w0_path))
             # for param1 in self.student.parameters():
             #     param1 = w_init
             # for param2 in self.teacher.parameters():
@@ -478,11 +479,11 @@ class UnrolledOptimizer_CT(nn.Module):
         # self.student.lin.weight = w_init
 
         with torch.no_grad():
-            self.teacher.load_state_dict(torch.load('teacher_wstar.pth'))
+            self.teacher.load_state_dict(load_teacher(self.opt.teacher_wstar_path))
             # for param1 in self.generator.parameters():
             #    param1 = weight
             self.generator.load_state_dict(weight)
-            self.student.load_state_dict(torch.load('teacher_w0.pth'))
+            self.student.load_state_dict(load_teacher(self.opt.teacher_w0_path))
             # for param1 in self.student.parameters():
             #     param1 = w_init
             # for param2 in self.teacher.parameters():
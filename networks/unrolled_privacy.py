@@ -11,6 +11,9 @@ from torch.autograd import Variable
 
 import numpy as np
 
+from utils.projection import pinv
+from utils.cache import load_teacher
+
 
 class Generator1(nn.Module):
     def __init__(self, opt, teacher, student):
@@ -192,7 +195,7 @@ class UnrolledOptimizer(nn.Module):
         self.nb_batch = int(self.X.shape[0] / self.opt.batch_size)
 
         self.proj_matrix = proj_matrix
-        self.unproj_matrix = torch.linalg.pinv(proj_matrix)
+        self.unproj_matrix = pinv(proj_matrix) if proj_matrix is not None else None
 
         pdist = torch.nn.PairwiseDistance(p=2)
         self.distance = pdist
@@ -221,11 +224,11 @@ class UnrolledOptimizer(nn.Module):
             fill[i, i, :, :] = 1
 
         with torch.no_grad():
-            self.teacher.load_state_dict(torch.load('teacher_wstar.pth'))
+            self.teacher.load_state_dict(load_teacher(self.opt.teacher_wstar_path))
             # for param1 in self.generator.parameters():
             #    param1 = weight
             self.generator.load_state_dict(weight)
-            self.student.load_state_dict(torch.load('teacher_w0.pth'))
+            self.student.load_state_dict(load_teacher(self.opt.teacher_w0_path))
             # for param1 in self.student.parameters():
             #     param1 = w_init
             # for param2 in self.teacher.parameters():
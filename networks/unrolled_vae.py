@@ -12,6 +12,8 @@ from torch.autograd import Variable
 import numpy as np
 
 from torch import distributions as D
+from utils.cache import load_teacher
+from utils.run import RunContext
 
 class Generator_old_mnist(nn.Module):
     def __init__(self, opt, teacher, student):
@@ -260,9 +262,9 @@ class UnrolledOptimizer(nn.Module):
             # for param1 in self.generator.parameters():
             #    param1 = weight
             self.generator.load_state_dict(weight)
-            self.teacher.load_state_dict(torch.load('teacher_wstar.pth'))
-            self.student.load_state_dict(torch.load('teacher_w0.pth'))
-            self.vae.load_state_dict(torch.load('pretrained_vae.pth'))
+            self.teacher.load_state_dict(load_teacher(self.opt.teacher_wstar_path))
+            self.student.load_state_dict(load_teacher(self.opt.teacher_w0_path))
+            self.vae.load_state_dict(RunContext(self.opt).load('pretrained_vae.pth'))
 
         loss_stu = 0
         w_loss = 0
@@ -404,9 +406,9 @@ class UnrolledOptimizer_moon(nn.Module):
             # for param1 in self.generator.parameters():
             #    param1 = weight
             self.generator.load_state_dict(weight)
-            self.student.load_state_dict(torch.load('teacher_w0.pth'))
-            self.teacher.load_state_dict(torch.load('teacher_wstar.pth'))
-            self.vae.load_state_dict(torch.load('pretrained_vae.pth'))
+            self.student.load_state_dict(load_teacher(self.opt.teacher_w0_path))
+            self.teacher.load_state_dict(load_teacher(self.opt.teacher_wstar_path))
+            self.vae.load_state_dict(RunContext(self.opt).load('pretrained_vae.pth'))
             # for param1 in self.student.parameters():
             #     param1 = w_init
             # for param2 in self.teacher.parameters():
@@ -35,6 +35,8 @@ class Options:
 
         self.parser.add_argument("--n_teacher_runs", type=int, help="name of the teaching mode", default=300)
         self.parser.add_argument("--dim", type=int, help="name of the teaching mode", default=784)
+        self.parser.add_argument("--projection", type=str, help="random projection of the samples: gaussian, sparse or hadamard", default='gaussian')
+        self.parser.add_argument("--projection_seed", type=int, help="seed of the random projection, the experiment seed if negative", default=-1)
         self.parser.add_argument("--eta", type=float, help="name of the teaching mode", default=2e-3)
         self.parser.add_argument("--n_unroll", type=int, help="name of the teaching mode", default=1000)
         self.parser.add_argument("--n_unroll_blocks", type=int, help="name of the teaching mode", default=40)
@@ -56,8 +58,18 @@ class Options:
 
         # Optimization
         self.parser.add_argument("--use_augmentation", type=bool, help="use data augmentation", default=True)
+        self.parser.add_argument("--batch_augment", help="if set, the random crops and flips of augment are applied to whole batches on the device instead of per sample in the DataLoader workers", action="store_true")
         self.parser.add_argument("--learning_rate", type=float, help="learning rate", default=1e-3)
         self.parser.add_argument("--n_iter", type=int, help="number of iterations", default=1200)
+        self.parser.add_argument("--trace_memmap", help="if set, the samples selected or generated at every iteration are recorded in memory-mapped files under the log directory instead of in memory", action="store_true")
+        self.parser.add_argument("--eval_interval", type=int, help="evaluate the learner on the test set every eval_interval iterations", default=1)
+        self.parser.add_argument("--eval_log_points", type=int, help="if > 0, evaluate the learner at eval_log_points log-spaced iterations instead", default=0)
+        self.parser.add_argument("--eval_resync", type=int, help="the test logits of the linear students are updated from the change of the weights and recomputed every eval_resync evaluations, 0 to always recompute them", default=50)
+        self.parser.add_argument("--video_format", type=str, help="format of the results videos", choices=["gif", "mp4"], default="gif")
+        self.parser.add_argument("--video_workers", type=int, help="number of processes rendering the frames of the results videos, 0 for all the cores", default=0)
+        self.parser.add_argument("--sweep_workers", type=int, help="number of runs of train.py sweep in parallel, 0 for all the cores", default=0)
+        self.parser.add_argument("--sweep_threads", type=int, help="torch threads of every sweep run, 0 to share the cores between the workers", default=0)
+        self.parser.add_argument("--rerun", action="store_true", help="run the stages and the sweep runs again even if the run manifest has them done", default=False)
         self.parser.add_argument("--batch_size", type=int, help="batch size", default=32)
         self.parser.add_argument("--lr_factor", type=int, help="batch size", default=10000)
         self.parser.add_argument("--scheduler_step_size", type=int, help="scheduler step size for lr decreasing", default=15)
@@ -68,6 +80,14 @@ class Options:
         self.parser.add_argument("--no_cuda", help="if set disables CUDA", action="store_true")
         self.parser.add_argument("--num_workers", type=int, help="number of dataloader workers", default=10)
         self.parser.add_argument("--log_frequency", type=int, help="number of batches between each tensorboard log", default=20)
+        self.parser.add_argument("--n_envs", type=int, help="number of student trainings played in parallel per policy update", default=1)
+        self.parser.add_argument("--env_backend", type=str, help="parallel environments backend: auto, vmap or process", default='auto')
+        self.parser.add_argument("--replay_ratio", type=float, help="off-policy updates from stored trajectories per policy update", default=0)
+        self.parser.add_argument("--replay_window", type=int, help="number of most recent stored episodes to replay from", default=20)
+        self.parser.add_argument("--replay_episodes", type=int, help="number of stored episodes per off-policy update", default=4)
+        self.parser.add_argument("--ppo_clip", type=float, help="clipping range of the importance weights", default=0.2)
+        self.parser.add_argument("--val_subsample", type=int, help="validation samples evaluated inside episodes, 0 for full passes", default=1024)
+        self.parser.add_argument("--stream_chunk_size", type=int, help="stream the training data in normalized chunks of this size instead of one dense tensor, 0 to disable", default=0)
 
         self.parser.add_argument("--train_student", type=bool, help="number of batches between each tensorboard log", default=False)
         self.parser.add_argument("--train_baseline", type=bool, help="number of batches between each tensorboard log", default=False)
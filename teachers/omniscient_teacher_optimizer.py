@@ -3,6 +3,7 @@
 
 
 from teachers.utils import BaseLinear, BaseConv
+from datasets.stream import iterate_batches
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -206,12 +207,8 @@ def __select_example__(teacher, student, opt, X, y, optimize_label=False):
     # - sort n * log(n)
     # - get first examples
 
-    for i in range(nb_batch):
-        i_min = i * opt.batch_size
-        i_max = (i + 1) * opt.batch_size
-
-        data = X[i_min:i_max]
-        label = y[i_min:i_max]
+    # streamed chunk by chunk with a prefetch queue when X is a StreamingArray
+    for i, data, label in iterate_batches(X, y, opt.batch_size):
         label = F.one_hot(label.long(), num_classes=2).type(torch.cuda.FloatTensor)
 
         lr = student.optim.param_groups[0]["lr"]
@@ -37,6 +37,8 @@ from torch.optim.lr_scheduler import StepLR
 from datasets import MoonDataset
 
 from datasets import BaseDataset
+from datasets.class_index import ClassIndex, query_set
+from datasets.stream import dataset_mean_and_std
 
 import networks.cgan_cifar100 as cgan
 import networks.unrolled_optimizer as unrolled
@@ -53,6 +55,8 @@ import subprocess
 import glob
 
 from utils.utils import progress_bar
+from utils.run import start_run
+from utils.results import results_writer
 
 sys.path.append('..') #Hack add ROOT DIR
 from baseconfig import CONF
@@ -276,6 +280,7 @@ class Trainer:
         self.opt.log_path = os.path.join(CONF.PATH.LOG, self.opt.model_name, str(self.opt.seed), str(self.opt.model), str(self.opt.experiment))
         if not os.path.exists(self.opt.log_path):
             os.makedirs(self.opt.log_path)
+        self.run = start_run(self.opt)
 
         self.visualize = True
 
@@ -285,25 +290,23 @@ class Trainer:
         self.device = torch.device("cpu" if self.opt.no_cuda else "cuda")
 
         if self.opt.data_mode == "cifar10":
+            normalize_transform = transforms.Normalize(*dataset_mean_and_std('cifar10'))
             if self.opt.augment:
                 transform_train = transforms.Compose([
                     transforms.RandomCrop(32, padding=4),
                     transforms.RandomHorizontalFlip(),
                     transforms.ToTensor(),
-                    transforms.Normalize((0.4914, 0.4822, 0.4465),
-                                         (0.2470, 0.2435, 0.2616)),
+                    normalize_transform,
                 ])
             else:
                 transform_train = transforms.Compose([
                     transforms.ToTensor(),
-                    transforms.Normalize((0.4914, 0.4822, 0.4465),
-                                         (0.2470, 0.2435, 0.2616)),
+                    normalize_transform,
                 ])
 
             transform_test = transforms.Compose([
                 transforms.ToTensor(),
-                transforms.Normalize((0.4914, 0.4822, 0.4465),
-                                     (0.2470, 0.2435, 0.2616)),
+                normalize_transform,
             ])
             dataset = torchvision.datasets.CIFAR10(root=CONF.PATH.DATA, train=True, download=True, transform=transform_train)
             self.test_dataset = torchvision.datasets.CIFAR10(root=CONF.PATH.DATA, train=False, download=True, transform=transform_test)
@@ -317,25 +320,23 @@ class Trainer:
             self.loader = DataLoader(dataset, batch_size=self.opt.batch_size, num_workers=self.opt.num_workers, pin_memory=True, shuffle=True, drop_last=True)
 
         elif self.opt.data_mode == "cifar100":
+            normalize_transform = transforms.Normalize(*dataset_mean_and_std('cifar100'))
             if self.opt.augment:
                 transform_train = transforms.Compose([
                     transforms.RandomCrop(32, padding=4),
                     transforms.RandomHorizontalFlip(),
                     transforms.ToTensor(),
-                    transforms.Normalize((0.5071, 0.4865, 0.4409),
-                                         (0.2673, 0.2564, 0.2762)),
+                    normalize_transform,
                 ])
             else:
                 transform_train = transforms.Compose([
                     transforms.ToTensor(),
-                    transforms.Normalize((0.5071, 0.4865, 0.4409),
-                                         (0.2673, 0.2564, 0.2762)),
+                    normalize_transform,
                 ])
 
             transform_test = transforms.Compose([
                 transforms.ToTensor(),
-                transforms.Normalize((0.5071, 0.4865, 0.4409),
-                                     (0.2673, 0.2564, 0.2762)),
+                normalize_transform,
             ])
             dataset = torchvision.datasets.CIFAR100(root=CONF.PATH.DATA, train=True, download=True, transform=transform_train)
             self.test_dataset = torchvision.datasets.CIFAR100(root=CONF.PATH.DATA, train=False, download=True, transform=transform_test)
@@ -483,69 +484,31 @@ class Trainer:
             param_group['lr'] = lr
 
     def get_query_set(self):
-        """decrease the learning rate at 100 and 150 epoch"""
+        """two examples of every class of the validation set, looked up in the per-class index"""
         query_set_1 = torch.empty(self.opt.n_query_classes, self.opt.channels, self.opt.img_size, self.opt.img_size)
         query_set_2 = torch.empty(self.opt.n_query_classes, self.opt.channels, self.opt.img_size, self.opt.img_size)
-        val_iter = iter(self.val_loader)
-        for i in range(self.opt.n_classes):
-            while True:
-                try:
-                    (inputs, targets) = val_iter.next()
-                except:
-                    val_iter = iter(self.val_loader)
-                    (inputs, targets) = val_iter.next()
-                idx = ((targets == i).nonzero(as_tuple=True)[0])
-                if idx.nelement() == 0:
-                    pass
-                else:
-                    idx = idx[0]
-                    query_set_1[i, :] = inputs[idx, :]
-                    break
-
-        for i in range(self.opt.n_classes):
-            while True:
-                try:
-                    (inputs, targets) = val_iter.next()
-                except:
-                    val_iter = iter(self.val_loader)
-                    (inputs, targets) = val_iter.next()
-                idx = ((targets == i).nonzero(as_tuple=True)[0])
-                if idx.nelement() == 0:
-                    pass
-                else:
-                    idx = idx[0]
-                    query_set_2[i, :] = inputs[idx, :]
-                    break
+
+        self.val_class_index = ClassIndex.from_dataset(self.val_loader.dataset)
+        # drawn from a generator of their own, the global numpy stream stays the one of the run
+        self.query_rng = np.random.RandomState(self.opt.seed)
+        samples = query_set(self.val_loader.dataset, self.val_class_index, classes=range(self.opt.n_classes), k=2, rng=self.query_rng)
+        query_set_1[:self.opt.n_classes] = samples[:, 0]
+        query_set_2[:self.opt.n_classes] = samples[:, 1]
 
         return query_set_1.cuda(), query_set_2.cuda()
 
     def get_query_set2(self):
-        """decrease the learning rate at 100 and 150 epoch"""
+        """n_samples examples of n_query_classes random classes of the validation set"""
         n_samples = 10
-        query_set = torch.zeros(self.opt.n_query_classes, n_samples, self.opt.channels, self.opt.img_size, self.opt.imgF_size)
 
         sample_classes = np.random.choice(self.opt.n_classes, self.opt.n_query_classes)
 
-        val_iter = iter(self.val_loader)
-        count = 0
-        for i, label in enumerate(sample_classes):
-            while count < n_samples:
-                try:
-                    (inputs, targets) = val_iter.next()
-                except:
-                    val_iter = iter(self.val_loader)
-                    (inputs, targets) = val_iter.next()
-                idx = ((targets == label).nonzero(as_tuple=True)[0])
-                if idx.nelement() == 0:
-                    pass
-                else:
-                    idx = idx[0]
-                    query_set[i, count, :] = inputs[idx, :]
-                    count = count + 1
-                    pass
-            count = 0
-
-        return query_set.cuda()
+        if not hasattr(self, 'val_class_index'):
+            self.val_class_index = ClassIndex.from_dataset(self.val_loader.dataset)
+            self.query_rng = np.random.RandomState(self.opt.seed)
+        query_set_samples = query_set(self.val_loader.dataset, self.val_class_index, classes=sample_classes, k=n_samples, rng=self.query_rng)
+
+        return query_set_samples.cuda()
 
     def main(self):
         """Run a single epoch of training and validation
@@ -628,9 +591,7 @@ class Trainer:
 
                 # self.adjust_learning_rate(example_optim, epoch)
 
-                with open(logname, 'a') as logfile:
-                    logwriter = csv.writer(logfile, delimiter=',')
-                    logwriter.writerow([epoch, acc])
+                results_writer(logname).writerow([epoch, acc])
 
 
         if self.opt.experiment == 'Student':
@@ -683,7 +644,7 @@ class Trainer:
                         # model_mdl = copy.deepcopy(self.student)
                         z = self.student(inputs)
 
-                        torch.save(self.student_fc.state_dict(), os.path.join(self.opt.log_path, 'tmp_fc.pth'))
+                        self.run.save(self.student_fc.state_dict(), 'tmp_fc.pth')
                         z_updated = unrolled_optimizer(z, inputs, targets)
                         outputs = self.student_fc(z_updated)
 
@@ -715,9 +676,7 @@ class Trainer:
                 res_student.append(acc)
                 res_loss_student.append(test_loss)
 
-                with open(logname, 'a') as logfile:
-                    logwriter = csv.writer(logfile, delimiter=',')
-                    logwriter.writerow([epoch, acc])
+                results_writer(logname).writerow([epoch, acc])
 
         if self.opt.experiment == 'Baseline':
             # student
@@ -809,9 +768,7 @@ class Trainer:
                 res_student.append(acc)
                 res_loss_student.append(test_loss)
 
-                with open(logname, 'a') as logfile:
-                    logwriter = csv.writer(logfile, delimiter=',')
-                    logwriter.writerow([epoch, acc])
+                results_writer(logname).writerow([epoch, acc])
 
     def normalize_lp_norms(self, x, p):
         # norms = torch.flatten(x).norms.lp(p=p, axis=-1)
@@ -132,7 +132,7 @@ def mixup_criterion(criterion, pred, y_a, y_b, lam):
 class Trainer:
     def __init__(self, options):
         self.opt = options
-        self.opt.log_path = os.path.join(self.opt.log_dir, self.opt.model_name)
+        self.opt.log_path = os.path.join(self.opt.log_dir, self.opt.model_name, str(self.opt.seed), str(self.opt.model), str(self.opt.experiment))
 
         self.visualize = True
 
@@ -28,6 +28,11 @@ import teachers.utils as utils
 import matplotlib.pyplot as plt
 
 import networks.blackbox_mixup_cnn as blackbox_mixup
+from utils.validation import val_estimate
+from datasets.class_index import ClassIndex, query_set
+from datasets.stream import dataset_mean_and_std
+from utils.augment import BatchAugment, AugmentedLoader, mixup_batch
+from utils.results import results_writer
 
 sys.path.append('..') #Hack add ROOT DIR
 from baseconfig import CONF
@@ -110,26 +115,8 @@ def mixup_criterion1(criterion, pred, y_a, y_b, lam):
 
 
 def mixup_data(x, y, alpha=1.0):
-    '''Returns mixed inputs, pairs of targets, and lambda'''
-    batch_size = x.shape[0]
-    index = torch.randperm(batch_size).cuda()
-
-    if alpha != 1:
-        lam = np.random.beta(alpha, alpha, size=(x.shape[0]))
-        lam = torch.tensor(lam, dtype=torch.float).cuda()
-        # mixed_y = lam * y + (1 - lam) * y[index]
-
-        lam = torch.unsqueeze(lam, 1)
-        lam = torch.unsqueeze(lam, 2)
-        lam = torch.unsqueeze(lam, 3)
-        mixed_x = lam * x + (1 - lam) * x[index, :]
-    else:
-        lam = np.random.beta(alpha, alpha)
-        mixed_x = lam * x + (1 - lam) * x[index, :]
-
-    y_a, y_b = y, y[index]
-    # mixed_y = lam * y + (1 - lam) * y[index]
-    return mixed_x, y_a, y_b, lam
+    '''Returns mixed inputs, pairs of targets, and per-sample lambdas'''
+    return mixup_batch(x, y, alpha)
 
 
 def mixup_criterion(criterion, pred, y_a, y_b, lam):
@@ -209,25 +196,23 @@ class Trainer:
         self.device = torch.device("cpu" if self.opt.no_cuda else "cuda")
 
         if self.opt.data_mode == "cifar10":
-            if self.opt.augment:
+            normalize_transform = transforms.Normalize(*dataset_mean_and_std('cifar10'))
+            if self.opt.augment and not self.opt.batch_augment:
                 transform_train = transforms.Compose([
                     transforms.RandomCrop(32, padding=4),
                     transforms.RandomHorizontalFlip(),
                     transforms.ToTensor(),
-                    transforms.Normalize((0.4914, 0.4822, 0.4465),
-                                         (0.2470, 0.2435, 0.2616)),
+                    normalize_transform,
                 ])
             else:
                 transform_train = transforms.Compose([
                     transforms.ToTensor(),
-                    transforms.Normalize((0.4914, 0.4822, 0.4465),
-                                         (0.2470, 0.2435, 0.2616)),
+                    normalize_transform,
                 ])
 
             transform_test = transforms.Compose([
                 transforms.ToTensor(),
-                transforms.Normalize((0.4914, 0.4822, 0.4465),
-                                     (0.2470, 0.2435, 0.2616)),
+                normalize_transform,
             ])
             dataset = torchvision.datasets.CIFAR10(root=CONF.PATH.DATA, train=True, download=True, transform=transform_train)
             self.test_dataset = torchvision.datasets.CIFAR10(root=CONF.PATH.DATA, train=False, download=True, transform=transform_test)
@@ -241,25 +226,23 @@ class Trainer:
             self.loader = DataLoader(dataset, batch_size=self.opt.batch_size, num_workers=self.opt.num_workers, pin_memory=True, shuffle=True)
 
         elif self.opt.data_mode == "cifar100":
-            if self.opt.augment:
+            normalize_transform = transforms.Normalize(*dataset_mean_and_std('cifar100'))
+            if self.opt.augment and not self.opt.batch_augment:
                 transform_train = transforms.Compose([
                     transforms.RandomCrop(32, padding=4),
                     transforms.RandomHorizontalFlip(),
                     transforms.ToTensor(),
-                    transforms.Normalize((0.5071, 0.4865, 0.4409),
-                                         (0.2673, 0.2564, 0.2762)),
+                    normalize_transform,
                 ])
             else:
                 transform_train = transforms.Compose([
                     transforms.ToTensor(),
-                    transforms.Normalize((0.5071, 0.4865, 0.4409),
-                                         (0.2673, 0.2564, 0.2762)),
+                    normalize_transform,
                 ])
 
             transform_test = transforms.Compose([
                 transforms.ToTensor(),
-                transforms.Normalize((0.5071, 0.4865, 0.4409),
-                                     (0.2673, 0.2564, 0.2762)),
+                normalize_transform,
             ])
             print(CONF.PATH.DATA)
             dataset = torchvision.datasets.CIFAR100(root=CONF.PATH.DATA, train=True, download=True, transform=transform_train)
@@ -277,7 +260,7 @@ class Trainer:
             # MNIST normalizing
             transform = transforms.Compose([
                 transforms.ToTensor(),
-                transforms.Normalize((0.1307,), (0.3081,)),
+                transforms.Normalize(*dataset_mean_and_std('mnist')),
             ])
             self.train_dataset = torchvision.datasets.MNIST(root=CONF.PATH.DATA, train=True, download=True, transform=transform)
             # train, valid = random_split(train_dataset, [50000, 10000])
@@ -316,6 +299,13 @@ class Trainer:
             print("Unrecognized data!")
             sys.exit()
 
+        if self.opt.augment and self.opt.batch_augment and self.opt.data_mode in ["cifar10", "cifar100"]:
+            # crops and flips on whole batches on the device, padded with the normalized black pixel of RandomCrop
+            fill = [-m / s for m, s in zip(normalize_transform.mean, normalize_transform.std)]
+            augment = BatchAugment(crop_padding=4, flip=True, fill=fill, seed=self.opt.seed)
+            self.train_loader = AugmentedLoader(self.train_loader, augment, self.device)
+            self.loader = AugmentedLoader(self.loader, augment, self.device)
+
         self.get_teacher_student()
 
         self.writers = {}
@@ -446,39 +436,16 @@ class Trainer:
             param_group['lr'] = lr
 
     def get_query_set(self):
-        """decrease the learning rate at 100 and 150 epoch"""
+        """two examples of every class of the validation set, looked up in the per-class index"""
         query_set_1 = torch.empty(self.opt.n_query_classes, self.opt.channels, self.opt.img_size, self.opt.img_size)
         query_set_2 = torch.empty(self.opt.n_query_classes, self.opt.channels, self.opt.img_size, self.opt.img_size)
-        val_iter = iter(self.val_loader)
-        for i in range(self.opt.n_classes):
-            while True:
-                try:
-                    (inputs, targets) = val_iter.next()
-                except:
-                    val_iter = iter(self.val_loader)
-                    (inputs, targets) = val_iter.next()
-                idx = ((targets == i).nonzero(as_tuple=True)[0])
-                if idx.nelement() == 0:
-                    pass
-                else:
-                    idx = idx[0]
-                    query_set_1[i, :] = inputs[idx, :]
-                    break
-
-        for i in range(self.opt.n_classes):
-            while True:
-                try:
-                    (inputs, targets) = val_iter.next()
-                except:
-                    val_iter = iter(self.val_loader)
-                    (inputs, targets) = val_iter.next()
-                idx = ((targets == i).nonzero(as_tuple=True)[0])
-                if idx.nelement() == 0:
-                    pass
-                else:
-                    idx = idx[0]
-                    query_set_2[i, :] = inputs[idx, :]
-                    break
+
+        self.val_class_index = ClassIndex.from_dataset(self.val_loader.dataset)
+        # drawn from a generator of their own, the global numpy stream stays the one of the run
+        self.query_rng = np.random.RandomState(self.opt.seed)
+        samples = query_set(self.val_loader.dataset, self.val_class_index, classes=range(self.opt.n_classes), k=2, rng=self.query_rng)
+        query_set_1[:self.opt.n_classes] = samples[:, 0]
+        query_set_2[:self.opt.n_classes] = samples[:, 1]
 
         return query_set_1.cuda(), query_set_2.cuda()
 
@@ -502,32 +469,17 @@ class Trainer:
         return features.cuda(), targets.cuda()
 
     def get_query_set2(self):
-        """decrease the learning rate at 100 and 150 epoch"""
+        """n_samples examples of n_query_classes random classes of the validation set"""
         n_samples = 10
-        query_set = torch.zeros(self.opt.n_query_classes, n_samples, self.opt.channels, self.opt.img_size, self.opt.img_size)
 
         sample_classes = np.random.choice(self.opt.n_classes, self.opt.n_query_classes)
 
-        val_iter = iter(self.val_loader)
-        count = 0
-        for i, label in enumerate(sample_classes):
-            while count < n_samples:
-                try:
-                    (inputs, targets) = val_iter.next()
-                except:
-                    val_iter = iter(self.val_loader)
-                    (inputs, targets) = val_iter.next()
-                idx = ((targets == label).nonzero(as_tuple=True)[0])
-                if idx.nelement() == 0:
-                    pass
-                else:
-                    idx = idx[0]
-                    query_set[i, count, :] = inputs[idx, :]
-                    count = count + 1
-                    pass
-            count = 0
-
-        return query_set.cuda()
+        if not hasattr(self, 'val_class_index'):
+            self.val_class_index = ClassIndex.from_dataset(self.val_loader.dataset)
+            self.query_rng = np.random.RandomState(self.opt.seed)
+        query_set_samples = query_set(self.val_loader.dataset, self.val_class_index, classes=sample_classes, k=n_samples, rng=self.query_rng)
+
+        return query_set_samples.cuda()
 
     def main(self):
         """Run a single epoch of training and validation
@@ -678,7 +630,7 @@ class Trainer:
                             # self.log(mode="val", name="loss_teacher", value=loss.item(), step=self.step)
 
                         if self.step == 1:
-                            _, _ = self.val(self.baseline, val_loader=self.val_loader, epoch=epoch)
+                            _, _ = val_estimate(self, self.baseline, self.device)
 
                             self.init_train_loss = train_loss / self.step
                             avg_train_loss = self.init_train_loss
@@ -691,16 +643,14 @@ class Trainer:
 
                         if self.step % 100 == 0:
                             # _, _ = self.test(self.baseline, test_loader=self.test_loader, epoch=epoch)
-                            _, _ = self.val(self.baseline, val_loader=self.val_loader, epoch=epoch)
+                            _, _ = val_estimate(self, self.baseline, self.device)
 
                 # _, _ = self.val(self.baseline, val_loader=self.val_loader, epoch=epoch, netG=netG, save=True)
                 acc, test_loss = self.test(self.baseline, test_loader=self.test_loader, epoch=epoch, netG=netG)
                 res_student.append(acc)
                 res_loss_student.append(test_loss)
 
-                with open(logname, 'a') as logfile:
-                    logwriter = csv.writer(logfile, delimiter=',')
-                    logwriter.writerow([epoch, acc])
+                results_writer(logname).writerow([epoch, acc])
 
             torch.save(netG.state_dict(), os.path.join(self.opt.log_path, 'weights/best_model_netG.pth'))
 
@@ -793,9 +743,7 @@ class Trainer:
                 res_student.append(acc)
                 res_loss_student.append(test_loss)
 
-                with open(logname, 'a') as logfile:
-                    logwriter = csv.writer(logfile, delimiter=',')
-                    logwriter.writerow([epoch, acc])
+                results_writer(logname).writerow([epoch, acc])
 
             torch.save(netG.state_dict(), os.path.join(self.opt.log_path, 'weights/best_model_netG.pth'))
 
@@ -903,9 +851,7 @@ class Trainer:
             # if epoch % 2 == 0:
             #    self.query_set_1, self.query_set_2 = self.get_query_set()
 
-            with open(logname, 'a') as logfile:
-                logwriter = csv.writer(logfile, delimiter=',')
-                logwriter.writerow([epoch, acc])
+            results_writer(logname).writerow([epoch, acc])
 
     def get_activation(self, name):
         def hook(model, input, output):
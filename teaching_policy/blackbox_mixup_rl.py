@@ -39,11 +39,15 @@ from torch.optim.lr_scheduler import StepLR
 from datasets import MoonDataset
 
 from datasets import BaseDataset
+from datasets.class_index import ClassIndex, query_set
+from datasets.stream import dataset_mean_and_std
+from utils.augment import BatchAugment, AugmentedLoader, mixup_batch, mixup_loss
 
 import networks.cgan as cgan
 import networks.unrolled_optimizer as unrolled
 import networks.blackbox_mixup_cnn as blackbox_mixup
 from networks.policy_gradient import PolicyGradient
+from networks.episode_buffer import EpisodeBuffer
 from networks.controller import Agent
 # import networks
 
@@ -60,6 +64,8 @@ import glob
 import random
 
 from utils.utils import progress_bar
+from utils.validation import val_estimate
+from utils.results import results_writer
 
 sys.path.append('..') #Hack add ROOT DIR
 from baseconfig import CONF
@@ -142,26 +148,8 @@ def mixup_criterion1(criterion, pred, y_a, y_b, lam):
 
 
 def mixup_data(x, y, alpha=1.0):
-    '''Returns mixed inputs, pairs of targets, and lambda'''
-    batch_size = x.shape[0]
-    index = torch.randperm(batch_size).cuda()
-
-    if alpha != 1:
-        lam = np.random.beta(alpha, alpha, size=(x.shape[0]))
-        lam = torch.tensor(lam, dtype=torch.float).cuda()
-        # mixed_y = lam * y + (1 - lam) * y[index]
-
-        lam = torch.unsqueeze(lam, 1)
-        lam = torch.unsqueeze(lam, 2)
-        lam = torch.unsqueeze(lam, 3)
-        mixed_x = lam * x + (1 - lam) * x[index, :]
-    else:
-        lam = np.random.beta(alpha, alpha)
-        mixed_x = lam * x + (1 - lam) * x[index, :]
-
-    y_a, y_b = y, y[index]
-    # mixed_y = lam * y + (1 - lam) * y[index]
-    return mixed_x, y_a, y_b, lam
+    '''Returns mixed inputs, pairs of targets, and per-sample lambdas'''
+    return mixup_batch(x, y, alpha)
 
 
 def mixup_criterion(criterion, pred, y_a, y_b, lam):
@@ -241,25 +229,23 @@ class Trainer:
         self.device = torch.device("cpu" if self.opt.no_cuda else "cuda")
 
         if self.opt.data_mode == "cifar10":
-            if self.opt.augment:
+            normalize_transform = transforms.Normalize(*dataset_mean_and_std('cifar10'))
+            if self.opt.augment and not self.opt.batch_augment:
                 transform_train = transforms.Compose([
                     transforms.RandomCrop(32, padding=4),
                     transforms.RandomHorizontalFlip(),
                     transforms.ToTensor(),
-                    transforms.Normalize((0.4914, 0.4822, 0.4465),
-                                         (0.2470, 0.2435, 0.2616)),
+                    normalize_transform,
                 ])
             else:
                 transform_train = transforms.Compose([
                     transforms.ToTensor(),
-                    transforms.Normalize((0.4914, 0.4822, 0.4465),
-                                         (0.2470, 0.2435, 0.2616)),
+                    normalize_transform,
                 ])
 
             transform_test = transforms.Compose([
                 transforms.ToTensor(),
-                transforms.Normalize((0.4914, 0.4822, 0.4465),
-                                     (0.2470, 0.2435, 0.2616)),
+                normalize_transform,
             ])
             dataset = torchvision.datasets.CIFAR10(root=CONF.PATH.DATA, train=True, download=True, transform=transform_train)
             self.test_dataset = torchvision.datasets.CIFAR10(root=CONF.PATH.DATA, train=False, download=True, transform=transform_test)
@@ -273,25 +259,23 @@ class Trainer:
             self.loader = DataLoader(dataset, batch_size=self.opt.batch_size, num_workers=self.opt.num_workers, pin_memory=True, shuffle=True, drop_last=True)
 
         elif self.opt.data_mode == "cifar100":
-            if self.opt.augment:
+            normalize_transform = transforms.Normalize(*dataset_mean_and_std('cifar100'))
+            if self.opt.augment and not self.opt.batch_augment:
                 transform_train = transforms.Compose([
                     transforms.RandomCrop(32, padding=4),
                     transforms.RandomHorizontalFlip(),
                     transforms.ToTensor(),
-                    transforms.Normalize((0.5071, 0.4865, 0.4409),
-                                         (0.2673, 0.2564, 0.2762)),
+                    normalize_transform,
                 ])
             else:
                 transform_train = transforms.Compose([
                     transforms.ToTensor(),
-                    transforms.Normalize((0.5071, 0.4865, 0.4409),
-                                         (0.2673, 0.2564, 0.2762)),
+                    normalize_transform,
                 ])
 
             transform_test = transforms.Compose([
                 transforms.ToTensor(),
-                transforms.Normalize((0.5071, 0.4865, 0.4409),
-                                     (0.2673, 0.2564, 0.2762)),
+                normalize_transform,
             ])
             dataset = torchvision.datasets.CIFAR100(root=CONF.PATH.DATA, train=True, download=True, transform=transform_train)
             self.test_dataset = torchvision.datasets.CIFAR100(root=CONF.PATH.DATA, train=False, download=True, transform=transform_test)
@@ -308,7 +292,7 @@ class Trainer:
             # MNIST normalizing
             transform = transforms.Compose([
                 transforms.ToTensor(),
-                transforms.Normalize((0.1307,), (0.3081,)),
+                transforms.Normalize(*dataset_mean_and_std('mnist')),
             ])
             dataset = torchvision.datasets.MNIST(root=CONF.PATH.DATA, train=True, download=True, transform=transform)
             # train, valid = random_split(train_dataset, [50000, 10000])
@@ -344,6 +328,13 @@ class Trainer:
             print("Unrecognized data!")
             sys.exit()
 
+        if self.opt.augment and self.opt.batch_augment and self.opt.data_mode in ["cifar10", "cifar100"]:
+            # crops and flips on whole batches on the device, padded with the normalized black pixel of RandomCrop
+            fill = [-m / s for m, s in zip(normalize_transform.mean, normalize_transform.std)]
+            augment = BatchAugment(crop_padding=4, flip=True, fill=fill, seed=self.opt.seed)
+            self.train_loader = AugmentedLoader(self.train_loader, augment, self.device)
+            self.loader = AugmentedLoader(self.loader, augment, self.device)
+
         self.get_teacher_student()
 
         self.writers = {}
@@ -453,39 +444,16 @@ class Trainer:
             param_group['lr'] = lr
 
     def get_query_set(self):
-        """decrease the learning rate at 100 and 150 epoch"""
+        """two examples of every class of the validation set, looked up in the per-class index"""
         query_set_1 = torch.empty(self.opt.n_query_classes, self.opt.channels, self.opt.img_size, self.opt.img_size)
         query_set_2 = torch.empty(self.opt.n_query_classes, self.opt.channels, self.opt.img_size, self.opt.img_size)
-        val_iter = iter(self.val_loader)
-        for i in range(self.opt.n_classes):
-            while True:
-                try:
-                    (inputs, targets) = val_iter.next()
-                except:
-                    val_iter = iter(self.val_loader)
-                    (inputs, targets) = val_iter.next()
-                idx = ((targets == i).nonzero(as_tuple=True)[0])
-                if idx.nelement() == 0:
-                    pass
-                else:
-                    idx = idx[0]
-                    query_set_1[i, :] = inputs[idx, :]
-                    break
-
-        for i in range(self.opt.n_classes):
-            while True:
-                try:
-                    (inputs, targets) = val_iter.next()
-                except:
-                    val_iter = iter(self.val_loader)
-                    (inputs, targets) = val_iter.next()
-                idx = ((targets == i).nonzero(as_tuple=True)[0])
-                if idx.nelement() == 0:
-                    pass
-                else:
-                    idx = idx[0]
-                    query_set_2[i, :] = inputs[idx, :]
-                    break
+
+        self.val_class_index = ClassIndex.from_dataset(self.val_loader.dataset)
+        # drawn from a generator of their own, the global numpy stream stays the one of the run
+        self.query_rng = np.random.RandomState(self.opt.seed)
+        samples = query_set(self.val_loader.dataset, self.val_class_index, classes=range(self.opt.n_classes), k=2, rng=self.query_rng)
+        query_set_1[:self.opt.n_classes] = samples[:, 0]
+        query_set_2[:self.opt.n_classes] = samples[:, 1]
 
         return query_set_1.cuda(), query_set_2.cuda()
 
@@ -509,32 +477,17 @@ class Trainer:
         return features.cuda(), targets.cuda()
 
     def get_query_set2(self):
-        """decrease the learning rate at 100 and 150 epoch"""
+        """n_samples examples of n_query_classes random classes of the validation set"""
         n_samples = 10
-        query_set = torch.zeros(self.opt.n_query_classes, n_samples, self.opt.channels, self.opt.img_size, self.opt.img_size)
 
         sample_classes = np.random.choice(self.opt.n_classes, self.opt.n_query_classes)
 
-        val_iter = iter(self.val_loader)
-        count = 0
-        for i, label in enumerate(sample_classes):
-            while count < n_samples:
-                try:
-                    (inputs, targets) = val_iter.next()
-                except:
-                    val_iter = iter(self.val_loader)
-                    (inputs, targets) = val_iter.next()
-                idx = ((targets == label).nonzero(as_tuple=True)[0])
-                if idx.nelement() == 0:
-                    pass
-                else:
-                    idx = idx[0]
-                    query_set[i, count, :] = inputs[idx, :]
-                    count = count + 1
-                    pass
-            count = 0
+        if not hasattr(self, 'val_class_index'):
+            self.val_class_index = ClassIndex.from_dataset(self.val_loader.dataset)
+            self.query_rng = np.random.RandomState(self.opt.seed)
+        query_set_samples = query_set(self.val_loader.dataset, self.val_class_index, classes=sample_classes, k=n_samples, rng=self.query_rng)
 
-        return query_set.cuda()
+        return query_set_samples.cuda()
 
     def main(self):
         """Run a single epoch of training and validation
@@ -642,9 +595,7 @@ class Trainer:
 
                 # self.adjust_learning_rate(example_optim, epoch)
 
-                with open(logname, 'a') as logfile:
-                    logwriter = csv.writer(logfile, delimiter=',')
-                    logwriter.writerow([epoch, acc])
+                results_writer(logname).writerow([epoch, acc])
 
                 '''
                 example.eval()
@@ -702,6 +653,8 @@ class Trainer:
             correct = 0
             total = 0
             mixup_baseline.load_state_dict(torch.load(os.path.join(self.opt.log_path, 'teacher_w0.pth')))
+            # seeded lambdas and permutations of the mixup batches, drawn on the host once per batch
+            mixup_augment = BatchAugment(seed=self.opt.seed)
             # mixup_baseline_optim = torch.optim.SGD(mixup_baseline.parameters(), lr=self.opt.lr, momentum=self.opt.momentum)
             mixup_baseline_optim = torch.optim.Adam(mixup_baseline.parameters(), lr=self.opt.lr)
             # mixup_baseline_optim = torch.optim.SGD(mixup_baseline.parameters(),
@@ -723,18 +676,12 @@ class Trainer:
                     for batch_idx, (inputs, targets) in enumerate(self.loader):
                         inputs, targets = inputs.cuda(), targets.cuda()
 
-                        lam = np.random.beta(1.0, 1.0)
-
-                        index = torch.randperm(inputs.shape[0]).cuda()
-                        targets_a, targets_b = targets, targets[index]
-                        targets_a = one_hot(targets_a, self.opt.n_classes)
-                        targets_b = one_hot(targets_b, self.opt.n_classes)
-
-                        mixed_x = lam * inputs + (1 - lam) * inputs[index, :]
+                        # one lambda per sample, drawn with the permutation in one call
+                        mixed_x, targets_a, targets_b, lam = mixup_augment.mixup(inputs, targets, alpha=1.0)
 
                         outputs = mixup_baseline(mixed_x)
 
-                        loss = lam * self.loss_fn(outputs, targets_a.float()) + (1 - lam) * self.loss_fn(outputs, targets_b.float())
+                        loss = mixup_loss(outputs, targets_a, targets_b, lam)
 
                         # mixed_x, targets_a, targets_b, lam = mixup_data(inputs, targets, alpha=1.0)
 
@@ -763,9 +710,7 @@ class Trainer:
 
                 # self.adjust_learning_rate(mixup_baseline_optim, epoch)
 
-                with open(logname, 'a') as logfile:
-                    logwriter = csv.writer(logfile, delimiter=',')
-                    logwriter.writerow([epoch, acc])
+                results_writer(logname).writerow([epoch, acc])
 
                 mixup_baseline.train()
 
@@ -810,6 +755,8 @@ class Trainer:
             correct = 0
             total = 0
             mixup_baseline.load_state_dict(torch.load(os.path.join(self.opt.log_path, 'teacher_w0.pth')))
+            # seeded lambdas and permutations of the mixup batches, drawn on the host once per batch
+            mixup_augment = BatchAugment(seed=self.opt.seed)
             # mixup_baseline_optim = torch.optim.SGD(mixup_baseline.parameters(), lr=self.opt.lr, momentum=self.opt.momentum)
             mixup_baseline_optim = torch.optim.Adam(mixup_baseline.parameters(), lr=self.opt.lr)
             # mixup_baseline_optim = torch.optim.SGD(mixup_baseline.parameters(),
@@ -833,20 +780,13 @@ class Trainer:
                     for batch_idx, (inputs, targets) in enumerate(self.loader):
                         inputs, targets = inputs.cuda(), targets.cuda()
 
-                        lam = np.random.beta(1.0, 1.0)
-                        inds = np.digitize(lam, bins)
-                        lam = prob[inds-1]
-
-                        index = torch.randperm(inputs.shape[0]).cuda()
-                        targets_a, targets_b = targets, targets[index]
-                        targets_a = one_hot(targets_a, self.opt.n_classes)
-                        targets_b = one_hot(targets_b, self.opt.n_classes)
-
-                        mixed_x = lam * inputs + (1 - lam) * inputs[index, :]
+                        # one lambda per sample, snapped to the level of its bin
+                        mixed_x, targets_a, targets_b, lam = mixup_augment.mixup(
+                            inputs, targets, alpha=1.0, quantize=lambda lam: np.asarray(prob)[np.digitize(lam, bins) - 1])
 
                         outputs = mixup_baseline(mixed_x)
 
-                        loss = lam * self.loss_fn(outputs, targets_a.float()) + (1 - lam) * self.loss_fn(outputs, targets_b.float())
+                        loss = mixup_loss(outputs, targets_a, targets_b, lam)
 
                         # mixed_x, targets_a, targets_b, lam = mixup_data(inputs, targets, alpha=1.0)
 
@@ -875,9 +815,7 @@ class Trainer:
 
                 # self.adjust_learning_rate(mixup_baseline_optim, epoch)
 
-                with open(logname, 'a') as logfile:
-                    logwriter = csv.writer(logfile, delimiter=',')
-                    logwriter.writerow([epoch, acc])
+                results_writer(logname).writerow([epoch, acc])
 
                 mixup_baseline.train()
 
@@ -898,8 +836,10 @@ class Trainer:
                 plt.close()
 
         if self.opt.experiment == 'Student':
-            # policy_gradient = PolicyGradient(opt=self.opt, student=self.student, train_loader=self.loader, val_loader=self.val_loader, test_loader=self.test_loader, writers=self.writers)
-            # policy_gradient.solve_environment()
+            # train the mixup policy with n_envs student trainings per policy update, or when it has not been trained yet
+            if self.opt.n_envs > 1 or not os.path.isfile(os.path.join(self.opt.log_path, 'policy_w.pth')):
+                policy_gradient = PolicyGradient(opt=self.opt, student=self.student, train_loader=self.loader, val_loader=self.val_loader, test_loader=self.test_loader, writers=self.writers)
+                policy_gradient.solve_environment()
 
             # mixup student
             self.opt.experiment = "Policy_Gradient_Mixup"
@@ -949,6 +889,8 @@ class Trainer:
 
             rewards = []
 
+            episode_buffer = EpisodeBuffer(self.opt.n_epochs * len(self.loader), len(state[0]), self.opt.action_space, device=self.device)
+
             for epoch in tqdm(range(self.opt.n_epochs)):
                 if epoch != 0:
                     running_train_loss = 0
@@ -968,15 +910,10 @@ class Trainer:
                         inputs_a, inputs_b = inputs, inputs[index, :]
 
                         # action: mixup variable lambda
-                        action, episode_logits, episode_log_probs = self.select_action(policy, state, inputs_a, inputs_b, targets_a, targets_b)
+                        action, action_index, episode_logits, episode_log_probs = self.select_action(policy, state, inputs_a, inputs_b, targets_a, targets_b)
                         # print("state", state)
 
-                        if self.step == 1:
-                            episode_logits_all = episode_logits
-                            episode_log_probs_all = episode_log_probs
-                        else:
-                            episode_logits_all = torch.cat((episode_logits_all, episode_logits), 0)
-                            episode_log_probs_all = torch.cat((episode_log_probs_all, episode_log_probs), 0)
+                        episode_buffer.push(state, action_index, episode_logits, episode_log_probs)
 
                         # print('state', state)
                         # action = self.select_action(state)
@@ -1017,7 +954,7 @@ class Trainer:
                             # print(self.init_feat_sim.mean())
 
                             # _ = self.test(self.student, test_loader=self.test_loader, epoch=epoch, log=False)
-                            _, _ = self.val(self.student, val_loader=self.val_loader, epoch=epoch)
+                            _, _ = val_estimate(self, self.student, self.device)
 
                             self.init_train_loss = train_loss / self.step
                             avg_train_loss = self.init_train_loss
@@ -1032,11 +969,13 @@ class Trainer:
 
                         if self.step % 100 == 0: # 100
                             # _, _ = self.test(self.student, test_loader=self.test_loader, epoch=epoch, log=False)
-                            _, _ = self.val(self.student, val_loader=self.val_loader, epoch=epoch)
+                            _, _ = val_estimate(self, self.student, self.device)
 
                 acc, test_loss = self.test(self.student, test_loader=self.test_loader, epoch=epoch)
                 res_student.append(acc)
                 res_loss_student.append(test_loss)
+                if len(episode_buffer) > 0:
+                    episode_buffer.set_reward(acc)
 
                 # feat, labels = self.get_query_set()
                 # self.estimator.update_CV(feat, labels)
@@ -1052,9 +991,9 @@ class Trainer:
 
                 self.student.train()
 
-                with open(logname, 'a') as logfile:
-                    logwriter = csv.writer(logfile, delimiter=',')
-                    logwriter.writerow([epoch, acc])
+                results_writer(logname).writerow([epoch, acc])
+
+            episode_buffer.save(os.path.join(self.opt.log_path, 'episode_trace_' + str(self.opt.seed) + '.npz'))
 
             if self.visualize == False:
                 fig = plt.figure()
@@ -1088,7 +1027,7 @@ class Trainer:
         # action_space = torch.tensor([[0.2, 0.3, 1.0], [0.2, 0.3, 1.0], [0.2, 0.3, 1.0], [0.2, 0.3, 1.0]], device=self.DEVICE)
 
         action = torch.gather(action_space, 1, action_index).squeeze(1)
-        return action.item(), episode_logits, episode_log_probs
+        return action.item(), action_index, episode_logits, episode_log_probs
 
     def get_activation(self, name):
         def hook(model, input, output):
@@ -104,7 +104,7 @@ def to_matrix(l, n):
 class Trainer:
     def __init__(self, options):
         self.opt = options
-        self.opt.log_path = os.path.join(CONF.PATH.LOG, self.opt.model_name)
+        self.opt.log_path = os.path.join(CONF.PATH.LOG, self.opt.model_name, str(self.opt.seed), str(self.opt.model), str(self.opt.experiment))
 
         self.visualize = True
 
@@ -37,7 +37,13 @@ from sklearn.datasets import make_moons, make_classification
 from sklearn.model_selection import train_test_split
 
 from utils.visualize import make_results_video, make_results_video_2d, make_results_img, make_results_img_2d, plot_generated_samples
-from utils.data import init_data, initialize_weights, plot_graphs, load_experiment_result
+from utils.data import init_data, initialize_weights, plot_graphs, load_experiment_result, project_data
+from utils.run import start_run
+from utils.cache import TeacherStore, load_teacher
+from utils.manifest import stage_manifest
+from utils.projection import get_projection
+from utils.trace import trace_recorder
+from utils.evaluation import Evaluator
 
 from experiments import SGDTrainer, IMTTrainer, WSTARTrainer
 
@@ -109,9 +115,10 @@ class Trainer:
 
         self.opt.model_name = "omniscient_cgan_" + self.opt.data_mode
 
-        self.opt.log_path = os.path.join(CONF.PATH.LOG, self.opt.model_name)
+        self.opt.log_path = os.path.join(CONF.PATH.LOG, self.opt.model_name, str(self.opt.seed), str(self.opt.model), str(self.opt.experiment))
         if not os.path.exists(self.opt.log_path):
             os.makedirs(self.opt.log_path)
+        self.run = start_run(self.opt)
 
         self.visualize = True
 
@@ -135,7 +142,7 @@ class Trainer:
             self.teacher.apply(initialize_weights)
             self.student = omniscient.OmniscientLinearStudent(self.opt.dim)
             self.baseline = omniscient.OmniscientLinearStudent(self.opt.dim)
-            torch.save(self.teacher.state_dict(), 'teacher_w0.pth')
+            self.opt.teacher_w0_path = TeacherStore().w0(self.opt, self.teacher)
 
     def set_train(self):
         """Convert all models to training mode
@@ -196,13 +203,10 @@ class Trainer:
         """
 
         print("Training")
+        manifest = stage_manifest(self.opt)
         # self.set_train()
 
-        if self.opt.init_data:
-            init_data(self.opt)
-
-        X = torch.load('X.pt')
-        Y = torch.load('Y.pt')
+        X, Y = init_data(self.opt)
 
         # Shuffle datasets
         # randomize = np.arange(X.shape[0])
@@ -228,12 +232,10 @@ class Trainer:
             data_train = BaseDataset(X_train, Y_train)
             train_loader = DataLoader(data_train, batch_size=self.opt.batch_size, drop_last=True, shuffle=True)
 
-            X_train = X_train.reshape((self.opt.nb_train, self.opt.img_size**2))
-            X_test = X_test.reshape((self.opt.nb_test, self.opt.img_size**2))
-
-            proj_matrix = torch.empty(self.opt.img_size**2, self.opt.dim).normal_(mean=0, std=0.1)
-            X_train = X_train @ proj_matrix
-            X_test = X_test @ proj_matrix
+            proj_matrix = get_projection(self.opt)
+            X_proj = project_data(self.opt, X, proj_matrix)
+            X_train = torch.from_numpy(X_proj[:self.opt.nb_train])
+            X_test = torch.from_numpy(X_proj[self.opt.nb_train:self.opt.nb_train + self.opt.nb_test])
 
         else:
             X_train = torch.tensor(X[:self.opt.nb_train], dtype=torch.float)
@@ -254,11 +256,14 @@ class Trainer:
         #  Train Teacher
         # ---------------------
 
-        if self.opt.train_wstar == True:
-            wstar_trainer = WSTARTrainer(self.opt, X_train, Y_train, X_test, Y_test)
-            wstar_trainer.train(self.teacher)
+        with TeacherStore().wstar(self.opt, self.teacher) as wstar:
+            if wstar.build:
+                wstar_trainer = WSTARTrainer(self.opt, X_train, Y_train, X_test, Y_test)
+                wstar_trainer.train(self.teacher)
+                wstar.save(self.teacher.state_dict())
+        self.opt.teacher_wstar_path = wstar.path
 
-        self.teacher.load_state_dict(torch.load('teacher_wstar.pth'))
+        self.teacher.load_state_dict(load_teacher(self.opt.teacher_wstar_path))
         w_star = self.teacher.lin.weight
         w_star = w_star / torch.norm(w_star)
 
@@ -267,13 +272,14 @@ class Trainer:
         # ---------------------
 
         self.opt.experiment = "SGD"
-        if self.opt.train_sgd == False:
+        if self.opt.train_sgd == False and manifest.start(self.opt):
 
             sgd_example = utils.BaseLinear(self.opt.dim)
-            sgd_example.load_state_dict(torch.load('teacher_w0.pth'))
+            sgd_example.load_state_dict(load_teacher(self.opt.teacher_w0_path))
 
             sgd_trainer = SGDTrainer(self.opt, X_train, Y_train, X_test, Y_test)
             _, _ = sgd_trainer.train(sgd_example, w_star)
+            manifest.done(self.opt.experiment)
 
         res_sgd, w_diff_sgd = load_experiment_result(self.opt)
 
@@ -282,11 +288,12 @@ class Trainer:
         # ---------------------
 
         self.opt.experiment = "IMT_Baseline"
-        if self.opt.train_baseline == False:
-            self.baseline.load_state_dict(torch.load('teacher_w0.pth'))
+        if self.opt.train_baseline == False and manifest.start(self.opt):
+            self.baseline.load_state_dict(load_teacher(self.opt.teacher_w0_path))
 
             imt_trainer = IMTTrainer(self.opt, X_train, Y_train, X_test, Y_test)
             _, _ = imt_trainer.train(self.baseline, self.teacher, w_star)
+            manifest.done(self.opt.experiment)
 
         res_baseline, w_diff_baseline = load_experiment_result(self.opt)
 
@@ -428,13 +435,13 @@ class Trainer:
                     print(f" Epoch {epoch+1}/{self.opt.n_epochs} Discriminator Loss {D_losses[-1]:.3f} Generator Loss {G_losses[-1]:.3f}"
                          + f" D(x) {Dx_values[-1]:.3f} D(G(x)) {DGz_values[-1]:.3f}")
 
-            res_student = []
             a_student = []
             b_student = []
-            w_diff_student = []
 
-            self.student.load_state_dict(torch.load('teacher_w0.pth'))
+            self.student.load_state_dict(load_teacher(self.opt.teacher_w0_path))
             netG.eval()
+            trace = trace_recorder(self.opt, self.opt.n_iter - 1, self.opt.experiment)
+            evaluator = Evaluator(self.opt, X_test, Y_test, w_star, logname)
             for idx in tqdm(range(self.opt.n_iter)):
                 if idx != 0:
                     w_t = self.student.lin.weight
@@ -455,12 +462,7 @@ class Trainer:
                     # x = torch.cat((w, z), dim=1)
                     generated_sample = netG(w, gt_y_onehot)
 
-                    if idx == 1:
-                        generated_samples = generated_sample.cpu().detach().numpy()  # [np.newaxis, :]
-                        generated_labels = gt_y.cpu().unsqueeze(1).detach().numpy()  # [np.newaxis, :]
-                    else:
-                        generated_samples = np.concatenate((generated_samples, generated_sample.cpu().detach().numpy()), axis=0)
-                        generated_labels = np.concatenate((generated_labels, gt_y.unsqueeze(1).cpu().detach().numpy()), axis=0)
+                    trace.record(generated_sample, gt_y.unsqueeze(1))
 
                     if self.opt.data_mode == "mnist":
                         generated_sample = generated_sample.reshape((self.opt.batch_size, self.opt.img_size**2))
@@ -468,34 +470,14 @@ class Trainer:
 
                     self.student.update(generated_sample, gt_y.unsqueeze(1))
 
-                self.student.eval()
-                test = self.student(X_test.cuda()).cpu()
-
-                if self.opt.data_mode == "moon":
                     a, b = plot_classifier(self.student, X.max(axis=0), X.min(axis=0))
                     a_student.append(a)
                     b_student.append(b)
-
-                if self.opt.data_mode == "mnist" or self.opt.data_mode == "gaussian" or self.opt.data_mode == "moon":
-                    tmp = torch.where(test > 0.5, torch.ones(1), torch.zeros(1))
-                    nb_correct = torch.where(tmp.view(-1) == Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-                elif self.opt.data_mode == "cifar10":
-                    tmp = torch.max(test, dim=1).indices
-                    nb_correct = torch.where(tmp == Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-                else:
-                    sys.exit()
-                acc = nb_correct / X_test.size(0)
-                res_student.append(acc)
-
-                # diff = self.teacher.lin.weight - example.lin.weight
-                w = self.student.lin.weight
-                w = w / torch.norm(w)
-                diff = torch.linalg.norm(w_star - w, ord=2) ** 2
-                w_diff_student.append(diff.detach().clone().cpu())
-
-                with open(logname, 'a') as logfile:
-                    logwriter = csv.writer(logfile, delimiter=',')
-                    logwriter.writerow([idx, acc, diff.item()])
+                evaluator(self.student, idx)
+            evaluator.flush()
+            res_student, w_diff_student = evaluator.curves()
+            trace.save()
+            generated_samples, generated_labels = trace.samples, trace.labels
 
             if self.opt.data_mode == "gaussian" or self.opt.data_mode == "moon":
                 make_results_img_2d(self.opt, X, Y, generated_samples, generated_labels, res_sgd, res_baseline, res_student, w_diff_sgd, w_diff_baseline, w_diff_student, epoch, self.opt.seed)
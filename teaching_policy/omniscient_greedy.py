@@ -23,8 +23,16 @@ import teachers.utils as utils
 import matplotlib.pyplot as plt
 
 from utils.visualize import make_results_video, make_results_video_2d, make_results_img, make_results_img_2d, make_results
-from utils.data import init_data, load_experiment_result, plot_graphs_optimized
+from utils.data import init_data, load_experiment_result, plot_graphs_optimized, project_data
+from utils.run import start_run
+from utils.cache import TeacherStore, load_teacher
+from utils.manifest import stage_manifest
+from utils.projection import get_projection
+from datasets.stream import StreamingArray
 from utils.network import initialize_weights
+from utils.results import results_writer, flush_results
+from utils.trace import trace_recorder
+from utils.evaluation import Evaluator
 
 from experiments import SGDTrainer, IMTTrainer, WSTARTrainer
 
@@ -77,9 +85,10 @@ class Trainer:
 
         self.opt.model_name = "omniscient_optimized_" + self.opt.data_mode
 
-        self.opt.log_path = os.path.join(CONF.PATH.LOG, self.opt.model_name)
+        self.opt.log_path = os.path.join(CONF.PATH.LOG, self.opt.model_name, str(self.opt.seed), str(self.opt.model), str(self.opt.experiment))
         if not os.path.exists(self.opt.log_path):
             os.makedirs(self.opt.log_path)
+        self.run = start_run(self.opt)
 
         self.visualize = True
 
@@ -102,7 +111,7 @@ class Trainer:
             self.student_label = omniscient.OmniscientLinearStudent(self.opt.dim)
             self.label = omniscient.OmniscientLinearStudent(self.opt.dim)
             self.imt_label = omniscient.OmniscientLinearStudent(self.opt.dim)
-            torch.save(self.teacher.state_dict(), 'teacher_w0.pth')
+            self.opt.teacher_w0_path = TeacherStore().w0(self.opt, self.teacher)
 
     def set_train(self):
         """Convert all models to training mode
@@ -144,13 +153,10 @@ class Trainer:
         """
 
         print("Training")
+        manifest = stage_manifest(self.opt)
         # self.set_train()
 
-        if self.opt.init_data:
-            init_data(self.opt)
-
-        X = torch.load('X.pt')
-        Y = torch.load('Y.pt')
+        X, Y = init_data(self.opt)
 
         # Shuffle datasets
         # randomize = np.arange(X.shape[0])
@@ -161,24 +167,25 @@ class Trainer:
         nb_batch = int(self.opt.nb_train / self.opt.batch_size)
 
         if self.opt.data_mode == "cifar10":
-            X_train = torch.tensor(X[:self.opt.nb_train])
+            if isinstance(X, StreamingArray):
+                # the training pool stays on disk and is normalized batch by batch, only the test split is materialized
+                X_train = X.subset(0, self.opt.nb_train)
+                X_test = X[self.opt.nb_train:self.opt.nb_train + self.opt.nb_test]
+            else:
+                X_train = torch.tensor(X[:self.opt.nb_train])
+                X_test = torch.tensor(X[self.opt.nb_train:self.opt.nb_train + self.opt.nb_test])
             Y_train = torch.tensor(Y[:self.opt.nb_train], dtype=torch.long)
-            X_test = torch.tensor(X[self.opt.nb_train:self.opt.nb_train + self.opt.nb_test])
             Y_test = torch.tensor(Y[self.opt.nb_train:self.opt.nb_train + self.opt.nb_test], dtype=torch.long)
 
         elif self.opt.data_mode == "mnist":
-            X_train = torch.tensor(X[:self.opt.nb_train], dtype=torch.float)
             Y_train = torch.tensor(Y[:self.opt.nb_train], dtype=torch.float)
-            X_test = torch.tensor(X[self.opt.nb_train:self.opt.nb_train + self.opt.nb_test], dtype=torch.float)
             Y_test = torch.tensor(Y[self.opt.nb_train:self.opt.nb_train + self.opt.nb_test], dtype=torch.float)
 
-            X_train = X_train.reshape((self.opt.nb_train, self.opt.img_size**2))
-            X_test = X_test.reshape((self.opt.nb_test, self.opt.img_size**2))
-
-            proj_matrix = torch.empty(self.opt.img_size**2, self.opt.dim).normal_(mean=0, std=0.1)
+            proj_matrix = get_projection(self.opt)
             # proj_matrix = torch.load('proj_matrix.pt')
-            X_train = torch.matmul(X_train, proj_matrix)
-            X_test = torch.matmul(X_test, proj_matrix)
+            X_proj = project_data(self.opt, X, proj_matrix)
+            X_train = torch.from_numpy(X_proj[:self.opt.nb_train])
+            X_test = torch.from_numpy(X_proj[self.opt.nb_train:self.opt.nb_train + self.opt.nb_test])
 
         else:
             X_train = torch.tensor(X[:self.opt.nb_train], dtype=torch.float)
@@ -191,59 +198,61 @@ class Trainer:
         # ---------------------
 
         self.opt.experiment = "WSTAR"
-        if self.opt.train_wstar == False:
-            print("Start training {} ...".format(self.opt.experiment))
-            logname = os.path.join(self.opt.log_path, 'results' + '_' + self.opt.experiment + '_' + str(self.opt.seed) + '.csv')
-            if os.path.exists(logname):
-                os.remove(logname)
-            if not os.path.exists(logname):
-                with open(logname, 'w') as logfile:
-                    logwriter = csv.writer(logfile, delimiter=',')
-                    logwriter.writerow(['epoch', 'test acc'])
+        with TeacherStore().wstar(self.opt, self.teacher, recipe='greedy') as wstar:
+            if wstar.build:
+                print("Start training {} ...".format(self.opt.experiment))
+                logname = os.path.join(self.opt.log_path, 'results' + '_' + self.opt.experiment + '_' + str(self.opt.seed) + '.csv')
+                # rows still buffered from an earlier run of this stage go to the old file
+                flush_results(logname)
+                if os.path.exists(logname):
+                    os.remove(logname)
+                if not os.path.exists(logname):
+                    with open(logname, 'w') as logfile:
+                        logwriter = csv.writer(logfile, delimiter=',')
+                        logwriter.writerow(['epoch', 'test acc'])
+
+                nb_batch = int(self.opt.nb_train / self.opt.batch_size)
+
+                accuracies = []
+                self.scheduler = torch.optim.lr_scheduler.MultiStepLR(self.teacher.optim, milestones=[25], gamma=0.1)
+                for n in tqdm(range(self.opt.n_teacher_runs)):
+                    if n != 0:
+                        for i in range(nb_batch):
+                            i_min = i * self.opt.batch_size
+                            i_max = (i + 1) * self.opt.batch_size
+                            x = X_train[i_min:i_max].cuda()
+                            y = Y_train[i_min:i_max].cuda()
+
+                            y = F.one_hot(y.long(), num_classes=2).type(torch.cuda.FloatTensor)
+
+                            self.teacher.update(x, y)
+
+                    self.teacher.eval()
+                    test = self.teacher(X_test.cuda()).cpu()
+
+                    if self.opt.data_mode == "mnist" or self.opt.data_mode == "gaussian" or self.opt.data_mode == "moon" or self.opt.data_mode == "linearly_seperable" or self.opt.data_mode == "covid":
+                        # tmp = torch.where(test > 0.5, torch.ones(1), torch.zeros(1))
+                        tmp = torch.max(test, dim=1).indices
+                        nb_correct = torch.where(tmp.view(-1) == Y_test, torch.ones(1), torch.zeros(1)).sum().item()
+                    elif self.opt.data_mode == "cifar10":
+                        tmp = torch.max(test, dim=1).indices
+                        nb_correct = torch.where(tmp == Y_test, torch.ones(1), torch.zeros(1)).sum().item()
+                    else:
+                        sys.exit()
+                    acc = nb_correct / X_test.size(0)
+                    accuracies.append(acc)
+                    print("Accuracy:", acc)
+                    self.scheduler.step()
 
-            nb_batch = int(self.opt.nb_train / self.opt.batch_size)
+                    if acc > 0.6 and n == 0:
+                        sys.exit()
 
-            accuracies = []
-            self.scheduler = torch.optim.lr_scheduler.MultiStepLR(self.teacher.optim, milestones=[25], gamma=0.1)
-            for n in tqdm(range(self.opt.n_teacher_runs)):
-                if n != 0:
-                    for i in range(nb_batch):
-                        i_min = i * self.opt.batch_size
-                        i_max = (i + 1) * self.opt.batch_size
-                        x = X_train[i_min:i_max].cuda()
-                        y = Y_train[i_min:i_max].cuda()
-
-                        y = F.one_hot(y.long(), num_classes=2).type(torch.cuda.FloatTensor)
-
-                        self.teacher.update(x, y)
-
-                self.teacher.eval()
-                test = self.teacher(X_test.cuda()).cpu()
-
-                if self.opt.data_mode == "mnist" or self.opt.data_mode == "gaussian" or self.opt.data_mode == "moon" or self.opt.data_mode == "linearly_seperable" or self.opt.data_mode == "covid":
-                    # tmp = torch.where(test > 0.5, torch.ones(1), torch.zeros(1))
-                    tmp = torch.max(test, dim=1).indices
-                    nb_correct = torch.where(tmp.view(-1) == Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-                elif self.opt.data_mode == "cifar10":
-                    tmp = torch.max(test, dim=1).indices
-                    nb_correct = torch.where(tmp == Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-                else:
-                    sys.exit()
-                acc = nb_correct / X_test.size(0)
-                accuracies.append(acc)
-                print("Accuracy:", acc)
-                self.scheduler.step()
-
-                if acc > 0.6 and n == 0:
-                    sys.exit()
-
-                with open(logname, 'a') as logfile:
-                    logwriter = csv.writer(logfile, delimiter=',')
-                    logwriter.writerow([n, acc])
+                    results_writer(logname).writerow([n, acc])
 
-            torch.save(self.teacher.state_dict(), 'teacher_wstar.pth')
+                wstar.save(self.teacher.state_dict())
+        self.opt.teacher_wstar_path = wstar.path
 
-        self.teacher.load_state_dict(torch.load('teacher_wstar.pth'))
+        self.teacher.load_state_dict(load_teacher(self.opt.teacher_wstar_path))
         w_star = self.teacher.lin.weight
         w_star = w_star / torch.norm(w_star)
 
@@ -252,9 +261,9 @@ class Trainer:
         # ---------------------
 
         self.opt.experiment = "SGD"
-        if self.opt.train_sgd == False:
+        if self.opt.train_sgd == False and manifest.start(self.opt):
             sgd_example = utils.BaseLinear(self.opt.dim)
-            sgd_example.load_state_dict(torch.load('teacher_w0.pth'))
+            sgd_example.load_state_dict(load_teacher(self.opt.teacher_w0_path))
 
             print("Start training {} ...".format(self.opt.experiment))
             logname = os.path.join(self.opt.log_path, 'results' + '_' + self.opt.experiment + '_' + str(self.opt.seed) + '.csv')
@@ -270,6 +279,7 @@ class Trainer:
 
             nb_batch = int(self.opt.nb_train / self.opt.batch_size)
 
+            evaluator = Evaluator(self.opt, X_test, Y_test, w_star, logname, argmax=True)
             for idx in tqdm(range(self.opt.n_iter)):
                 if idx != 0:
                     i = torch.randint(0, nb_batch, size=(1,)).item()
@@ -279,34 +289,9 @@ class Trainer:
 
                     sgd_example.update(sample, label)
 
-                sgd_example.eval()
-                test = sgd_example(X_test.cuda()).cpu()
-
-                # a, b = plot_classifier(model, X_train.max(axis=0), X_train.min(axis=0))
-                # a_example.append(a)
-                # b_example.append(b)
-
-                if self.opt.data_mode == "mnist" or self.opt.data_mode == "gaussian" or self.opt.data_mode == "moon" or self.opt.data_mode == "covid":
-                    tmp = torch.max(test, dim=1).indices
-                    # tmp = torch.where(test > 0.5, torch.ones(1), torch.zeros(1))
-                    nb_correct = torch.where(tmp.view(-1) == Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-                elif self.opt.data_mode == "cifar10":
-                    tmp = torch.max(test, dim=1).indices
-                    nb_correct = torch.where(tmp == Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-                else:
-                    sys.exit()
-
-                acc = nb_correct / X_test.size(0)
-                res_sgd.append(acc)
-
-                w = sgd_example.lin.weight
-                w = w / torch.norm(w)
-                diff = torch.linalg.norm(w_star - w, ord=2) ** 2
-                w_diff_sgd.append(diff.detach().clone().cpu())
-
-                with open(logname, 'a') as logfile:
-                    logwriter = csv.writer(logfile, delimiter=',')
-                    logwriter.writerow([idx, acc, diff.item()])
+                evaluator(sgd_example, idx)
+            evaluator.flush()
+            manifest.done(self.opt.experiment)
 
         res_sgd, w_diff_sgd = load_experiment_result(self.opt)
 
@@ -316,8 +301,8 @@ class Trainer:
 
         # self.opt.experiment = "IMT_Baseline_random_label"
         self.opt.experiment = "IMT_Baseline"
-        if self.opt.train_baseline == False:
-            self.baseline.load_state_dict(torch.load('teacher_w0.pth'))
+        if self.opt.train_baseline == False and manifest.start(self.opt):
+            self.baseline.load_state_dict(load_teacher(self.opt.teacher_w0_path))
 
             print("Start training {} ...".format(self.opt.experiment))
             logname = os.path.join(self.opt.log_path, 'results' + '_' + self.opt.experiment + '_' + str(self.opt.seed) + '.csv')
@@ -331,6 +316,7 @@ class Trainer:
             b_baseline = []
             w_diff_baseline = []
 
+            evaluator = Evaluator(self.opt, X_test, Y_test, w_star, logname, argmax=True)
             for t in tqdm(range(self.opt.n_iter)):
                 if t != 0:
                     if self.opt.experiment == "IMT_Baseline":
@@ -344,40 +330,9 @@ class Trainer:
 
                     self.baseline.update(best_sample, best_label)
 
-                self.baseline.eval()
-                test = self.baseline(X_test.cuda()).cpu()
-
-                # a, b = plot_classifier(model, X.max(axis=0), X.min(axis=0))
-                # a_baseline.append(a)
-                # b_baseline.append(b)
-
-                if self.opt.data_mode == "mnist" or self.opt.data_mode == "gaussian" or self.opt.data_mode == "moon" or self.opt.data_mode == "linearly_seperable" or self.opt.data_mode == "covid":
-                    tmp = torch.max(test, dim=1).indices
-                    # tmp = torch.where(test > 0.5, torch.ones(1), torch.zeros(1))
-                    nb_correct = torch.where(tmp.view(-1) == Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-                elif self.opt.data_mode == "cifar10":
-                    tmp = torch.max(test, dim=1).indices
-                    nb_correct = torch.where(tmp == Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-                else:
-                    sys.exit()
-                acc_base = nb_correct / X_test.size(0)
-                res_baseline.append(acc_base)
-
-                w = self.baseline.lin.weight
-                w = w / torch.norm(w)
-                diff = torch.linalg.norm(w_star - w, ord=2) ** 2
-                w_diff_baseline.append(diff.detach().clone().cpu())
-
-                print("iter", t, "acc IMT", acc_base)
-
-                # sys.stdout.write("\r" + str(t) + "/" + str(self.opt.n_iter) + ", idx=" + str(i) + " " * 100)
-                # sys.stdout.flush()
-
-                print("Base line trained\n")
-
-                with open(logname, 'a') as logfile:
-                    logwriter = csv.writer(logfile, delimiter=',')
-                    logwriter.writerow([t, acc_base, diff.item()])
+                evaluator(self.baseline, t)
+            evaluator.flush()
+            manifest.done(self.opt.experiment)
 
         res_baseline, w_diff_baseline = load_experiment_result(self.opt)
 
@@ -386,7 +341,7 @@ class Trainer:
         # ---------------------
 
         self.opt.experiment = "Student"
-        if self.opt.train_student == False:
+        if self.opt.train_student == False and manifest.start(self.opt):
             print("Start training {} ...".format(self.opt.experiment))
             logname = os.path.join(self.opt.log_path, 'results' + '_' + self.opt.experiment + '_' + str(self.opt.seed) + '.csv')
             if not os.path.exists(logname):
@@ -396,56 +351,25 @@ class Trainer:
             res_student = []
             a_student = []
             b_student = []
-            generated_samples = np.zeros(2)
+            trace = trace_recorder(self.opt, self.opt.n_iter - 1, self.opt.experiment)
             w_diff_student = []
-            self.student.load_state_dict(torch.load('teacher_w0.pth'))
+            self.student.load_state_dict(load_teacher(self.opt.teacher_w0_path))
+            evaluator = Evaluator(self.opt, X_test, Y_test, w_star, logname, argmax=True)
             for t in tqdm(range(self.opt.n_iter)):
                 if t != 0:
                     # labels = torch.randint(0, 1, (self.opt.batch_size,), dtype=torch.float).cuda()
                     new_data, new_labels = self.teacher.generate_example(self.opt, self.student, X_train.cuda(), Y_train.cuda(), optimize_label=False)
 
-                    generated_data = new_data.detach().clone().cpu().numpy()
-                    generated_label = new_labels.detach().clone().cpu().numpy()
-                    if t == 1:
-                        generated_samples = generated_data # [np.newaxis, :]
-                        generated_labels = generated_label # [np.newaxis, :]
-                    else:
-                        generated_samples = np.concatenate((generated_samples, generated_data), axis=0)
-                        generated_labels = np.concatenate((generated_labels, generated_label), axis=0)
+                    trace.record(new_data, new_labels)
 
                     self.student.update(torch.cuda.FloatTensor(new_data), new_labels)
-                self.student.eval()
-                test = self.student(X_test.cuda()).cpu()
-
                 a, b = plot_classifier(self.student, X.max(axis=0), X.min(axis=0))
                 a_student.append(a)
                 b_student.append(b)
-
-                if self.opt.data_mode == "mnist" or self.opt.data_mode == "gaussian" or self.opt.data_mode == "moon" or self.opt.data_mode == "linearly_seperable":
-                    # tmp = torch.where(test > 0.5, torch.ones(1), torch.zeros(1))
-                    tmp = torch.max(test, dim=1).indices
-                    nb_correct = torch.where(tmp.view(-1) == Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-                elif self.opt.data_mode == "cifar10":
-                    tmp = torch.max(test, dim=1).indices
-                    nb_correct = torch.where(tmp == Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-                else:
-                    sys.exit()
-                acc = nb_correct / X_test.size(0)
-                res_student.append(acc)
-
-                w = self.student.lin.weight
-                w = w / torch.norm(w)
-                diff = torch.linalg.norm(w_star - w, ord=2) ** 2
-                w_diff_student.append(diff.detach().clone().cpu())
-
-                print("iter", t, "acc student", acc)
-
-                # sys.stdout.write("\r" + str(t) + "/" + str(self.opt.n_iter) + ", idx=" + str(i) + " " * 100)
-                # sys.stdout.flush()
-
-                with open(logname, 'a') as logfile:
-                    logwriter = csv.writer(logfile, delimiter=',')
-                    logwriter.writerow([t, acc, diff.item()])
+                evaluator(self.student, t)
+            evaluator.flush()
+            trace.save()
+            manifest.done(self.opt.experiment)
 
         res_student, w_diff_student = load_experiment_result(self.opt)
 
@@ -453,7 +377,7 @@ class Trainer:
         #  Train Student with Label
         # ---------------------
         self.opt.experiment = "Student_with_Label"
-        if self.opt.train_student == False:
+        if self.opt.train_student == False and manifest.start(self.opt):
             print("Start training {} ...".format(self.opt.experiment))
             logname = os.path.join(self.opt.log_path, 'results' + '_' + self.opt.experiment + '_' + str(self.opt.seed) + '.csv')
             if not os.path.exists(logname):
@@ -465,45 +389,20 @@ class Trainer:
             b_student_label = []
             generated_samples = np.zeros(2)
             w_diff_student_label = []
-            self.student_label.load_state_dict(torch.load('teacher_w0.pth'))
+            self.student_label.load_state_dict(load_teacher(self.opt.teacher_w0_path))
+            evaluator = Evaluator(self.opt, X_test, Y_test, w_star, logname, argmax=True)
             for t in tqdm(range(self.opt.n_iter)):
                 if t != 0:
                     # labels = torch.randint(0, 1, (self.opt.batch_size,), dtype=torch.float).cuda()
                     new_data, new_labels = self.teacher.generate_example(self.opt, self.student_label, X_train.cuda(), Y_train.cuda(), optimize_label=True)
 
                     self.student_label.update(torch.cuda.FloatTensor(new_data), new_labels)
-                self.student_label.eval()
-                test = self.student_label(X_test.cuda()).cpu()
-
                 a, b = plot_classifier(self.student_label, X.max(axis=0), X.min(axis=0))
                 a_student_label.append(a)
                 b_student_label.append(b)
-
-                if self.opt.data_mode == "mnist" or self.opt.data_mode == "gaussian" or self.opt.data_mode == "moon" or self.opt.data_mode == "linearly_seperable":
-                    # tmp = torch.where(test > 0.5, torch.ones(1), torch.zeros(1))
-                    tmp = torch.max(test, dim=1).indices
-                    nb_correct = torch.where(tmp.view(-1) == Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-                elif self.opt.data_mode == "cifar10":
-                    tmp = torch.max(test, dim=1).indices
-                    nb_correct = torch.where(tmp == Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-                else:
-                    sys.exit()
-                acc = nb_correct / X_test.size(0)
-                res_student_label.append(acc)
-
-                w = self.student_label.lin.weight
-                w = w / torch.norm(w)
-                diff = torch.linalg.norm(w_star - w, ord=2) ** 2
-                w_diff_student_label.append(diff.detach().clone().cpu())
-
-                print("iter", t, "acc student with label", acc)
-
-                # sys.stdout.write("\r" + str(t) + "/" + str(self.opt.n_iter) + ", idx=" + str(i) + " " * 100)
-                # sys.stdout.flush()
-
-                with open(logname, 'a') as logfile:
-                    logwriter = csv.writer(logfile, delimiter=',')
-                    logwriter.writerow([t, acc, diff.item()])
+                evaluator(self.student_label, t)
+            evaluator.flush()
+            manifest.done(self.opt.experiment)
 
         res_student_label, w_diff_student_label = load_experiment_result(self.opt)
 
@@ -511,7 +410,7 @@ class Trainer:
         #  Train Label
         # ---------------------
         self.opt.experiment = "Label"
-        if self.opt.train_student == False:
+        if self.opt.train_student == False and manifest.start(self.opt):
             print("Start training {} ...".format(self.opt.experiment))
             logname = os.path.join(self.opt.log_path, 'results' + '_' + self.opt.experiment + '_' + str(self.opt.seed) + '.csv')
             if not os.path.exists(logname):
@@ -523,45 +422,20 @@ class Trainer:
             b_label = []
             generated_samples = np.zeros(2)
             w_diff_label = []
-            self.label.load_state_dict(torch.load('teacher_w0.pth'))
+            self.label.load_state_dict(load_teacher(self.opt.teacher_w0_path))
+            evaluator = Evaluator(self.opt, X_test, Y_test, w_star, logname, argmax=True)
             for t in tqdm(range(self.opt.n_iter)):
                 if t != 0:
                     # labels = torch.randint(0, 1, (self.opt.batch_size,), dtype=torch.float).cuda()
                     new_data, new_labels = self.teacher.generate_label(self.opt, self.label, X_train.cuda(), Y_train.cuda())
 
                     self.label.update(torch.cuda.FloatTensor(new_data), new_labels)
-                self.label.eval()
-                test = self.label(X_test.cuda()).cpu()
-
                 a, b = plot_classifier(self.label, X.max(axis=0), X.min(axis=0))
                 a_label.append(a)
                 b_label.append(b)
-
-                if self.opt.data_mode == "mnist" or self.opt.data_mode == "gaussian" or self.opt.data_mode == "moon" or self.opt.data_mode == "linearly_seperable":
-                    # tmp = torch.where(test > 0.5, torch.ones(1), torch.zeros(1))
-                    tmp = torch.max(test, dim=1).indices
-                    nb_correct = torch.where(tmp.view(-1) == Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-                elif self.opt.data_mode == "cifar10":
-                    tmp = torch.max(test, dim=1).indices
-                    nb_correct = torch.where(tmp == Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-                else:
-                    sys.exit()
-                acc = nb_correct / X_test.size(0)
-                res_label.append(acc)
-
-                w = self.label.lin.weight
-                w = w / torch.norm(w)
-                diff = torch.linalg.norm(w_star - w, ord=2) ** 2
-                w_diff_label.append(diff.detach().clone().cpu())
-
-                print("iter", t, "acc label", acc)
-
-                # sys.stdout.write("\r" + str(t) + "/" + str(self.opt.n_iter) + ", idx=" + str(i) + " " * 100)
-                # sys.stdout.flush()
-
-                with open(logname, 'a') as logfile:
-                    logwriter = csv.writer(logfile, delimiter=',')
-                    logwriter.writerow([t, acc, diff.item()])
+                evaluator(self.label, t)
+            evaluator.flush()
+            manifest.done(self.opt.experiment)
 
         res_label, w_diff_label = load_experiment_result(self.opt)
 
@@ -569,7 +443,7 @@ class Trainer:
         #  Train IMT + Label
         # ---------------------
         self.opt.experiment = "IMT_Label"
-        if self.opt.train_baseline == False:
+        if self.opt.train_baseline == False and manifest.start(self.opt):
             print("Start training {} ...".format(self.opt.experiment))
             logname = os.path.join(self.opt.log_path, 'results' + '_' + self.opt.experiment + '_' + str(self.opt.seed) + '.csv')
             if not os.path.exists(logname):
@@ -581,45 +455,20 @@ class Trainer:
             b_imt_label = []
             generated_samples = np.zeros(2)
             w_diff_imt_label = []
-            self.imt_label.load_state_dict(torch.load('teacher_w0.pth'))
+            self.imt_label.load_state_dict(load_teacher(self.opt.teacher_w0_path))
+            evaluator = Evaluator(self.opt, X_test, Y_test, w_star, logname, argmax=True)
             for t in tqdm(range(self.opt.n_iter)):
                 if t != 0:
                     # labels = torch.randint(0, 1, (self.opt.batch_size,), dtype=torch.float).cuda()
                     new_data, new_labels = self.teacher.select_example(self.imt_label, self.opt, X_train.cuda(), Y_train.cuda(), optimize_label=True)
 
                     self.imt_label.update(torch.cuda.FloatTensor(new_data), new_labels)
-                self.imt_label.eval()
-                test = self.imt_label(X_test.cuda()).cpu()
-
                 a, b = plot_classifier(self.imt_label, X.max(axis=0), X.min(axis=0))
                 a_imt_label.append(a)
                 b_imt_label.append(b)
-
-                if self.opt.data_mode == "mnist" or self.opt.data_mode == "gaussian" or self.opt.data_mode == "moon" or self.opt.data_mode == "linearly_seperable":
-                    # tmp = torch.where(test > 0.5, torch.ones(1), torch.zeros(1))
-                    tmp = torch.max(test, dim=1).indices
-                    nb_correct = torch.where(tmp.view(-1) == Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-                elif self.opt.data_mode == "cifar10":
-                    tmp = torch.max(test, dim=1).indices
-                    nb_correct = torch.where(tmp == Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-                else:
-                    sys.exit()
-                acc = nb_correct / X_test.size(0)
-                res_imt_label.append(acc)
-
-                w = self.imt_label.lin.weight
-                w = w / torch.norm(w)
-                diff = torch.linalg.norm(w_star - w, ord=2) ** 2
-                w_diff_imt_label.append(diff.detach().clone().cpu())
-
-                print("iter", t, "acc student", acc)
-
-                # sys.stdout.write("\r" + str(t) + "/" + str(self.opt.n_iter) + ", idx=" + str(i) + " " * 100)
-                # sys.stdout.flush()
-
-                with open(logname, 'a') as logfile:
-                    logwriter = csv.writer(logfile, delimiter=',')
-                    logwriter.writerow([t, acc, diff.item()])
+                evaluator(self.imt_label, t)
+            evaluator.flush()
+            manifest.done(self.opt.experiment)
 
         res_imt_label, w_diff_imt_label = load_experiment_result(self.opt)
 
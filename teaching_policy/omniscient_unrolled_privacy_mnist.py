@@ -35,7 +35,14 @@ from datasets import BaseDataset
 import csv
 
 from utils.data import init_data, load_experiment_result, plot_graphs, initialize_weights
+from utils.run import start_run
+from utils.cache import TeacherStore, load_teacher
+from utils.manifest import stage_manifest
+from utils.projection import get_projection
 from utils.visualize import make_results_video, make_results_video_2d, make_results_img, make_results_img_2d
+from utils.results import results_writer
+from utils.trace import trace_recorder
+from utils.evaluation import Evaluator
 
 from experiments import SGDTrainer, IMTTrainer, WSTARTrainer
 
@@ -106,9 +113,10 @@ class Trainer:
 
         self.opt.model_name = "omniscient_privacy_" + self.opt.data_mode
 
-        self.opt.log_path = os.path.join(CONF.PATH.LOG, self.opt.model_name)
+        self.opt.log_path = os.path.join(CONF.PATH.LOG, self.opt.model_name, str(self.opt.seed), str(self.opt.model), str(self.opt.experiment))
         if not os.path.exists(self.opt.log_path):
             os.makedirs(self.opt.log_path)
+        self.run = start_run(self.opt)
 
         self.visualize = True
 
@@ -128,7 +136,7 @@ class Trainer:
             self.teacher.apply(initialize_weights)
             self.student = omniscient.OmniscientLinearStudent(self.opt.dim)
             self.baseline = omniscient.OmniscientLinearStudent(self.opt.dim)
-            torch.save(self.teacher.state_dict(), 'teacher_w0.pth')
+            self.opt.teacher_w0_path = TeacherStore().w0(self.opt, self.teacher)
 
     def set_train(self):
         """Convert all models to training mode
@@ -180,13 +188,10 @@ class Trainer:
         """
 
         print("Training")
+        manifest = stage_manifest(self.opt)
         # self.set_train()
 
-        if self.opt.init_data:
-            init_data(self.opt)
-
-        X = torch.load('X.pt')
-        Y = torch.load('Y.pt')
+        X, Y = init_data(self.opt)
 
         # Shuffle datasets
         # randomize = np.arange(X.shape[0])
@@ -219,7 +224,7 @@ class Trainer:
             X_train = X_train.reshape((self.opt.nb_train, self.opt.img_size**2))
             X_test = X_test.reshape((self.opt.nb_test, self.opt.img_size**2))
 
-            proj_matrix = torch.empty(self.opt.img_size**2, self.opt.dim).normal_(mean=0, std=0.1)
+            proj_matrix = get_projection(self.opt)
             X_train = X_train @ proj_matrix
             X_test = X_test @ proj_matrix
 
@@ -239,11 +244,14 @@ class Trainer:
         #  Train Teacher
         # ---------------------
 
-        if self.opt.train_wstar == True:
-            wstar_trainer = WSTARTrainer(self.opt, X_train, Y_train, X_test, Y_test)
-            wstar_trainer.train(self.teacher)
+        with TeacherStore().wstar(self.opt, self.teacher) as wstar:
+            if wstar.build:
+                wstar_trainer = WSTARTrainer(self.opt, X_train, Y_train, X_test, Y_test)
+                wstar_trainer.train(self.teacher)
+                wstar.save(self.teacher.state_dict())
+        self.opt.teacher_wstar_path = wstar.path
 
-        self.teacher.load_state_dict(torch.load('teacher_wstar.pth'))
+        self.teacher.load_state_dict(load_teacher(self.opt.teacher_wstar_path))
         w_star = self.teacher.lin.weight
         w_star = w_star / torch.norm(w_star)
 
@@ -253,13 +261,14 @@ class Trainer:
         # ---------------------
 
         self.opt.experiment = "SGD"
-        if self.opt.train_sgd == True:
+        if self.opt.train_sgd == True and manifest.start(self.opt):
 
             sgd_example = utils.BaseLinear(self.opt.dim)
-            sgd_example.load_state_dict(torch.load('teacher_w0.pth'))
+            sgd_example.load_state_dict(load_teacher(self.opt.teacher_w0_path))
 
             sgd_trainer = SGDTrainer(self.opt, X_train, Y_train, X_test, Y_test, data_train)
             random_samples, random_labels = sgd_trainer.train(sgd_example, w_star)
+            manifest.done(self.opt.experiment)
 
         res_sgd, w_diff_sgd = load_experiment_result(self.opt)
 
@@ -268,11 +277,12 @@ class Trainer:
         # ---------------------
 
         self.opt.experiment = "IMT_Baseline"
-        if self.opt.train_baseline == True:
-            self.baseline.load_state_dict(torch.load('teacher_w0.pth'))
+        if self.opt.train_baseline == True and manifest.start(self.opt):
+            self.baseline.load_state_dict(load_teacher(self.opt.teacher_w0_path))
 
             imt_trainer = IMTTrainer(self.opt, X_train, Y_train, X_test, Y_test, data_train)
             selected_samples, selected_labels = imt_trainer.train(self.baseline, self.teacher, w_star)
+            manifest.done(self.opt.experiment)
 
         res_baseline, w_diff_baseline = load_experiment_result(self.opt)
 
@@ -301,11 +311,9 @@ class Trainer:
         netG.apply(weights_init)
         optimG = torch.optim.Adam(netG.parameters(), lr=self.opt.netG_lr, betas=(0.9, 0.999), eps=1e-08, weight_decay=1e-04, amsgrad=False)
 
-        res_student = []
         a_student = []
         b_student = []
         loss_student = []
-        w_diff_student = []
 
         # tmp_student.load_state_dict(torch.load('teacher_w0.pth'))
         # w_init = tmp_student.state_dict()
@@ -326,7 +334,9 @@ class Trainer:
         cls = torch.arange(self.opt.n_classes)
         onehot = torch.zeros(self.opt.n_classes, self.opt.n_classes).scatter_(1, cls.view(self.opt.n_classes, 1), 1)
 
-        self.student.load_state_dict(torch.load('teacher_w0.pth'))
+        self.student.load_state_dict(load_teacher(self.opt.teacher_w0_path))
+        trace = trace_recorder(self.opt, self.opt.n_iter - 1, self.opt.experiment)
+        evaluator = Evaluator(self.opt, X_test, Y_test, w_star, logname)
         for idx in tqdm(range(self.opt.n_iter)):
             if idx != 0:
                 w_t = self.student.lin.weight
@@ -343,12 +353,7 @@ class Trainer:
                 # x = torch.cat((w_t, w_t-w_star), dim=1)
                 generated_sample = netG(x, gt_y_onehot)
 
-                if idx == 1:
-                    generated_samples = generated_sample.cpu().detach().numpy()  # [np.newaxis, :]
-                    generated_labels = gt_y.unsqueeze(1).cpu().detach().numpy()  # [np.newaxis, :]
-                else:
-                    generated_samples = np.concatenate((generated_samples, generated_sample.cpu().detach().numpy()), axis=0)
-                    generated_labels = np.concatenate((generated_labels, gt_y.unsqueeze(1).cpu().detach().numpy()), axis=0)
+                trace.record(generated_sample, gt_y.unsqueeze(1))
 
                 if self.opt.data_mode == "mnist":
                     generated_sample = generated_sample.reshape((self.opt.batch_size, self.opt.img_size**2))
@@ -357,34 +362,14 @@ class Trainer:
                 self.student.update(generated_sample.detach(), gt_y.unsqueeze(1))
 
 
-            self.student.eval()
-            test = self.student(X_test.cuda()).cpu()
-
             a, b = plot_classifier(self.student, X.max(axis=0), X.min(axis=0))
             a_student.append(a)
             b_student.append(b)
-
-            if self.opt.data_mode == "mnist" or self.opt.data_mode == "gaussian" or self.opt.data_mode == "moon":
-                tmp = torch.where(test > 0.5, torch.ones(1), torch.zeros(1))
-                nb_correct = torch.where(tmp.view(-1) == Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-            elif self.opt.data_mode == "cifar10":
-                tmp = torch.max(test, dim=1).indices
-                nb_correct = torch.where(tmp == Y_test, torch.ones(1), torch.zeros(1)).sum().item()
-            else:
-                sys.exit()
-            acc = nb_correct / X_test.size(0)
-            res_student.append(acc)
-
-            w = self.student.lin.weight
-            w = w / torch.norm(w)
-            diff = torch.linalg.norm(w_star - w, ord=2) ** 2
-            w_diff_student.append(diff.detach().clone().cpu())
-
-            with open(logname, 'a') as logfile:
-                logwriter = csv.writer(logfile, delimiter=',')
-                logwriter.writerow([idx, acc, diff.item()])
-
-            print("acc", acc)
+            evaluator(self.student, idx)
+        evaluator.flush()
+        res_student, w_diff_student = evaluator.curves()
+        trace.save()
+        generated_samples, generated_labels = trace.samples, trace.labels
 
         self.perceptual_loss(random_samples, selected_samples, generated_samples, feat_privacy_set, net, proj_matrix)
 
@@ -415,8 +400,6 @@ class Trainer:
 
         pdist = torch.nn.PairwiseDistance(p=2)
 
-        unproj_matrix = torch.linalg.pinv(proj_matrix)
-
         loss = []
         img_shape = (1, 28, 28)
         experiments_lst = ['SGD', 'IMT_Baseline', 'Student']
@@ -464,9 +447,7 @@ class Trainer:
             baseline_perceptual_loss = experiment_dict['IMT_Baseline'][t]
             student_perceptual_loss = experiment_dict['Student'][t]
 
-            with open(logname, 'a') as logfile:
-                logwriter = csv.writer(logfile, delimiter=',')
-                logwriter.writerow([t, sgd_perceptual_loss, baseline_perceptual_loss, student_perceptual_loss])
+            results_writer(logname).writerow([t, sgd_perceptual_loss, baseline_perceptual_loss, student_perceptual_loss])
 
         return loss
 
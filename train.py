@@ -4,6 +4,12 @@ import os
 import argparse
 import sys
 import csv
+import copy
+import json
+import time
+import queue
+import traceback
+import multiprocessing
 import itertools
 import importlib
 import yaml
@@ -11,6 +17,7 @@ import random
 import torch
 import numpy as np
 from options.options import Options
+from utils.manifest import sweep_manifest, fail_running_stages, avoided_compute
 
 sys.path.append('..') #Hack add ROOT DIR
 from baseconfig import CONF
@@ -45,28 +52,28 @@ def get_parser():
     return parser
 
 
-if __name__ == "__main__":
-    # command line parser
-    parser = get_parser()
-    p = parser.parse_args()
-
-    # base config parser
-    options = Options()
-    opts = options.parse()
-
-    # specify the config file
-    config = load_config(p.config + '.yaml')
-    opts.set_defaults(**config)
-    args = opts.parse_args()
-
-    curr_comb = combination[args.idx]
-
+def combination_args(args, curr_comb):
+    """Options of one (seed, model, experiment) of the grid"""
+    args = copy.copy(args)
     # generate data
     args.init_data = True
 
     args.seed = curr_comb[0]
     args.model = curr_comb[1]
     args.experiment = curr_comb[2]
+    return args
+
+
+def run_combination(args, curr_comb):
+    """
+    Train one (seed, model, experiment) of the grid, unless the manifest has it done with the same options.
+    A run that crashed is run again, its policy skipping the stages the manifest has done.
+    """
+    args = combination_args(args, curr_comb)
+
+    manifest = sweep_manifest()
+    if not manifest.start(args, args.teaching_policy, artifacts=[]):
+        return
 
     # set seed
     torch.manual_seed(args.seed)
@@ -78,6 +85,182 @@ if __name__ == "__main__":
     module_name = "teaching_policy." + args.teaching_policy
     module = importlib.import_module(module_name)
 
-    trainer = module.Trainer(args)
+    try:
+        trainer = module.Trainer(args)
+
+        trainer.main()
+    except BaseException as e:
+        fail_running_stages(repr(e))
+        raise
+    manifest.done(args.teaching_policy)
+    if avoided_compute() > 0:
+        print("{:.0f}s of compute avoided by skipping the stages already done".format(avoided_compute()))
+
+
+# ---------------------
+#  Sweep
+# ---------------------
+
+def n_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def cost_key(args, curr_comb):
+    # the cost of a run does not depend on its seed
+    return "{}/{}/{}/{}".format(args.teaching_policy, args.config, curr_comb[1], curr_comb[2])
+
+
+def load_costs(path):
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_costs(path, costs):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(costs, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def sweep_run(task):
+    """Run one combination in a sweep worker, its output going to log_file"""
+    idx, args, curr_comb, n_threads, log_file = task
+    torch.set_num_threads(n_threads)
+    start = time.time()
+    error = None
+    with open(log_file, 'w') as log:
+        # redirect the file descriptors too, for tqdm and the output of the native code
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            run_combination(args, curr_comb)
+        except (Exception, SystemExit):
+            # some policies sys.exit() on a bad teacher, a failure of the run rather than of the sweep
+            error = traceback.format_exc()
+            print(error)
+        sys.stdout.flush()
+        sys.stderr.flush()
+    return idx, curr_comb, time.time() - start, error, avoided_compute()
+
+
+def sweep_process(task, results):
+    results.put(sweep_run(task))
+
+
+def sweep(args):
+    """
+    Run the whole grid in up to sweep_workers processes of sweep_threads torch threads each (0: all the
+    cores), every run in a new process and seeded as with --idx. The processes are not daemonic, so that a
+    run can render its videos and step its environments in processes of its own. The runs start by
+    decreasing duration of the same policy, config, model and experiment in the previous sweeps, the
+    unknown ones first. Every run logs under LOG/<model_name>/<seed>/<model>/<experiment> and keeps its
+    artifacts in a run directory of its own, so any runs can overlap. The runs the manifest has done with the same options are skipped (all of them are run again with --rerun).
+    """
+    manifest = sweep_manifest()
+    avoided = 0.0
+    todo = []
+    for i, curr_comb in enumerate(combination):
+        cell_args = combination_args(args, curr_comb)
+        if not args.rerun and manifest.is_done(cell_args, args.teaching_policy):
+            avoided += manifest.record(cell_args, args.teaching_policy).get('duration', 0.0)
+        else:
+            todo.append(i)
+    if len(todo) < len(combination):
+        print("Skipping {} runs done in a previous sweep ({:.0f}s of compute)".format(len(combination) - len(todo), avoided))
+    if not todo:
+        return []
+
+    n_workers = args.sweep_workers if args.sweep_workers > 0 else n_cores()
+    n_workers = max(1, min(n_workers, len(todo)))
+    n_threads = args.sweep_threads if args.sweep_threads > 0 else max(1, n_cores() // n_workers)
+    if args.video_workers <= 0:
+        args.video_workers = n_threads
+
+    costs_path = os.path.join(CONF.PATH.LOG, 'sweep_costs.json')
+    costs = load_costs(costs_path)
+    order = sorted(todo, key=lambda i: -costs.get(cost_key(args, combination[i]), float('inf')))
+
+    log_dir = os.path.join(CONF.PATH.LOG, args.model_name, 'sweep')
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir, exist_ok=True)
+    tasks = [(i, args, combination[i], n_threads,
+              os.path.join(log_dir, '{}_{}_{}_{}.log'.format(i, *combination[i]))) for i in order]
+
+    print("Sweep of {} runs, {} workers of {} threads, logs in {}".format(len(tasks), n_workers, n_threads, log_dir))
+    n_tasks = len(tasks)
+    failed = []
+    start = time.time()
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    running = {}
+    k = 0
+    while tasks or running:
+        # start the longest runs
+        while tasks and len(running) < n_workers:
+            task = tasks.pop(0)
+            process = ctx.Process(target=sweep_process, args=(task, results))
+            process.start()
+            running[task[0]] = (process, task, time.time())
+
+        try:
+            idx, curr_comb, seconds, error, skipped = results.get(timeout=1)
+        except queue.Empty:
+            # a process exits once its result is in the queue, so one that is dead and has none was killed
+            dead = [idx for idx, (process, _, _) in running.items() if not process.is_alive()]
+            if not dead or not results.empty():
+                continue
+            idx = dead[0]
+            process, task, started = running[idx]
+            curr_comb, seconds, skipped = task[2], time.time() - started, 0.0
+            error = "exit code {}".format(process.exitcode)
+        process, _, _ = running.pop(idx)
+        process.join()
+
+        k += 1
+        avoided += skipped
+        if error is None:
+            costs[cost_key(args, curr_comb)] = seconds
+            save_costs(costs_path, costs)
+        else:
+            failed.append(idx)
+        print("[{}/{}] idx {} {} {} in {:.0f}s, {:.0f}s elapsed".format(
+            k, n_tasks, idx, curr_comb, "failed" if error else "done", seconds, time.time() - start))
+
+    print("{:.0f}s of compute avoided by the manifest".format(avoided))
+    if failed:
+        print("Failed runs (see their logs):", sorted(failed))
+    return failed
+
+
+if __name__ == "__main__":
+    # python train.py sweep --config ... runs the whole grid instead of combination[idx]
+    run_sweep = len(sys.argv) > 1 and sys.argv[1] == 'sweep'
+    if run_sweep:
+        del sys.argv[1]
+
+    # command line parser
+    parser = get_parser()
+    # the other arguments are the ones of Options
+    p, _ = parser.parse_known_args()
+
+    # base config parser
+    options = Options()
+    opts = options.parse()
+
+    # specify the config file
+    config = load_config(p.config + '.yaml')
+    opts.set_defaults(**config)
+    args = opts.parse_args()
+
+    if run_sweep:
+        sys.exit(1 if sweep(args) else 0)
 
-    trainer.main()
+    run_combination(args, combination[args.idx])
@@ -0,0 +1,133 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+class BatchAugment:
+    """Random crop, horizontal flip and Cutout applied to a whole (B, C, H, W) batch after collation.
+
+    Same augmentations as transforms.RandomCrop(H, padding) + transforms.RandomHorizontalFlip() in the
+    per-sample pipeline and as the Cutout of mixup_data_augmentation.py, but all the random parameters
+    of a batch (crop offsets, flips, hole centers, mixup permutation and lambdas) are drawn in one call
+    from generators seeded once, and the augmentation itself is a few tensor ops on the device of the
+    batch. The training loop is then no longer bound by the DataLoader workers, and two runs with the
+    same seed see the same augmented batches whatever the number of workers or the device.
+    """
+    def __init__(self, crop_padding=0, flip=False, n_holes=0, cutout_length=16, fill=None, seed=0):
+        """
+        :param crop_padding: padding of the random crop, 0 to disable
+        :param flip: random horizontal flip with probability 0.5
+        :param n_holes: number of Cutout holes per image, 0 to disable
+        :param cutout_length: side of the Cutout holes in pixels
+        :param fill: per-channel value of the crop padding, in the space of the batch. For a normalized
+                     batch, [-m / s for m, s in zip(mean, std)] pads with the black pixels of RandomCrop.
+        :param seed: seed of the crop, flip, Cutout and mixup draws
+        """
+        self.crop_padding = crop_padding
+        self.flip = flip
+        self.n_holes = n_holes
+        self.cutout_length = cutout_length
+        self.fill = fill
+        self.generator = torch.Generator().manual_seed(seed)
+        self.rng = np.random.default_rng(seed)
+
+    def randint(self, high, size, device):
+        return torch.randint(high, size, generator=self.generator).to(device, non_blocking=True)
+
+    def random_crop(self, x):
+        B, C, H, W = x.shape
+        p = self.crop_padding
+        fill = torch.zeros(C) if self.fill is None else torch.as_tensor(self.fill, dtype=x.dtype)
+        padded = fill.to(x.device, x.dtype).view(1, C, 1, 1).repeat(B, 1, H + 2 * p, W + 2 * p)
+        padded[:, :, p:p + H, p:p + W] = x
+
+        offsets = self.randint(2 * p + 1, (2, B), x.device)
+        rows = offsets[0].view(B, 1) + torch.arange(H, device=x.device)
+        cols = offsets[1].view(B, 1) + torch.arange(W, device=x.device)
+        x = padded.gather(2, rows.view(B, 1, H, 1).expand(B, C, H, W + 2 * p))
+        return x.gather(3, cols.view(B, 1, 1, W).expand(B, C, H, W))
+
+    def random_flip(self, x):
+        flip = self.randint(2, (x.shape[0],), x.device).bool()
+        return torch.where(flip.view(-1, 1, 1, 1), x.flip(3), x)
+
+    def cutout(self, x):
+        """Zero n_holes squares of side cutout_length per image, centered anywhere and clipped at the borders"""
+        B, C, H, W = x.shape
+        half = self.cutout_length // 2
+        y = self.randint(H, (B, self.n_holes, 1), x.device)
+        z = self.randint(W, (B, self.n_holes, 1), x.device)
+        rows = torch.arange(H, device=x.device)
+        cols = torch.arange(W, device=x.device)
+        in_rows = (rows >= (y - half).clamp(0, H)) & (rows < (y + half).clamp(0, H))
+        in_cols = (cols >= (z - half).clamp(0, W)) & (cols < (z + half).clamp(0, W))
+        holes = (in_rows.unsqueeze(3) & in_cols.unsqueeze(2)).any(1)
+        return x * (~holes).unsqueeze(1).to(x.dtype)
+
+    def __call__(self, x):
+        if self.crop_padding > 0:
+            x = self.random_crop(x)
+        if self.flip:
+            x = self.random_flip(x)
+        if self.n_holes > 0:
+            x = self.cutout(x)
+        return x
+
+    def mixup(self, x, y, alpha=1.0, quantize=None):
+        """Seeded mixup_batch(), see there"""
+        return mixup_batch(x, y, alpha, generator=self.generator, rng=self.rng, quantize=quantize)
+
+
+def mixup_batch(x, y, alpha=1.0, generator=None, rng=None, quantize=None):
+    """
+    Mixup with one lambda per sample, lam_i ~ Beta(alpha, alpha), and one permutation for the batch,
+    all drawn in one call. Without generator and rng, the global torch and numpy generators are used.
+    :param quantize: function mapping the (B,) array of lambdas to the ones used, e.g. to a few discrete levels
+    :return: mixed inputs, pairs of targets and the lambdas as a (B,) tensor on the device of x, see mixup_loss()
+    """
+    B = x.shape[0]
+    rng = np.random if rng is None else rng
+    lam = rng.beta(alpha, alpha, size=B) if alpha > 0. else np.ones(B)
+    if quantize is not None:
+        lam = quantize(lam)
+    lam = torch.tensor(lam, dtype=x.dtype).to(x.device, non_blocking=True)
+    index = torch.randperm(B, generator=generator).to(x.device, non_blocking=True)
+
+    lam_x = lam.view((B,) + (1,) * (x.dim() - 1))
+    mixed_x = lam_x * x + (1 - lam_x) * x[index]
+    return mixed_x, y, y[index], lam
+
+
+def mixup_loss(pred, y_a, y_b, lam):
+    """Cross-entropy of a mixup batch with per-sample lambdas"""
+    loss = lam * F.cross_entropy(pred, y_a, reduction='none') + (1 - lam) * F.cross_entropy(pred, y_b, reduction='none')
+    return loss.mean()
+
+
+def mixup_correct(pred, y_a, y_b, lam):
+    """Number of correct predictions of a mixup batch, each sample weighted by its lambda"""
+    return (lam * pred.eq(y_a).float() + (1 - lam) * pred.eq(y_b).float()).sum().item()
+
+
+class AugmentedLoader:
+    """DataLoader wrapper that moves every collated batch to device and augments it there"""
+    def __init__(self, loader, augment, device='cpu'):
+        self.loader = loader
+        self.augment = augment
+        self.device = torch.device(device)
+
+    @property
+    def dataset(self):
+        return self.loader.dataset
+
+    @property
+    def batch_size(self):
+        return self.loader.batch_size
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        for x, y in self.loader:
+            x = x.to(self.device, non_blocking=True)
+            yield self.augment(x), y.to(self.device, non_blocking=True)
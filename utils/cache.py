@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import errno
+import shutil
+import hashlib
+import tempfile
+import contextlib
+
+import numpy as np
+import torch
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+sys.path.append('..') #Hack add ROOT DIR
+from baseconfig import CONF
+
+
+def cache_key(key):
+    """Content address of a dict of json-serializable values"""
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Exclusive inter-process lock held while the context is open (no-op without fcntl)"""
+    lock_dir = os.path.dirname(path)
+    if lock_dir and not os.path.exists(lock_dir):
+        os.makedirs(lock_dir, exist_ok=True)
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def atomic_replace_dir(tmp_dir, final_dir):
+    """Move a fully written directory into place, the first writer wins"""
+    try:
+        os.rename(tmp_dir, final_dir)
+    except OSError as e:
+        if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+            raise
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class DatasetCache:
+    """Content-addressed cache of preprocessed datasets.
+
+    Every entry is a directory named after the hash of its key (dataset, transform, class pair,
+    seed, shuffle, ...) holding raw .npy arrays and the key itself. Entries are written once into a
+    temporary directory and renamed into place, readers open the arrays memory-mapped, so concurrent
+    runs share the same files and pay neither the transform pipeline nor a full load.
+    """
+    def __init__(self, root=None):
+        self.root = root if root is not None else CONF.PATH.CACHE
+        if not os.path.exists(self.root):
+            os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, cache_key(key))
+
+    def exists(self, key):
+        return os.path.isfile(os.path.join(self.path(key), 'key.json'))
+
+    def save(self, key, **arrays):
+        tmp_dir = tempfile.mkdtemp(dir=self.root, prefix='.tmp_')
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, name + '.npy'), np.ascontiguousarray(array))
+        # key.json is written last, an entry without it is incomplete
+        with open(os.path.join(tmp_dir, 'key.json'), 'w') as f:
+            json.dump(key, f, sort_keys=True)
+        atomic_replace_dir(tmp_dir, self.path(key))
+
+    def save_streamed(self, key, arrays, chunks):
+        """
+        Like save() for arrays that do not fit in memory: arrays is a dict name -> (shape, dtype) and
+        chunks an iterable of dicts name -> consecutive rows, appended to the .npy files as they come,
+        so that at most one chunk is ever held in memory.
+        """
+        tmp_dir = tempfile.mkdtemp(dir=self.root, prefix='.tmp_')
+        files = {}
+        try:
+            for name, (shape, dtype) in arrays.items():
+                files[name] = open(os.path.join(tmp_dir, name + '.npy'), 'wb')
+                header = {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False, 'shape': tuple(shape)}
+                np.lib.format.write_array_header_1_0(files[name], header)
+            rows = dict.fromkeys(arrays, 0)
+            for chunk in chunks:
+                for name, array in chunk.items():
+                    files[name].write(np.ascontiguousarray(array, dtype=arrays[name][1]).tobytes())
+                    rows[name] += len(array)
+            for name, (shape, dtype) in arrays.items():
+                if rows[name] != shape[0]:
+                    raise ValueError("{} rows written to {}, expected {}".format(rows[name], name, shape[0]))
+                files[name].close()
+        except BaseException:
+            for f in files.values():
+                f.close()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        with open(os.path.join(tmp_dir, 'key.json'), 'w') as f:
+            json.dump(key, f, sort_keys=True)
+        atomic_replace_dir(tmp_dir, self.path(key))
+
+    def load(self, key, name):
+        """Memory-mapped array, copy-on-write so that it can be wrapped without copy by torch.from_numpy"""
+        return np.load(os.path.join(self.path(key), name + '.npy'), mmap_mode='c')
+
+    def load_tensor(self, key, name):
+        return torch.from_numpy(self.load(key, name))
+
+    def get_or_create(self, key, create_fn, names=('X', 'Y')):
+        """Load the arrays of key, running create_fn() -> dict of arrays once if the entry is missing"""
+        if not self.exists(key):
+            with file_lock(self.path(key) + '.lock'):
+                if not self.exists(key):
+                    self.save(key, **create_fn())
+        return tuple(self.load(key, name) for name in names)
+
+    def get_or_create_streamed(self, key, arrays, chunks_fn, names=('X', 'Y')):
+        """get_or_create() for entries written chunk by chunk by save_streamed(key, arrays, chunks_fn())"""
+        if not self.exists(key):
+            with file_lock(self.path(key) + '.lock'):
+                if not self.exists(key):
+                    self.save_streamed(key, arrays, chunks_fn())
+        return tuple(self.load(key, name) for name in names)
+
+
+# options of the training of w*, on top of the key of w0
+WSTAR_OPTIONS = ('n_teacher_runs', 'nb_train', 'nb_test', 'batch_size', 'eta', 'projection', 'projection_seed', 'img_size', 'channels')
+
+
+class TeacherEntry:
+    """Weights file of a TeacherStore key, to be written with save() by the run that builds it"""
+    def __init__(self, path, key, build):
+        self.path = path
+        self.key = key
+        self.build = build
+
+    def save(self, state_dict):
+        tmp_path = self.path + '.tmp.{}'.format(os.getpid())
+        torch.save(state_dict, tmp_path)
+        with open(os.path.splitext(self.path)[0] + '.json', 'w') as f:
+            json.dump(self.key, f, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+class TeacherStore:
+    """Initial (w0) and trained (w*) teacher weights shared by the runs of a sweep.
+
+    Every weights file is named after the hash of its key: the teacher class, the data (data_key, with
+    its transform), class pair, dim and seed for w0, plus the options of the teacher training and the
+    training recipe for w*. The first run of a key builds the weights under a file lock and moves them into place, the
+    concurrent runs of the same key wait for it, and all of them then read the same file, so the
+    teacher of a seed is trained once for all the models and experiments of a sweep.
+    """
+    def __init__(self, root=None):
+        self.root = root if root is not None else os.path.join(CONF.PATH.CACHE, 'teachers')
+        if not os.path.exists(self.root):
+            os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def w0_key(opt, teacher):
+        # utils.data imports this module
+        from utils.data import data_key
+        # the data key has the transform of the inputs, e.g. binarized MNIST for the VAE generators
+        return {'artifact': 'teacher_w0', 'teacher': type(teacher).__module__ + '.' + type(teacher).__name__,
+                'data_mode': opt.data_mode, 'data': data_key(opt), 'generator_type': getattr(opt, 'generator_type', None),
+                'class_1': getattr(opt, 'class_1', None), 'class_2': getattr(opt, 'class_2', None),
+                'dim': opt.dim, 'seed': opt.seed}
+
+    @staticmethod
+    def wstar_key(opt, teacher, recipe='wstar_trainer'):
+        key = dict(TeacherStore.w0_key(opt, teacher), artifact='teacher_wstar', recipe=recipe)
+        key.update({k: getattr(opt, k, None) for k in WSTAR_OPTIONS})
+        return key
+
+    def path(self, key):
+        return os.path.join(self.root, cache_key(key) + '.pth')
+
+    @contextlib.contextmanager
+    def entry(self, key):
+        """TeacherEntry of key, with build set (and the lock held) if its weights are missing"""
+        path = self.path(key)
+        if os.path.isfile(path):
+            yield TeacherEntry(path, key, build=False)
+            return
+        with file_lock(path + '.lock'):
+            entry = TeacherEntry(path, key, build=not os.path.isfile(path))
+            yield entry
+            if not os.path.isfile(path):
+                raise RuntimeError("The teacher weights {} were not saved".format(path))
+
+    def w0(self, opt, teacher):
+        """
+        Path of the initial weights of teacher: its own weights for the first run of the key, which are
+        saved, and the saved ones, loaded into teacher, for the others
+        """
+        with self.entry(self.w0_key(opt, teacher)) as entry:
+            if entry.build:
+                entry.save(teacher.state_dict())
+        teacher.load_state_dict(load_teacher(entry.path))
+        return entry.path
+
+    def wstar(self, opt, teacher, recipe='wstar_trainer'):
+        """entry() of the trained weights of teacher, trained by the caller from w0 if entry.build"""
+        return self.entry(self.wstar_key(opt, teacher, recipe))
+
+
+_TEACHER_STATES = {}
+
+
+def load_teacher(path):
+    """State dict of a TeacherStore file, read once per process (the files of the store never change)"""
+    if path not in _TEACHER_STATES:
+        _TEACHER_STATES[path] = torch.load(path)
+    return _TEACHER_STATES[path]
@@ -1,5 +1,7 @@
 import sys
 
+import numpy as np
+import torch
 import torchvision
 from torchvision import transforms
 from torch.utils.data import DataLoader
@@ -9,6 +11,16 @@ from sklearn.datasets import make_moons
 
 from matplotlib.ticker import FormatStrFormatter
 
+from utils.cache import DatasetCache
+from utils.projection import get_projection
+from utils.results import flush_results
+from utils.store import ResultsStore, opt_params
+from utils.evaluation import per_iteration
+from utils.run import RunContext
+from datasets.class_index import ClassIndex
+from datasets.stream import RAW_DATASETS, StreamingArray, raw_data, dataset_mean_and_std
+from datasets.synthetic import SYNTHETIC_DATASETS, synthetic_key, synthetic_data
+
 
 import csv
 
@@ -18,66 +30,96 @@ from baseconfig import CONF
 visualize = False
 
 
+def data_key(opt):
+    """Dataset cache key of the data init_data(opt) returns"""
+    if opt.data_mode in ("cifar10", "cifar100"):
+        mean, std = dataset_mean_and_std(opt.data_mode)
+        return {'dataset': opt.data_mode, 'split': 'train', 'transform': ['to_tensor', 'normalize', list(mean), list(std)]}
+    elif opt.data_mode == "mnist":
+        # MNIST normalizing
+        if opt.generator_type == "vae":
+            transform = ['to_tensor', 'round']
+        else:
+            transform = ['to_tensor', 'normalize', [0.5], [0.5]]
+        return {'dataset': 'mnist', 'split': 'train', 'transform': transform,
+                'class_pair': [opt.class_1, opt.class_2], 'seed': opt.seed, 'shuffle': 'RandomState(seed)'}
+    elif is_synthetic(opt):
+        return synthetic_key(opt.data_mode, opt.nb_train + opt.nb_test, opt.dim, opt.seed)
+    return None
+
+
+def is_synthetic(opt):
+    """Data generated by datasets/synthetic.py: gaussian, linearly_seperable, and moon out of the plane"""
+    if opt.data_mode == "moon":
+        return opt.dim != 2
+    return opt.data_mode in SYNTHETIC_DATASETS
+
+
 def init_data(opt):
-    if opt.data_mode == "cifar10":
-        print("Loading CIFAR10 data ...")
+    """
+    Load the data of opt.data_mode from the dataset cache, building the cache entry on the first run
+    :return: a tuple (X, Y) of memory-mapped arrays, X is a StreamingArray for cifar10 and cifar100 with opt.stream_chunk_size > 0
+    """
+    if opt.data_mode in ("cifar10", "cifar100"):
+        print("Loading {} data ...".format(opt.data_mode.upper()))
 
-        transform = transforms.Compose([
-            transforms.ToTensor(),
-            transforms.Normalize((0.4914, 0.4822, 0.4465),
-                                 (0.2470, 0.2435, 0.2616)),
-        ])
+        mean, std = dataset_mean_and_std(opt.data_mode)
+        if opt.stream_chunk_size > 0:
+            # normalized on demand from the raw uint8 array instead of one dense float copy
+            X_raw, Y = raw_data(opt.data_mode, 'train')
+            return StreamingArray(X_raw, mean, std, chunk_size=opt.stream_chunk_size), Y
 
-        train_dataset = torchvision.datasets.CIFAR10(root=CONF.PATH.DATA, train=True, download=True, transform=transform)
-        test_dataset = torchvision.datasets.CIFAR10(root=CONF.PATH.DATA, train=False, download=True, transform=transform)
+        key = data_key(opt)
 
-        train_loader = DataLoader(train_dataset, batch_size=len(train_dataset))
-        test_loader = DataLoader(test_dataset, batch_size=len(test_dataset))
+        def create():
+            train_dataset = RAW_DATASETS[opt.data_mode](root=CONF.PATH.DATA, train=True, download=True)
+            # same arithmetic as transforms.ToTensor() + transforms.Normalize(), on the whole uint8 array at once
+            X = torch.from_numpy(train_dataset.data).permute(0, 3, 1, 2).float().div(255)
+            X = X.sub(torch.tensor(mean).view(1, 3, 1, 1)).div(torch.tensor(std).view(1, 3, 1, 1))
+            Y = np.asarray(train_dataset.targets, dtype=np.int64)
+            return {'X': X.numpy(), 'Y': Y}
 
-        X = next(iter(train_loader))[0].numpy()
-        Y = next(iter(train_loader))[1].numpy()
-        (N, W, H, C) = train_dataset.data.shape
-        dim = W*H*C
+        X, Y = DatasetCache().get_or_create(key, create)
 
     elif opt.data_mode == "mnist":
         print("Loading MNIST data ...")
 
-        # MNIST normalizing
-        if opt.generator_type == "vae":
-            transform = transforms.Compose([transforms.ToTensor(),
-                                           lambda x: torch.round(x)])
-        else:
-            transform = transforms.Compose([transforms.ToTensor(),
-                                            transforms.Normalize([0.5], [0.5])
-                                            ])
+        key = data_key(opt)
 
-        train_dataset = torchvision.datasets.MNIST(root=CONF.PATH.DATA, train=True, download=True, transform=transform)
-        test_dataset = torchvision.datasets.MNIST(root=CONF.PATH.DATA, train=False, download=True, transform=transform)
+        def create():
+            train_dataset = torchvision.datasets.MNIST(root=CONF.PATH.DATA, train=True, download=True)
 
-        loader = DataLoader(train_dataset, batch_size=len(train_dataset), shuffle=False)
-        X = next(iter(loader))[0].numpy()
-        Y = next(iter(loader))[1].numpy()
+            # create new data set with class 1 as 0 and class 2 as 1
+            index = ClassIndex.load_or_build('mnist', 'train', lambda: train_dataset.targets.numpy())
+            f = torch.from_numpy(index.pair(opt.class_1, opt.class_2))
 
-        (N, W, H) = train_dataset.data.shape
-        # dim = W*H
-        # X = X.reshape((N, dim))
+            X = train_dataset.data[f].unsqueeze(1).float().div(255)
+            if opt.generator_type == "vae":
+                X = torch.round(X)
+            else:
+                X = X.sub(0.5).div(0.5)
+            X = X.numpy()
+            Y = train_dataset.targets[f].numpy()
+            Y = np.where(Y == opt.class_1, 0, 1)
 
-        # create new data set with class 1 as 0 and class 2 as 1
-        f = (Y == opt.class_1) | (Y == opt.class_2)
-        X = X[f]
-        Y = Y[f]
-        Y = np.where(Y == opt.class_1, 0, 1)
+            # Shuffle datasets, with a generator of their own so that the shuffle only depends on the seed
+            randomize = np.arange(X.shape[0])
+            np.random.RandomState(opt.seed).shuffle(randomize)
+            X = X[randomize]
+            Y = Y[randomize]
+            return {'X': X, 'Y': Y}
 
-        # Shuffle datasets
-        randomize = np.arange(X.shape[0])
-        np.random.shuffle(randomize)
-        X = X[randomize]
-        Y = Y[randomize]
+        X, Y = DatasetCache().get_or_create(key, create)
 
         img_shape = (opt.channels, opt.img_size, opt.img_size)
-        proj_matrix = torch.empty(int(np.prod(img_shape)), opt.dim).normal_(mean=0, std=0.1)
+        proj_matrix = get_projection(opt, int(np.prod(img_shape)))
+
+        RunContext(opt).save(proj_matrix.matrix(), 'proj_matrix.pt')
+
+    elif is_synthetic(opt):
+        print("Generating {} data ...".format(opt.data_mode))
 
-        torch.save(proj_matrix, 'proj_matrix.pt')
+        X, Y = synthetic_data(opt.data_mode, opt.nb_train + opt.nb_test, opt.dim, seed=opt.seed)
 
     elif opt.data_mode == "moon":
         print("Generating moon data ...")
@@ -85,32 +127,50 @@ def init_data(opt):
         # np.random.seed(0)
         noise_val = 0.2
 
+        # cheaper to generate than to cache
         X, Y = make_moons(opt.nb_train+opt.nb_test, noise=noise_val)
 
     else:
         print("Unrecognized data!")
         sys.exit()
 
-    torch.save(X, 'X.pt')
-    torch.save(Y, 'Y.pt')
+    return X, Y
+
+
+def project_data(opt, X, proj_matrix, chunk_size=4096):
+    """
+    Flattened samples of init_data(opt) projected by proj_matrix, cached next to the data
+    :return: a memory-mapped array of shape (len(X), opt.dim)
+    """
+    key = {'projected': data_key(opt), 'projection': proj_matrix.kind, 'in_dim': proj_matrix.in_dim,
+           'dim': proj_matrix.out_dim, 'projection_seed': proj_matrix.seed}
+
+    def create():
+        X_proj = np.empty((X.shape[0], proj_matrix.out_dim), dtype=np.float32)
+        for i_min in range(0, X.shape[0], chunk_size):
+            x = torch.from_numpy(np.asarray(X[i_min:i_min + chunk_size], dtype=np.float32))
+            X_proj[i_min:i_min + chunk_size] = (x.reshape(x.shape[0], -1) @ proj_matrix).numpy()
+        return {'X': X_proj}
+
+    X_proj, = DatasetCache().get_or_create(key, create, names=('X',))
+    return X_proj
 
 
 def load_experiment_result(opt):
-    """Write an event to the tensorboard events file
+    """Accuracy and w diff curves of the results CSV of opt.experiment, recorded in the results store
     """
     csv_path = os.path.join(opt.log_path, 'results' + '_' + opt.experiment + '_' + str(opt.seed) + '.csv')
+    flush_results(csv_path)
 
     if os.path.isfile(csv_path):
-        acc = []
-        w_diff = []
-        with open(csv_path, 'r') as csvfile:
-            lines = csv.reader(csvfile, delimiter=',')
-            for idx, row in enumerate(lines):
-                if idx != 0:
-                    acc.append(row[1])
-                    w_diff.append(row[2])
-        acc_np = np.asarray(acc).astype(float)
-        w_diff_np = np.asarray(w_diff).astype(float)
+        # record the run in the results store, keyed for the sweep aggregations
+        store = ResultsStore()
+        run = store.ingest_csv(csv_path, policy=opt.model_name, data_mode=opt.data_mode, model=str(opt.model),
+                               experiment=opt.experiment, seed=opt.seed, params=opt_params(opt))
+        # one value per iteration, also for the runs evaluated on a sparser schedule
+        iters = store.column(run, 0)
+        acc_np = per_iteration(iters, store.column(run, 1))
+        w_diff_np = per_iteration(iters, store.column(run, 2))
 
     return acc_np, w_diff_np
 
@@ -143,6 +203,8 @@ import seaborn as sns
 
 
 def plot_graphs(rootdir, experiment_dict, experiment_lst, model_name):
+    flush_results()
+    store = ResultsStore()
     # mpl.rcParams['figure.dpi'] = 120
     # mpl.rcParams['savefig.dpi'] = 200
 
@@ -159,21 +221,7 @@ def plot_graphs(rootdir, experiment_dict, experiment_lst, model_name):
     plt.gca().yaxis.set_major_formatter(FormatStrFormatter('%.1f'))
 
     for experiment in experiment_lst:
-        acc_np = 0
-        for i, file in tqdm(enumerate(sorted(experiment_dict[experiment]))):
-            file_path = os.path.join(rootdir, file)
-            if os.path.isfile(file_path):
-                acc = []
-                with open(file_path, 'r') as csvfile:
-                    lines = csv.reader(csvfile, delimiter=',')
-                    for idx, row in enumerate(lines):
-                        if idx != 0:
-                            acc.append(row[1])
-                tmp_acc_np = np.asarray(acc).astype(float)
-                if i == 0:
-                    acc_np = tmp_acc_np[np.newaxis, :]
-                else:
-                    acc_np = np.concatenate((acc_np, tmp_acc_np[np.newaxis, :]), axis=0)
+        acc_np = store.csv_curves([os.path.join(rootdir, file) for file in sorted(experiment_dict[experiment])], 1)
 
         acc_mean = np.mean(acc_np, axis=0)
         acc_std = np.std(acc_np, axis=0) * 0.2
@@ -204,22 +252,7 @@ def plot_graphs(rootdir, experiment_dict, experiment_lst, model_name):
 
     for experiment in experiment_lst:
 
-        w_diff_np = 0
-
-        for i, file in tqdm(enumerate(sorted(experiment_dict[experiment]))):
-            file_path = os.path.join(rootdir, file)
-            if os.path.isfile(file_path):
-                w_diff = []
-                with open(file_path, 'r') as csvfile:
-                    lines = csv.reader(csvfile, delimiter=',')
-                    for idx, row in enumerate(lines):
-                        if idx != 0:
-                            w_diff.append(row[2])
-                tmp_w_diff_np = np.asarray(w_diff).astype(float)
-                if i == 0:
-                    w_diff_np = tmp_w_diff_np[np.newaxis, :]
-                else:
-                    w_diff_np = np.concatenate((w_diff_np, tmp_w_diff_np[np.newaxis, :]), axis=0)
+        w_diff_np = store.csv_curves([os.path.join(rootdir, file) for file in sorted(experiment_dict[experiment])], 2)
 
         w_diff_mean = np.mean(w_diff_np, axis=0)
         w_diff_std = np.std(w_diff_np, axis=0) * 0.2
@@ -249,6 +282,8 @@ def plot_graphs(rootdir, experiment_dict, experiment_lst, model_name):
 
 
 def plot_graphs_optimized(rootdir, experiment_dict, experiment_lst, model_name):
+    flush_results()
+    store = ResultsStore()
     # mpl.rcParams['figure.dpi'] = 120
     # mpl.rcParams['savefig.dpi'] = 200
 
@@ -265,21 +300,7 @@ def plot_graphs_optimized(rootdir, experiment_dict, experiment_lst, model_name):
     plt.gca().yaxis.set_major_formatter(FormatStrFormatter('%.1f'))
 
     for experiment in experiment_lst:
-        acc_np = 0
-        for i, file in tqdm(enumerate(sorted(experiment_dict[experiment]))):
-            file_path = os.path.join(rootdir, file)
-            if os.path.isfile(file_path):
-                acc = []
-                with open(file_path, 'r') as csvfile:
-                    lines = csv.reader(csvfile, delimiter=',')
-                    for idx, row in enumerate(lines):
-                        if idx != 0:
-                            acc.append(row[1])
-                tmp_acc_np = np.asarray(acc).astype(float)
-                if i == 0:
-                    acc_np = tmp_acc_np[np.newaxis, :]
-                else:
-                    acc_np = np.concatenate((acc_np, tmp_acc_np[np.newaxis, :]), axis=0)
+        acc_np = store.csv_curves([os.path.join(rootdir, file) for file in sorted(experiment_dict[experiment])], 1)
 
         acc_mean = np.mean(acc_np, axis=0)
         acc_std = np.std(acc_np, axis=0) * 0.2
@@ -322,22 +343,7 @@ def plot_graphs_optimized(rootdir, experiment_dict, experiment_lst, model_name):
 
     for experiment in experiment_lst:
 
-        w_diff_np = 0
-
-        for i, file in tqdm(enumerate(sorted(experiment_dict[experiment]))):
-            file_path = os.path.join(rootdir, file)
-            if os.path.isfile(file_path):
-                w_diff = []
-                with open(file_path, 'r') as csvfile:
-                    lines = csv.reader(csvfile, delimiter=',')
-                    for idx, row in enumerate(lines):
-                        if idx != 0:
-                            w_diff.append(row[2])
-                tmp_w_diff_np = np.asarray(w_diff).astype(float)
-                if i == 0:
-                    w_diff_np = tmp_w_diff_np[np.newaxis, :]
-                else:
-                    w_diff_np = np.concatenate((w_diff_np, tmp_w_diff_np[np.newaxis, :]), axis=0)
+        w_diff_np = store.csv_curves([os.path.join(rootdir, file) for file in sorted(experiment_dict[experiment])], 2)
 
         w_diff_mean = np.mean(w_diff_np, axis=0)
         w_diff_std = np.std(w_diff_np, axis=0) * 0.2
@@ -376,6 +382,8 @@ def plot_graphs_optimized(rootdir, experiment_dict, experiment_lst, model_name):
 
 
 def plot_graphs_vae_cgan(rootdir, experiment_dict, experiment_lst, model_name):
+    flush_results()
+    store = ResultsStore()
     # mpl.rcParams['figure.dpi'] = 120
     # mpl.rcParams['savefig.dpi'] = 200
 
@@ -392,21 +400,7 @@ def plot_graphs_vae_cgan(rootdir, experiment_dict, experiment_lst, model_name):
     plt.gca().yaxis.set_major_formatter(FormatStrFormatter('%.1f'))
 
     for experiment in experiment_lst:
-        acc_np = 0
-        for i, file in tqdm(enumerate(sorted(experiment_dict[experiment]))):
-            file_path = os.path.join(rootdir, file)
-            if os.path.isfile(file_path):
-                acc = []
-                with open(file_path, 'r') as csvfile:
-                    lines = csv.reader(csvfile, delimiter=',')
-                    for idx, row in enumerate(lines):
-                        if idx != 0:
-                            acc.append(row[1])
-                tmp_acc_np = np.asarray(acc).astype(float)
-                if i == 0:
-                    acc_np = tmp_acc_np[np.newaxis, :]
-                else:
-                    acc_np = np.concatenate((acc_np, tmp_acc_np[np.newaxis, :]), axis=0)
+        acc_np = store.csv_curves([os.path.join(rootdir, file) for file in sorted(experiment_dict[experiment])], 1)
 
         acc_mean = np.mean(acc_np, axis=0)
         acc_std = np.std(acc_np, axis=0) * 0.2
@@ -441,22 +435,7 @@ def plot_graphs_vae_cgan(rootdir, experiment_dict, experiment_lst, model_name):
 
     for experiment in experiment_lst:
 
-        w_diff_np = 0
-
-        for i, file in tqdm(enumerate(sorted(experiment_dict[experiment]))):
-            file_path = os.path.join(rootdir, file)
-            if os.path.isfile(file_path):
-                w_diff = []
-                with open(file_path, 'r') as csvfile:
-                    lines = csv.reader(csvfile, delimiter=',')
-                    for idx, row in enumerate(lines):
-                        if idx != 0:
-                            w_diff.append(row[2])
-                tmp_w_diff_np = np.asarray(w_diff).astype(float)
-                if i == 0:
-                    w_diff_np = tmp_w_diff_np[np.newaxis, :]
-                else:
-                    w_diff_np = np.concatenate((w_diff_np, tmp_w_diff_np[np.newaxis, :]), axis=0)
+        w_diff_np = store.csv_curves([os.path.join(rootdir, file) for file in sorted(experiment_dict[experiment])], 2)
 
         w_diff_mean = np.mean(w_diff_np, axis=0)
         w_diff_std = np.std(w_diff_np, axis=0) * 0.2
@@ -492,6 +471,8 @@ def plot_graphs_vae_cgan(rootdir, experiment_dict, experiment_lst, model_name):
 
 
 def plot_perceptual_loss(log_path, experiments_lst, model_name, epsilon=50):
+    flush_results()
+    store = ResultsStore()
 
     rootdir = log_path
 
@@ -515,21 +496,7 @@ def plot_perceptual_loss(log_path, experiments_lst, model_name, epsilon=50):
     plt.gca().yaxis.set_major_formatter(FormatStrFormatter('%.1f'))
 
     for idx, experiment in enumerate(experiments_lst):
-        value_np = 0
-        for i, file in tqdm(enumerate(sorted(file_lst))):
-            file_path = os.path.join(rootdir, file)
-            if os.path.isfile(file_path):
-                value = []
-                with open(file_path, 'r') as csvfile:
-                    lines = csv.reader(csvfile, delimiter=',')
-                    for n, row in enumerate(lines):
-                        if n != 0:
-                            value.append(row[idx + 1])
-                tmp_value_np = np.asarray(value).astype(float)
-                if i == 0:
-                    value_np = tmp_value_np[np.newaxis, :]
-                else:
-                    value_np = np.concatenate((value_np, tmp_value_np[np.newaxis, :]), axis=0)
+        value_np = store.csv_curves([os.path.join(rootdir, file) for file in sorted(file_lst)], idx + 1)
 
         value_mean = np.mean(value_np, axis=0)
         value_std = np.std(value_np, axis=0)
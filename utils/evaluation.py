@@ -0,0 +1,141 @@
+import numpy as np
+import torch
+
+from networks.linear import LinearClassifier
+from utils.results import results_writer
+
+
+def eval_schedule(n_iter, interval=1, n_log_points=0):
+    """
+    Iterations at which the learner is evaluated, always including the first and the last one
+    :param interval: evaluate every interval iterations
+    :param n_log_points: if > 0, n_log_points iterations log-spaced over [0, n_iter) instead
+    """
+    if n_log_points > 0:
+        iters = np.round(np.geomspace(1, n_iter, n_log_points)).astype(int) - 1
+    else:
+        iters = np.arange(0, n_iter, max(interval, 1))
+    return np.unique(np.concatenate([[0], iters, [n_iter - 1]]))
+
+
+def per_iteration(iters, values):
+    """
+    Values evaluated at the increasing iterations iters, one per iteration from 0 to iters[-1], each
+    held until the next evaluation, so that a curve is indexed by iteration whatever the schedule.
+    Values whose iters are not increasing (not an iteration column) are returned as they are.
+    """
+    iters = np.asarray(iters)
+    values = np.asarray(values)
+    if len(iters) == 0 or len(iters) != len(values) or np.any(np.diff(iters) <= 0):
+        return values
+    iters = iters.astype(int)
+    idx = np.searchsorted(iters, np.arange(iters[-1] + 1), side='right') - 1
+    return values[np.maximum(idx, 0)]
+
+
+class Evaluator:
+    """Test accuracy and w diff of a learner along a teaching loop, without a host sync per iteration.
+
+    The test set is moved to the device of the learner once. At the iterations of the schedule, the
+    number of correct predictions and ||w* - w / ||w|| ||^2 are written on the device into a
+    preallocated (n_evals, 2) buffer, which is copied to the host every flush_every evaluations and at
+    the end of the loop, and only then appended to the results CSV. The values are the ones the loops
+    computed at every iteration, only fewer iterations are evaluated when the schedule is sparser, and
+    curves() holds them until the next evaluation, one value per iteration for the plots and videos.
+
+    For the linear students (sigmoid of lin), the test logits X_test w^T are kept from one evaluation
+    to the next and moved by X_test (w - w_prev)^T, one mat-vec with the change of the weights instead
+    of a forward pass of the model. They are recomputed from scratch every resync_every evaluations,
+    so that the rounding errors of the updates do not add up.
+    """
+    def __init__(self, opt, X_test, Y_test, w_star, logname, argmax=False, flush_every=100):
+        self.iters = eval_schedule(opt.n_iter, getattr(opt, 'eval_interval', 1), getattr(opt, 'eval_log_points', 0))
+        self.due = set(self.iters.tolist())
+        self.argmax = argmax or opt.data_mode == "cifar10"
+        self.X_test = X_test
+        self.Y_test = Y_test
+        self.n_test = X_test.size(0)
+        self.w_star = w_star
+        self.logname = logname
+        self.flush_every = flush_every
+        self.resync_every = getattr(opt, 'eval_resync', 50)
+
+        self.incremental = False
+        self.logits = None
+        self.weight = None
+        self.bias = None
+        self.n_deltas = 0
+
+        self.buffer = None
+        self.k = 0
+        self.n_flushed = 0
+        self.res = []
+        self.w_diff = []
+
+    def _setup(self, model):
+        device = model.lin.weight.device
+        self.incremental = self.resync_every > 0 and isinstance(model, LinearClassifier)
+        self.X_test = self.X_test.to(device)
+        self.Y_test = self.Y_test.to(device)
+        self.buffer = torch.zeros((len(self.iters), 2), dtype=torch.float64, device=device)
+
+    def predict(self, model):
+        if not self.incremental:
+            return model(self.X_test)
+        lin = model.lin
+        if self.logits is None or self.n_deltas >= self.resync_every:
+            self.logits = lin(self.X_test)
+            self.n_deltas = 0
+        else:
+            self.logits.addmm_(self.X_test, (lin.weight - self.weight).t())
+            if lin.bias is not None:
+                self.logits += lin.bias - self.bias
+            self.n_deltas += 1
+        self.weight = lin.weight.clone()
+        self.bias = lin.bias.clone() if lin.bias is not None else None
+        return model.sig(self.logits)
+
+    def __call__(self, model, t):
+        """Evaluate model at iteration t, if t is in the schedule"""
+        if t not in self.due:
+            return
+        if self.buffer is None:
+            self._setup(model)
+
+        model.eval()
+        with torch.no_grad():
+            test = self.predict(model)
+            if self.argmax:
+                tmp = torch.max(test, dim=1).indices
+            else:
+                tmp = (test > 0.5).to(self.Y_test.dtype)
+            self.buffer[self.k, 0] = (tmp.view(-1) == self.Y_test).sum()
+
+        # outside of no_grad: the 2-norm of a matrix then goes through the same SVD as in the loops
+        w = model.lin.weight
+        w = w / torch.norm(w)
+        self.buffer[self.k, 1] = (torch.linalg.norm(self.w_star - w, ord=2) ** 2).detach()
+        self.k += 1
+
+        if self.k - self.n_flushed >= self.flush_every:
+            self.flush()
+
+    def curves(self):
+        """Test accuracy and w diff at every iteration, see per_iteration()"""
+        self.flush()
+        iters = self.iters[:self.n_flushed]
+        return per_iteration(iters, self.res), per_iteration(iters, self.w_diff)
+
+    def flush(self):
+        """Copy the pending evaluations to the host and append them to the results CSV"""
+        if self.k == self.n_flushed:
+            return
+        values = self.buffer[self.n_flushed:self.k].cpu().numpy()
+        rows = []
+        for t, (nb_correct, diff) in zip(self.iters[self.n_flushed:self.k], values):
+            acc = float(nb_correct) / self.n_test
+            self.res.append(acc)
+            self.w_diff.append(float(diff))
+            rows.append([int(t), acc, float(diff)])
+        results_writer(self.logname).writerows(rows)
+        self.n_flushed = self.k
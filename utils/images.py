@@ -0,0 +1,66 @@
+import weakref
+
+import numpy as np
+import torch
+
+from utils.projection import projection_key, unproject
+
+
+def to_uint8(images):
+    """Images in [0, 1] to uint8, rounded and clamped like torchvision's save_image"""
+    images = torch.as_tensor(images)
+    return images.mul(255).add_(0.5).clamp_(0, 255).to(torch.uint8).numpy()
+
+
+class TraceImages:
+    """Images of a trace of generated samples, unprojected and converted once.
+
+    The whole trace is unprojected with one batched product by the (cached) pseudo-inverse of the
+    projection and reshaped to (n, *img_shape), and its uint8 version is computed at its first use,
+    so that the result images, the videos and the saved samples of a run share them.
+    """
+    def __init__(self, samples, proj_matrix=None, img_shape=(1, 28, 28)):
+        self.samples = samples
+        self.proj_matrix = proj_matrix
+        self.img_shape = img_shape
+        self._images = None
+        self._uint8 = None
+
+    @property
+    def images(self):
+        """(n, *img_shape) float array, the samples themselves when they were not projected"""
+        if self._images is None:
+            samples = self.samples
+            if torch.is_tensor(samples):
+                samples = samples.detach().cpu().numpy()
+            if self.proj_matrix is not None:
+                samples = unproject(np.asarray(samples), self.proj_matrix)
+                samples = np.reshape(samples, (samples.shape[0], *self.img_shape))
+            self._images = np.asarray(samples)
+        return self._images
+
+    @property
+    def uint8(self):
+        """The images as uint8, as save_image writes them"""
+        if self._uint8 is None:
+            self._uint8 = to_uint8(self.images)
+        return self._uint8
+
+
+# images of the last trace, kept as long as the trace itself
+_LAST = {}
+
+
+def trace_images(samples, proj_matrix=None, img_shape=(1, 28, 28)):
+    """The TraceImages of samples, shared by the calls with the same trace and projection"""
+    key = (projection_key(proj_matrix) if proj_matrix is not None else None, tuple(img_shape), tuple(samples.shape))
+    ref = _LAST.get('samples')
+    if ref is not None and ref() is samples and _LAST['key'] == key:
+        return _LAST['images']
+    images = TraceImages(samples, proj_matrix, img_shape)
+    try:
+        _LAST.update(samples=weakref.ref(samples), key=key, images=images)
+    except TypeError:
+        # samples that cannot be weakly referenced are not cached
+        _LAST.clear()
+    return images
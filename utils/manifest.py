@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import time
+
+sys.path.append('..') #Hack add ROOT DIR
+from baseconfig import CONF
+from utils.cache import cache_key, file_lock
+from utils.results import flush_results
+from utils.store import opt_params
+
+
+# options that do not change the results of a stage
+VOLATILE = {'idx', 'collect', 'init_data', 'rerun', 'train_wstar', 'train_sgd', 'train_baseline', 'train_student',
+            'sweep_workers', 'sweep_threads', 'video_workers', 'video_format', 'trace_memmap'}
+
+
+def config_hash(opt):
+    """Hash of the scalar options of opt that determine the results"""
+    return cache_key({k: v for k, v in opt_params(opt).items() if k not in VOLATILE})
+
+
+def results_csv_path(opt):
+    """Results CSV of opt.experiment, as written by the stages and read by load_experiment_result"""
+    return os.path.join(opt.log_path, 'results' + '_' + opt.experiment + '_' + str(opt.seed) + '.csv')
+
+
+# stages started and not finished by this process, manifest -> keys
+_RUNNING = {}
+
+
+class RunManifest:
+    """Status of the stages of the runs of a log directory, in a manifest.json next to their results.
+
+    Every stage of a run (seed, configuration) has a record with its status (running, done or
+    failed), the hash of its configuration, the paths of its artifacts and its timing. A stage that
+    is done with the same configuration and whose artifacts are still there is skipped, and its
+    duration counts as compute avoided. A crashed run is resumed at the granularity of its stages
+    only: the stages it completed are skipped, but the one it was in is not resumed from a
+    checkpoint (the stages do not write any), it is restarted from its first iteration, its stale
+    artifacts removed so that a partial results CSV is never appended to or read back. The file is
+    rewritten atomically under a lock, so concurrent runs can share it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self.avoided = 0.0
+        self.started = {}
+
+    def read(self):
+        if not os.path.isfile(self.path):
+            return {}
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def _update(self, key, **fields):
+        with file_lock(self.lock_path):
+            stages = self.read()
+            stages[key] = dict(stages.get(key, {}), **fields)
+            tmp_path = self.path + '.tmp.{}'.format(os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump(stages, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def key(opt, stage):
+        return "{}_{}@{}".format(stage, opt.seed, config_hash(opt))
+
+    def record(self, opt, stage=None):
+        return self.read().get(self.key(opt, stage or opt.experiment))
+
+    def is_done(self, opt, stage=None):
+        record = self.record(opt, stage)
+        return (record is not None and record['status'] == 'done'
+                and all(os.path.exists(path) for path in record.get('artifacts', [])))
+
+    def start(self, opt, stage=None, artifacts=None):
+        """
+        Mark the stage (opt.experiment by default) as running and return True, or return False if it is done.
+        A stage that is not done runs again from scratch, after its artifacts are removed.
+        :param artifacts: files written by the stage, its results CSV by default
+        """
+        stage = stage or opt.experiment
+        key = self.key(opt, stage)
+        record = self.read().get(key)
+        if not getattr(opt, 'rerun', False) and self.is_done(opt, stage):
+            self.avoided += record.get('duration', 0.0)
+            print("Skipping {}: done in {:.0f}s on {} (config {})".format(
+                stage, record.get('duration', 0.0), record.get('ended_at', '?'), record['config']))
+            return False
+
+        artifacts = [results_csv_path(opt)] if artifacts is None else list(artifacts)
+        for path in artifacts:
+            # rows still buffered from an earlier run of the stage go to the old file
+            flush_results(path)
+            if os.path.isfile(path):
+                os.remove(path)
+        if record is not None:
+            print("Restarting {} ({} before)".format(stage, record['status']))
+        self.started[stage] = (key, time.time())
+        _RUNNING.setdefault(self, set()).add(stage)
+        self._update(key, stage=stage, seed=opt.seed, config=config_hash(opt), status='running', pid=os.getpid(),
+                     artifacts=[os.path.abspath(path) for path in artifacts], started_at=time.strftime('%Y-%m-%d %H:%M:%S'))
+        return True
+
+    def _finish(self, stage, status, **fields):
+        key, started = self.started.pop(stage)
+        _RUNNING.get(self, set()).discard(stage)
+        self._update(key, status=status, ended_at=time.strftime('%Y-%m-%d %H:%M:%S'), duration=time.time() - started, **fields)
+
+    def done(self, stage):
+        for path in self.read()[self.started[stage][0]].get('artifacts', []):
+            flush_results(path)
+        self._finish(stage, 'done')
+
+    def fail(self, stage, error=None):
+        self._finish(stage, 'failed', error=error)
+
+
+_MANIFESTS = {}
+
+
+def run_manifest(path):
+    """The manifest of path, one object per process so that it tracks the stages started in it"""
+    path = os.path.abspath(path)
+    if path not in _MANIFESTS:
+        _MANIFESTS[path] = RunManifest(path)
+    return _MANIFESTS[path]
+
+
+def stage_manifest(opt):
+    """Manifest of the stages of the policies writing to opt.log_path"""
+    return run_manifest(os.path.join(opt.log_path, 'manifest.json'))
+
+
+def sweep_manifest():
+    """Manifest of the runs of train.py, one stage per (policy, seed, model, experiment)"""
+    return run_manifest(os.path.join(CONF.PATH.LOG, 'manifest.json'))
+
+
+def fail_running_stages(error=None):
+    """Mark the stages left running by this process as failed, e.g. when a run raises"""
+    for manifest, stages in list(_RUNNING.items()):
+        for stage in list(stages):
+            manifest.fail(stage, error)
+
+
+def avoided_compute():
+    """Seconds of the stages skipped by this process because they were done"""
+    return sum(manifest.avoided for manifest in _MANIFESTS.values())
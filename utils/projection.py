@@ -0,0 +1,391 @@
+import os
+import sys
+import abc
+import math
+import hashlib
+import warnings
+
+import numpy as np
+import torch
+
+sys.path.append('..') #Hack add ROOT DIR
+from baseconfig import CONF
+from utils.cache import cache_key
+
+
+_HADAMARD = {}
+
+
+def hadamard_matrix(n, device=None, dtype=torch.float):
+    """Unnormalized Sylvester Hadamard matrix of size n (a power of 2)"""
+    key = (n, str(device), dtype)
+    if key not in _HADAMARD:
+        H = torch.ones(1, 1, dtype=dtype)
+        while H.shape[0] < n:
+            H = torch.cat((torch.cat((H, H), dim=1), torch.cat((H, -H), dim=1)), dim=0)
+        _HADAMARD[key] = H.to(device)
+    return _HADAMARD[key]
+
+
+def fwht(x):
+    """Orthonormal Walsh-Hadamard transform along the last dimension (a power of 2).
+
+    H_n = H_a kron H_b with a*b = n, a ~ b, so the transform of a row reshaped to (a, b) is
+    H_a X H_b: two small matrix products, O(n sqrt(n)) but BLAS bound, which is faster in practice
+    than the log(n) butterfly passes for the sizes used here.
+    """
+    n = x.shape[-1]
+    k = n.bit_length() - 1
+    a, b = 1 << (k // 2), 1 << (k - k // 2)
+    X = x.reshape(-1, a, b)
+    X = hadamard_matrix(a, x.device, x.dtype) @ X @ hadamard_matrix(b, x.device, x.dtype)
+    return X.reshape(x.shape) / math.sqrt(n)
+
+
+class Projection(abc.ABC):
+    """Random linear projection R^in_dim -> R^out_dim used in place of a dense proj_matrix.
+
+    x @ projection projects a batch of flattened samples (tensor or array), projection.unproject(y)
+    maps projected samples back with the pseudo-inverse. Every kind has entries of standard
+    deviation std, so the projected features keep the scale of the original Gaussian proj_matrix
+    whatever the kind. The pseudo-inverse is never formed: it is applied as the transposed
+    projection and a solve with the small Gram matrix, factorized once.
+    """
+    kind = None
+
+    # let numpy arrays defer "array @ projection" to __rmatmul__
+    __array_ufunc__ = None
+
+    def __init__(self, in_dim, out_dim, seed=0, std=0.1):
+        self.in_dim = in_dim
+        self.out_dim = out_dim
+        self.seed = seed
+        self.std = std
+        self.device = torch.device('cpu')
+        self._factor = None
+        self._devices = {}
+
+    @property
+    def shape(self):
+        return (self.in_dim, self.out_dim)
+
+    @abc.abstractmethod
+    def _apply(self, x):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _apply_transpose(self, y):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _buffers(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _set_buffers(self, buffers):
+        raise NotImplementedError
+
+    def _generator(self):
+        return torch.Generator().manual_seed(self.seed)
+
+    def apply(self, x):
+        """x @ P for x of shape (..., in_dim)"""
+        return self._apply(x.reshape(-1, self.in_dim)).reshape(*x.shape[:-1], self.out_dim)
+
+    def apply_transpose(self, y):
+        """y @ P^T for y of shape (..., out_dim)"""
+        return self._apply_transpose(y.reshape(-1, self.out_dim)).reshape(*y.shape[:-1], self.in_dim)
+
+    def __rmatmul__(self, x):
+        if isinstance(x, np.ndarray):
+            return self.apply(torch.from_numpy(x).float()).numpy()
+        return self.to(x.device).apply(x)
+
+    def matrix(self):
+        """Dense (in_dim, out_dim) matrix"""
+        return self.apply(torch.eye(self.in_dim, device=self.device))
+
+    def _gram_factor(self):
+        # P^T P (out_dim x out_dim) when projecting down, P P^T (in_dim x in_dim) otherwise
+        if self._factor is None:
+            P = self.matrix().double()
+            G = P.t() @ P if self.out_dim <= self.in_dim else P @ P.t()
+            L, info = torch.linalg.cholesky_ex(G)
+            # fall back to the pseudo-inverse of the Gram matrix when it is singular
+            self._factor = (True, L) if info.item() == 0 else (False, torch.linalg.pinv(G))
+        return self._factor
+
+    def unproject(self, y, exact=True):
+        """
+            y @ pinv(P) for y of shape (..., out_dim)
+            exact: if False, use the scaled transpose P^T / (in_dim * std^2), the expectation of pinv(P) for out_dim << in_dim
+        """
+        numpy_input = isinstance(y, np.ndarray)
+        if numpy_input:
+            y = torch.from_numpy(y).float()
+        if y.device != self.device:
+            return self.to(y.device).unproject(y, exact=exact)
+        if not exact:
+            x = self.apply_transpose(y) / (self.in_dim * self.std ** 2)
+        else:
+            factor = self._gram_factor()
+            z = y.reshape(-1, self.out_dim).double()
+            if self.out_dim <= self.in_dim:
+                # pinv(P) = (P^T P)^-1 P^T
+                z = self._solve(factor, z)
+                x = self._apply_transpose(z.to(y.dtype))
+            else:
+                # pinv(P) = P^T (P P^T)^-1
+                x = self._solve(factor, self._apply_transpose(z.to(y.dtype)).double()).to(y.dtype)
+            x = x.reshape(*y.shape[:-1], self.in_dim)
+        return x.numpy() if numpy_input else x
+
+    @staticmethod
+    def _solve(factor, z):
+        # z @ G^-1 with G symmetric, factor is its Cholesky factor or its pseudo-inverse
+        is_cholesky, matrix = factor
+        if is_cholesky:
+            return torch.cholesky_solve(z.t(), matrix).t()
+        return z @ matrix
+
+    def pinv(self):
+        """Dense (out_dim, in_dim) pseudo-inverse, for code that needs the matrix itself"""
+        return self.unproject(torch.eye(self.out_dim, device=self.device))
+
+    def to(self, device):
+        """Copy of the projection on device, cached so that calling .cuda() in a loop is free"""
+        device = torch.device(device)
+        if device.type == 'cuda' and device.index is None:
+            device = torch.device('cuda', torch.cuda.current_device())
+        if device == self.device:
+            return self
+        if device not in self._devices:
+            other = self.__class__.__new__(self.__class__)
+            other.__dict__.update(self.__dict__)
+            other._devices = {}
+            other._factor = None if self._factor is None else (self._factor[0], self._factor[1].to(device))
+            other.device = device
+            other._set_buffers({k: v.to(device) for k, v in self._buffers().items()})
+            self._devices[device] = other
+        return self._devices[device]
+
+    def cuda(self):
+        return self.to('cuda')
+
+    def cpu(self):
+        return self.to('cpu')
+
+    def state_dict(self):
+        state = {'kind': self.kind, 'in_dim': self.in_dim, 'out_dim': self.out_dim, 'seed': self.seed, 'std': self.std}
+        state.update({k: v.cpu() for k, v in self._buffers().items()})
+        return state
+
+    def save(self, path):
+        torch.save(self.state_dict(), path)
+
+    @staticmethod
+    def load(path):
+        state = torch.load(path)
+        projection = PROJECTIONS[state['kind']].__new__(PROJECTIONS[state['kind']])
+        Projection.__init__(projection, state['in_dim'], state['out_dim'], state['seed'], state['std'])
+        projection._set_buffers(state)
+        return projection
+
+    def __repr__(self):
+        return "{}(in_dim={}, out_dim={}, seed={})".format(self.__class__.__name__, self.in_dim, self.out_dim, self.seed)
+
+
+class GaussianProjection(Projection):
+    """Dense i.i.d. N(0, std^2) matrix, the original proj_matrix"""
+    kind = 'gaussian'
+
+    def __init__(self, in_dim, out_dim, seed=0, std=0.1):
+        super(GaussianProjection, self).__init__(in_dim, out_dim, seed, std)
+        self.weight = torch.empty(in_dim, out_dim).normal_(mean=0, std=std, generator=self._generator())
+
+    def _apply(self, x):
+        return x @ self.weight
+
+    def _apply_transpose(self, y):
+        return y @ self.weight.t()
+
+    def matrix(self):
+        return self.weight
+
+    def _buffers(self):
+        return {'weight': self.weight}
+
+    def _set_buffers(self, buffers):
+        self.weight = buffers['weight']
+
+
+class SparseProjection(Projection):
+    """Very sparse random projection (Achlioptas 2003, Li et al. 2006).
+
+    Entries are +-std*sqrt(s) with probability 1/(2s) each and 0 otherwise, s = sqrt(in_dim) by
+    default (s = 3 is Achlioptas' database-friendly projection), so only in_dim * out_dim / s entries
+    are stored and multiplied.
+    """
+    kind = 'sparse'
+
+    def __init__(self, in_dim, out_dim, seed=0, std=0.1, s=None):
+        super(SparseProjection, self).__init__(in_dim, out_dim, seed, std)
+        s = math.sqrt(in_dim) if s is None else s
+        generator = self._generator()
+        flat = (torch.rand(in_dim * out_dim, generator=generator) < 1. / s).nonzero(as_tuple=True)[0]
+        signs = torch.randint(0, 2, (len(flat),), generator=generator).float().mul_(2).sub_(1)
+        self.rows = flat // out_dim
+        self.cols = flat % out_dim
+        self.values = signs * std * math.sqrt(s)
+        self._build()
+
+    def _build(self):
+        indices = torch.stack((self.rows, self.cols), dim=0)
+        weight = torch.sparse_coo_tensor(indices, self.values, (self.in_dim, self.out_dim), check_invariants=False).coalesce()
+        with warnings.catch_warnings():
+            # CSR is flagged as beta but sparse CSR @ dense (and its gradient w.r.t. the dense side) is supported
+            warnings.simplefilter('ignore')
+            self.weight = weight.to_sparse_csr()
+            self.weight_t = weight.t().coalesce().to_sparse_csr()
+
+    def _apply(self, x):
+        # (P^T x^T)^T
+        return (self.weight_t @ x.t()).t()
+
+    def _apply_transpose(self, y):
+        return (self.weight @ y.t()).t()
+
+    def matrix(self):
+        return self.weight.to_dense()
+
+    def _buffers(self):
+        return {'rows': self.rows, 'cols': self.cols, 'values': self.values}
+
+    def _set_buffers(self, buffers):
+        self.rows = buffers['rows']
+        self.cols = buffers['cols']
+        self.values = buffers['values']
+        self._build()
+
+
+class HadamardProjection(Projection):
+    """Subsampled randomized Hadamard transform (SRHT / FJLT, Ailon & Chazelle 2006).
+
+    x is zero-padded to the next power of 2 n, multiplied by random signs, transformed by the
+    orthonormal Walsh-Hadamard transform (fwht, O(n sqrt(n)) as two BLAS products) and out_dim
+    coordinates are kept (with replacement when out_dim > n). The scaling std*sqrt(n) gives +-std entries. Without padding
+    the columns are orthogonal and the pseudo-inverse is the scaled transpose.
+    """
+    kind = 'hadamard'
+
+    def __init__(self, in_dim, out_dim, seed=0, std=0.1):
+        super(HadamardProjection, self).__init__(in_dim, out_dim, seed, std)
+        self.n = 1 << (in_dim - 1).bit_length()
+        generator = self._generator()
+        self.signs = torch.randint(0, 2, (in_dim,), generator=generator).float().mul_(2).sub_(1)
+        if out_dim <= self.n:
+            self.index = torch.randperm(self.n, generator=generator)[:out_dim].sort()[0]
+        else:
+            self.index = torch.randint(0, self.n, (out_dim,), generator=generator)
+        self.scale = std * math.sqrt(self.n)
+
+    def _apply(self, x):
+        x = x * self.signs
+        if self.n > self.in_dim:
+            x = torch.nn.functional.pad(x, (0, self.n - self.in_dim))
+        return fwht(x)[:, self.index] * self.scale
+
+    def _apply_transpose(self, y):
+        x = torch.zeros(y.shape[0], self.n, dtype=y.dtype, device=y.device)
+        x = x.index_add(1, self.index, y * self.scale)
+        return fwht(x)[:, :self.in_dim] * self.signs
+
+    def _buffers(self):
+        return {'signs': self.signs, 'index': self.index}
+
+    def _set_buffers(self, buffers):
+        self.signs = buffers['signs']
+        self.index = buffers['index']
+        self.n = 1 << (self.in_dim - 1).bit_length()
+        self.scale = self.std * math.sqrt(self.n)
+
+
+PROJECTIONS = {
+    'gaussian': GaussianProjection,
+    'sparse': SparseProjection,
+    'hadamard': HadamardProjection,
+}
+
+
+def make_projection(kind, in_dim, out_dim, seed=0, std=0.1):
+    if kind not in PROJECTIONS:
+        raise ValueError("Unknown projection {}, expected one of {}".format(kind, list(PROJECTIONS)))
+    return PROJECTIONS[kind](in_dim, out_dim, seed=seed, std=std)
+
+
+def get_projection(opt, in_dim=None):
+    """Projection of the experiment, created from opt and kept in CONF.PATH.CACHE/projections, keyed by
+    its kind, dimensions and seed, so that every stage of the run, its reruns and the other runs with
+    the same key project with the same matrix"""
+    if in_dim is None:
+        in_dim = opt.channels * opt.img_size ** 2
+    seed = opt.projection_seed if opt.projection_seed >= 0 else opt.seed
+
+    root = os.path.join(CONF.PATH.CACHE, 'projections')
+    key = {'projection': opt.projection, 'in_dim': in_dim, 'out_dim': opt.dim, 'seed': seed}
+    path = os.path.join(root, cache_key(key) + '.pt')
+    if os.path.isfile(path):
+        return Projection.load(path)
+
+    projection = make_projection(opt.projection, in_dim, opt.dim, seed=seed)
+    if not os.path.exists(root):
+        os.makedirs(root, exist_ok=True)
+    # concurrent runs write the same content, each through a file of its own
+    tmp_path = path + '.tmp.{}'.format(os.getpid())
+    projection.save(tmp_path)
+    os.replace(tmp_path, path)
+    return projection
+
+
+def projection_key(proj_matrix):
+    """Hash of a Projection (its kind and seed) or of the content of a dense matrix (tensor or array)"""
+    if isinstance(proj_matrix, Projection):
+        state = (proj_matrix.kind, proj_matrix.in_dim, proj_matrix.out_dim, proj_matrix.seed, proj_matrix.std)
+        return hashlib.sha1(repr(state).encode()).hexdigest()
+    if torch.is_tensor(proj_matrix):
+        proj_matrix = proj_matrix.detach().cpu().numpy()
+    proj_matrix = np.ascontiguousarray(proj_matrix)
+    h = hashlib.sha1(repr((proj_matrix.shape, proj_matrix.dtype.str)).encode())
+    h.update(proj_matrix.data)
+    return h.hexdigest()
+
+
+_PINV = {}
+
+
+def _cached_pinv(proj_matrix, numpy_output=False):
+    # one pseudo-inverse per matrix, device and output type, however many times the matrix is passed
+    device = 'numpy' if numpy_output else str(proj_matrix.device if torch.is_tensor(proj_matrix) or isinstance(proj_matrix, Projection) else 'cpu')
+    key = (projection_key(proj_matrix), device)
+    if key not in _PINV:
+        if numpy_output:
+            _PINV[key] = np.linalg.pinv(np.asarray(proj_matrix.cpu() if torch.is_tensor(proj_matrix) else proj_matrix))
+        elif isinstance(proj_matrix, Projection):
+            _PINV[key] = proj_matrix.pinv()
+        else:
+            _PINV[key] = torch.linalg.pinv(torch.as_tensor(proj_matrix))
+    return _PINV[key]
+
+
+def unproject(samples, proj_matrix):
+    """samples @ pinv(proj_matrix) for a Projection or a dense matrix (tensor or array), the pseudo-inverse of a dense matrix computed once"""
+    if isinstance(proj_matrix, Projection):
+        return proj_matrix.unproject(samples)
+    if isinstance(samples, np.ndarray):
+        return samples @ _cached_pinv(proj_matrix, numpy_output=True)
+    return samples @ _cached_pinv(proj_matrix).to(samples.device)
+
+
+def pinv(proj_matrix):
+    """Dense pseudo-inverse of a Projection or a dense matrix, computed once per matrix"""
+    return _cached_pinv(proj_matrix)
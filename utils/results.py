@@ -0,0 +1,129 @@
+import os
+import csv
+import atexit
+import signal
+import threading
+
+
+class ResultsWriter:
+    """Buffered writer of the rows of a results CSV file.
+
+    writerow() only appends the row to an in-memory buffer. The buffer is appended to the file by the
+    background flusher thread every flush_interval seconds, or as soon as it holds flush_rows rows,
+    with one open() for the whole buffer instead of one per row. The rows are written by csv.writer
+    with the same delimiter as before, so the files are unchanged. All the writers are flushed at
+    exit, on an uncaught exception and on SIGTERM, so a crash loses at most one flush interval.
+    """
+    def __init__(self, path, flush_rows=1000, flush_interval=5.0):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.rows = []
+        # reentrant: the SIGTERM handler flushes on the main thread, which may hold them in writerow() or flush()
+        self.lock = threading.RLock()
+        self.flush_lock = threading.RLock()
+
+    def writerow(self, row):
+        with self.lock:
+            self.rows.append(row)
+            full = len(self.rows) >= self.flush_rows
+        if full:
+            _flusher.wake()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        # flush_lock keeps the rows of two concurrent flushes in order
+        with self.flush_lock:
+            with self.lock:
+                rows, self.rows = self.rows, []
+            if not rows:
+                return
+            try:
+                with open(self.path, 'a') as logfile:
+                    logwriter = csv.writer(logfile, delimiter=',')
+                    logwriter.writerows(rows)
+            except OSError:
+                with self.lock:
+                    self.rows = rows + self.rows
+                raise
+
+
+class _Flusher:
+    """Background thread flushing all the open writers, started with the first writer"""
+    def __init__(self):
+        self.writers = {}
+        # reentrant for the SIGTERM handler, see ResultsWriter
+        self.lock = threading.RLock()
+        self.event = threading.Event()
+        self.thread = None
+
+    def writer(self, path, **kwargs):
+        path = os.path.abspath(path)
+        with self.lock:
+            if path not in self.writers:
+                self.writers[path] = ResultsWriter(path, **kwargs)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+                _install_signal_handler(signal.SIGTERM, self.flush)
+            return self.writers[path]
+
+    def wake(self):
+        self.event.set()
+
+    def run(self):
+        while True:
+            with self.lock:
+                writers = list(self.writers.values())
+            interval = min([w.flush_interval for w in writers] or [5.0])
+            self.event.wait(interval)
+            self.event.clear()
+            for w in writers:
+                try:
+                    w.flush()
+                except OSError as e:
+                    # keep the rows in memory and retry at the next interval (deleted log dir, full disk, ...)
+                    print("Could not write {}: {}".format(w.path, e))
+
+    def flush(self, path=None):
+        with self.lock:
+            if path is None:
+                writers = list(self.writers.values())
+            else:
+                writers = [self.writers[p] for p in [os.path.abspath(path)] if p in self.writers]
+        for w in writers:
+            w.flush()
+
+
+def _install_signal_handler(signum, flush_fn):
+    """Flush before the previous handler of signum runs, or before the default action kills the process"""
+    if threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signum)
+
+    def handler(sig, frame):
+        flush_fn()
+        if callable(previous):
+            previous(sig, frame)
+        elif previous != signal.SIG_IGN:
+            signal.signal(sig, signal.SIG_DFL)
+            os.kill(os.getpid(), sig)
+
+    signal.signal(signum, handler)
+
+
+_flusher = _Flusher()
+
+
+def results_writer(path, **kwargs):
+    """The buffered writer of the results file path, shared by all the callers of the process"""
+    return _flusher.writer(path, **kwargs)
+
+
+def flush_results(path=None):
+    """Write the buffered rows of path, or of all the results files, before reading them back"""
+    _flusher.flush(path)
@@ -0,0 +1,88 @@
+import os
+import sys
+import contextlib
+
+import torch
+
+sys.path.append('..') #Hack add ROOT DIR
+from baseconfig import CONF
+from utils.cache import cache_key
+from utils.manifest import config_hash
+
+
+# artifacts shared by the runs, at the path the teacher store resolved for the run (see TeacherStore)
+SHARED = {'teacher_w0.pth': 'teacher_w0_path', 'teacher_wstar.pth': 'teacher_wstar_path'}
+# artifacts that only depend on the data and the seed, shared by the runs of all the models and experiments
+DATA_ARTIFACTS = ('pretrained_vae.pth',)
+
+
+class RunContext:
+    """Artifacts of one run (policy, seed, configuration), under a directory of its own.
+
+    The files the policies, init_data and the unrolled optimizers used to write to the working
+    directory with fixed names (proj_matrix.pt, pretrained_vae.pth, tmp_fc.pth, ...) are resolved under
+    opt.run_path, log_path/runs/<seed>_<config hash>, so that concurrent runs never share them. Every
+    write goes to a temporary file moved into place, and a reader sees either the previous or the
+    new version of a file, never a partial one. The teacher weights resolve to the files of the
+    TeacherStore recorded in opt by the policy, and the DATA_ARTIFACTS (e.g. the VAE pretrained by one
+    run and loaded by the others) to a file of the cache keyed by the data and the seed.
+    """
+    def __init__(self, opt):
+        self.opt = opt
+        if getattr(opt, 'run_path', None) is None:
+            opt.run_path = run_path(opt)
+        self.root = opt.run_path
+        if not os.path.exists(self.root):
+            os.makedirs(self.root, exist_ok=True)
+
+    def path(self, name):
+        if name in SHARED and getattr(self.opt, SHARED[name], None) is not None:
+            return getattr(self.opt, SHARED[name])
+        if name in DATA_ARTIFACTS:
+            return data_artifact_path(self.opt, name)
+        return os.path.join(self.root, name)
+
+    @contextlib.contextmanager
+    def atomic(self, name):
+        """Temporary path to write the artifact name to, moved into place when the block exits without error"""
+        path = self.path(name)
+        tmp_path = path + '.tmp.{}'.format(os.getpid())
+        try:
+            yield tmp_path
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def save(self, obj, name):
+        with self.atomic(name) as tmp_path:
+            torch.save(obj, tmp_path)
+        return self.path(name)
+
+    def load(self, name, **kwargs):
+        return torch.load(self.path(name), **kwargs)
+
+    def exists(self, name):
+        return os.path.isfile(self.path(name))
+
+
+def run_path(opt):
+    """Directory of the artifacts of the run of opt, by seed and hash of its options"""
+    return os.path.join(opt.log_path, 'runs', '{}_{}'.format(opt.seed, config_hash(opt)))
+
+
+def data_artifact_path(opt, name):
+    """Path of the artifact name of the data and seed of opt, under CONF.PATH.CACHE/artifacts"""
+    # utils.data imports this module
+    from utils.data import data_key
+    key = {'artifact': name, 'data_mode': opt.data_mode, 'data': data_key(opt), 'seed': opt.seed}
+    root = os.path.join(CONF.PATH.CACHE, 'artifacts')
+    if not os.path.exists(root):
+        os.makedirs(root, exist_ok=True)
+    return os.path.join(root, cache_key(key) + os.path.splitext(name)[1])
+
+
+def start_run(opt):
+    """The RunContext of a new run of opt, recorded in opt.run_path for the code that only gets opt"""
+    opt.run_path = run_path(opt)
+    return RunContext(opt)
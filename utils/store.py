@@ -0,0 +1,180 @@
+import os
+import sys
+import csv
+import json
+
+import numpy as np
+
+sys.path.append('..') #Hack add ROOT DIR
+from baseconfig import CONF
+from utils.cache import cache_key, file_lock
+
+
+def opt_params(opt):
+    """Scalar hyperparameters of opt, the json-serializable part of the run key"""
+    return {k: v for k, v in sorted(vars(opt).items())
+            if isinstance(v, (bool, int, float, str)) and not k.endswith('path')}
+
+
+def read_results_csv(csv_path):
+    """Columns of a results CSV as a dict name -> float64 array, in the order of the header"""
+    with open(csv_path, 'r') as csvfile:
+        header = next(csv.reader(csvfile, delimiter=','))
+        lines = csvfile.readlines()
+    try:
+        values = np.loadtxt(lines, delimiter=',', ndmin=2)
+    except ValueError:
+        # non-numeric cells (e.g. a tensor repr) become nan instead of failing the whole file
+        values = np.genfromtxt(lines, delimiter=',', ndmin=2)
+    values = values.reshape(-1, len(header))
+    return {name: values[:, i] for i, name in enumerate(header)}
+
+
+class ResultsStore:
+    """Columnar store of the results of the runs.
+
+    Every run is one .npz file of float64 columns (iter, test acc, w diff, ...) under runs/, named
+    after the hash of its key, and one line of the append-only manifest.jsonl with the key itself:
+    policy (model_name), data_mode, model, experiment, seed, hyperparameters, column names, length
+    and, for the runs ingested from a results CSV, the path, size and mtime of the CSV. Queries only
+    read the manifest and the columns they need, and the CSV of a run is parsed once, when it
+    changes, instead of by every plot.
+    """
+    def __init__(self, root=None):
+        self.root = root if root is not None else os.path.join(CONF.PATH.RESULTS, 'store')
+        self.manifest_path = os.path.join(self.root, 'manifest.jsonl')
+        if not os.path.exists(os.path.join(self.root, 'runs')):
+            os.makedirs(os.path.join(self.root, 'runs'), exist_ok=True)
+        self._manifest = {}
+        self._manifest_size = 0
+
+    # ---------------------
+    #  Manifest
+    # ---------------------
+
+    def manifest(self):
+        """run id -> record of the latest version of every run, reading only the lines appended since the last call"""
+        if not os.path.isfile(self.manifest_path):
+            return self._manifest
+        size = os.path.getsize(self.manifest_path)
+        if size < self._manifest_size:
+            self._manifest, self._manifest_size = {}, 0
+        if size > self._manifest_size:
+            with open(self.manifest_path, 'r') as f:
+                f.seek(self._manifest_size)
+                for line in f:
+                    if line.endswith('\n'):
+                        record = json.loads(line)
+                        self._manifest[record['run']] = record
+                        self._manifest_size += len(line.encode('utf-8'))
+        return self._manifest
+
+    def _append(self, record):
+        with file_lock(self.manifest_path + '.lock'):
+            with open(self.manifest_path, 'a') as f:
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+
+    # ---------------------
+    #  Recording
+    # ---------------------
+
+    def record(self, columns, run=None, source=None, **keys):
+        """
+        Store the columns (dict name -> 1d array) of a run
+        :param run: id of the run, the hash of keys by default
+        :param source: path, size and mtime of the CSV the columns come from
+        :param keys: json-serializable key of the run, e.g. policy, data_mode, model, experiment, seed, params
+        :return: the run id
+        """
+        run = cache_key(keys) if run is None else run
+        path = os.path.join(self.root, 'runs', run + '.npz')
+        tmp_path = path + '.tmp.{}.npz'.format(os.getpid())
+        np.savez(tmp_path, **{name: np.asarray(column, dtype=np.float64) for name, column in columns.items()})
+        os.replace(tmp_path, path)
+
+        record = dict(keys, run=run, columns=list(columns), length=min([len(c) for c in columns.values()] or [0]))
+        if source is not None:
+            record['source'] = source
+        self._append(record)
+        return run
+
+    def ingest_csv(self, csv_path, **keys):
+        """
+        Record a results CSV as a run, identified by the path of the CSV, unless its current version was
+        already recorded with the same keys. A rewritten CSV replaces its run instead of adding one.
+        :return: the run id
+        """
+        csv_path = os.path.abspath(csv_path)
+        stat = os.stat(csv_path)
+        source = {'path': csv_path, 'size': stat.st_size, 'mtime': stat.st_mtime}
+        run = cache_key({'source_path': csv_path})
+        record = self.manifest().get(run)
+        if record is not None:
+            if record.get('source') == source and all(record.get(k) == v for k, v in keys.items()):
+                return run
+            keys = dict({k: v for k, v in record.items() if k not in ('run', 'columns', 'length', 'source')}, **keys)
+        return self.record(read_results_csv(csv_path), run=run, source=source, **keys)
+
+    def ingest_log_dir(self, log_root, model_name):
+        """
+        Ingest the results CSVs of a policy, laid out as log_root/model_name/seed/model/experiment/*.csv
+        :return: the run ids
+        """
+        runs = []
+        policy_dir = os.path.join(log_root, model_name)
+        for dirpath, _, filenames in os.walk(policy_dir):
+            parts = os.path.relpath(dirpath, policy_dir).split(os.sep)
+            if len(parts) != 3:
+                continue
+            seed, model, experiment = parts
+            for filename in sorted(filenames):
+                if filename.endswith('.csv'):
+                    runs.append(self.ingest_csv(os.path.join(dirpath, filename), policy=model_name,
+                                                seed=int(seed) if seed.isdigit() else seed, model=model, experiment=experiment))
+        return runs
+
+    # ---------------------
+    #  Queries
+    # ---------------------
+
+    def runs(self, **query):
+        """
+        Run ids matching every key of query, in the order they were first recorded. A list value matches any
+        of its elements, a dict value (params) matches if all its items match.
+        """
+        def match(record, key, value):
+            if isinstance(value, dict):
+                return all(match(record.get(key, {}), k, v) for k, v in value.items())
+            if isinstance(value, (list, tuple, set)):
+                return record.get(key) in value
+            return record.get(key) == value
+
+        return [run for run, record in self.manifest().items() if all(match(record, k, v) for k, v in query.items())]
+
+    def column(self, run, column):
+        """Column of a run, by name or by position in the header"""
+        if isinstance(column, int):
+            column = self.manifest()[run]['columns'][column]
+        with np.load(os.path.join(self.root, 'runs', run + '.npz')) as columns:
+            return columns[column]
+
+    def curves(self, column, runs=None, **query):
+        """(n_runs, length) array of a column of the runs (of query), truncated to the shortest run"""
+        runs = self.runs(**query) if runs is None else runs
+        values = [self.column(run, column) for run in runs]
+        length = min([len(v) for v in values] or [0])
+        return np.stack([v[:length] for v in values]) if values else np.empty((0, 0))
+
+    def final(self, column, runs=None, **query):
+        """Last value of a column of every run"""
+        runs = self.runs(**query) if runs is None else runs
+        return np.array([self.column(run, column)[-1] for run in runs])
+
+    def mean_std(self, column, runs=None, **query):
+        """Mean and std curves of a column over the runs"""
+        values = self.curves(column, runs, **query)
+        return values.mean(axis=0), values.std(axis=0)
+
+    def csv_curves(self, csv_paths, column):
+        """curves() of results CSV files, ingested on the fly"""
+        return self.curves(column, runs=[self.ingest_csv(path) for path in csv_paths if os.path.isfile(path)])
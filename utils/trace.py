@@ -0,0 +1,150 @@
+import os
+
+import numpy as np
+import torch
+
+
+class TraceRecorder:
+    """Samples and labels selected or generated by a teacher, one batch per step.
+
+    The buffers of n_steps batches are allocated at the first record(), when the shape of a batch is
+    known, and every step is copied into its slot instead of concatenating the whole trace again. In
+    memory, the buffers live on the device of the recorded tensors, so recording does not wait for the
+    device, and the trace is copied to the host once, when samples or labels are read. With a path, the
+    buffers are .npy files memory-mapped at path + '_samples.npy' and path + '_labels.npy', for the long
+    runs whose trace does not fit in memory. save() at the end of the stage persists the trace with the
+    run, the recorded rows only, so that load() reads it back without the padding of the buffers.
+    """
+    def __init__(self, n_steps, path=None, save_path=None):
+        self.n_steps = max(n_steps, 1)
+        self.path = path
+        self.save_path = save_path if save_path is not None else path
+        self.n = 0
+        self.buffers = None
+        self.host = None
+
+    def __len__(self):
+        return self.n
+
+    def _allocate(self, name, batch, capacity):
+        shape = (capacity,) + tuple(batch.shape[1:])
+        if self.path is None:
+            return torch.empty(shape, dtype=batch.dtype, device=batch.device)
+        dtype = torch.empty(0, dtype=batch.dtype).numpy().dtype
+        return np.lib.format.open_memmap(self.path + '_' + name + '.npy', mode='w+', dtype=dtype, shape=shape)
+
+    def _grow(self, name, buffer, batch, capacity):
+        if self.path is None:
+            new = self._allocate(name, batch, capacity)
+            new[:self.n] = buffer[:self.n]
+            return new
+        # write the larger file next to the current one and swap them
+        final_path = self.path + '_' + name + '.npy'
+        tmp_path = self.path + '_' + name + '.tmp'
+        new = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=buffer.dtype, shape=(capacity,) + buffer.shape[1:])
+        new[:self.n] = buffer[:self.n]
+        del buffer
+        os.replace(tmp_path, final_path)
+        return new
+
+    def record(self, samples, labels):
+        """Append one step, tensors (on any device) or arrays of the same number of rows"""
+        samples = torch.as_tensor(samples).detach()
+        labels = torch.as_tensor(labels).detach()
+        batch = {'samples': samples, 'labels': labels}
+        b = samples.shape[0]
+
+        if self.buffers is None:
+            if self.path is not None and os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.buffers = {name: self._allocate(name, x, self.n_steps * b) for name, x in batch.items()}
+        elif self.n + b > len(self.buffers['samples']):
+            # more steps than announced, double the capacity to keep recording amortized O(1)
+            capacity = max(2 * len(self.buffers['samples']), self.n + b)
+            self.buffers = {name: self._grow(name, self.buffers[name], batch[name], capacity) for name in batch}
+
+        for name, x in batch.items():
+            if self.path is None:
+                self.buffers[name][self.n:self.n + b].copy_(x, non_blocking=True)
+            else:
+                self.buffers[name][self.n:self.n + b] = x.cpu().numpy()
+        self.n += b
+        self.host = None
+
+    def _view(self, name):
+        if self.buffers is None:
+            return np.empty((0,))
+        if self.path is not None:
+            return self.buffers[name][:self.n]
+        if self.host is None:
+            self.host = {k: v[:self.n].cpu().numpy() for k, v in self.buffers.items()}
+        return self.host[name]
+
+    @property
+    def samples(self):
+        """(n, ...) array of the recorded samples, copied to the host at the first read after a record()"""
+        return self._view('samples')
+
+    @property
+    def labels(self):
+        return self._view('labels')
+
+    def save(self, path=None):
+        """
+        Persist the trace as path_samples.npy and path_labels.npy, save_path by default. The files of a
+        memory-mapped trace are truncated in place to the recorded rows, which ends the recording.
+        """
+        path = path if path is not None else self.save_path
+        if path is None:
+            return
+        if self.path is not None and os.path.abspath(path) == os.path.abspath(self.path):
+            self.flush()
+            if self.buffers is not None:
+                for name in self.buffers:
+                    truncate_npy(self.path + '_' + name + '.npy', self.n)
+                self.buffers = dict(zip(('samples', 'labels'), self.load(self.path)))
+            return
+        if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        for name, values in (('samples', self.samples), ('labels', self.labels)):
+            tmp_path = path + '_' + name + '.tmp.npy'
+            np.save(tmp_path, values)
+            os.replace(tmp_path, path + '_' + name + '.npy')
+
+    def flush(self):
+        if self.path is not None and self.buffers is not None:
+            for buffer in self.buffers.values():
+                buffer.flush()
+
+    @staticmethod
+    def load(path):
+        """samples, labels of a saved trace, memory-mapped"""
+        return np.load(path + '_samples.npy', mmap_mode='r'), np.load(path + '_labels.npy', mmap_mode='r')
+
+
+def truncate_npy(path, n):
+    """Shrink the .npy file at path to its first n rows in place, rewriting its header with the same length"""
+    with open(path, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+        prefix = 10 if version == (1, 0) else 12
+        header = "{{'descr': {!r}, 'fortran_order': {!r}, 'shape': {!r}, }}".format(
+            np.lib.format.dtype_to_descr(dtype), fortran_order, (n,) + tuple(shape[1:]))
+        f.seek(prefix)
+        f.write(header.ljust(offset - prefix - 1).encode('latin1') + b'\n')
+        f.truncate(offset + n * int(np.prod(shape[1:], dtype=np.int64)) * dtype.itemsize)
+
+
+def trace_recorder(opt, n_steps, name):
+    """
+    The recorder of a teaching stage: memory-mapped under the log directory of the run when
+    opt.trace_memmap is set, in memory otherwise, and saved there by save() in both cases
+    :param name: name of the stage, e.g. the experiment
+    """
+    save_path = os.path.join(opt.log_path, 'trace_' + name + '_' + str(opt.seed))
+    path = save_path if getattr(opt, 'trace_memmap', False) else None
+    return TraceRecorder(n_steps, path=path, save_path=save_path)
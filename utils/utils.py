@@ -34,19 +34,63 @@ def mixup_data(x, y, alpha=1.0, use_cuda=True):
 def mixup_criterion(y_a, y_b, lam):
     return lambda criterion, pred: lam * criterion(pred, y_a) + (1 - lam) * criterion(pred, y_b)
 
-def get_mean_and_std(dataset):
-    '''Compute the mean and std value of dataset.'''
-    dataloader = torch.utils.data.DataLoader(dataset, batch_size=1, shuffle=True, num_workers=2)
-    mean = torch.zeros(3)
-    std = torch.zeros(3)
+class ChannelStats:
+    """Running per-channel mean and variance of batches of shape (B, C, ...), in float64.
+
+    Every batch is reduced to its count, mean and sum of squared deviations, which are merged
+    into the running ones with the parallel update of Chan et al., so the result is the exact
+    statistic over all the values of a channel and does not suffer from the cancellation of
+    the sum-of-squares formula.
+    """
+    def __init__(self):
+        self.n = 0
+        self.mean = None
+        self.m2 = None
+
+    def update(self, x):
+        x = x.detach().transpose(0, 1).reshape(x.shape[1], -1).double()
+        n_b = x.shape[1]
+        mean_b = x.mean(dim=1)
+        m2_b = ((x - mean_b.unsqueeze(1)) ** 2).sum(dim=1)
+        if self.n == 0:
+            self.n, self.mean, self.m2 = n_b, mean_b, m2_b
+            return
+        n = self.n + n_b
+        delta = mean_b - self.mean
+        self.mean = self.mean + delta * n_b / n
+        self.m2 = self.m2 + m2_b + delta ** 2 * self.n * n_b / n
+        self.n = n
+
+    def merge(self, other):
+        """Combine with the statistics of another part of the dataset (e.g. computed by another worker)"""
+        if other.n == 0:
+            return
+        if self.n == 0:
+            self.n, self.mean, self.m2 = other.n, other.mean, other.m2
+            return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.n / n
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.n * other.n / n
+        self.n = n
+
+    @property
+    def var(self):
+        return self.m2 / self.n
+
+    @property
+    def std(self):
+        return self.var.sqrt()
+
+
+def get_mean_and_std(dataset, batch_size=1024, num_workers=2):
+    '''Compute the per-channel mean and std of all the pixels of a dataset, in one pass.'''
+    dataloader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    stats = ChannelStats()
     print('==> Computing mean and std..')
     for inputs, targets in dataloader:
-        for i in range(3):
-            mean[i] += inputs[:,i,:,:].mean()
-            std[i] += inputs[:,i,:,:].std()
-    mean.div_(len(dataset))
-    std.div_(len(dataset))
-    return mean, std
+        stats.update(inputs)
+    return stats.mean.float(), stats.std.float()
 
 def init_params(net):
     '''Init layer parameters.'''
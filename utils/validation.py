@@ -0,0 +1,141 @@
+import math
+
+import torch
+import torch.nn as nn
+
+
+class ValidationEstimator:
+    """Cheap estimate of the validation loss and accuracy used inside teaching episodes.
+
+    The validation set is cached once as device-resident tensors. Every call evaluates a stratified
+    subsample chunk by chunk, keeping a running mean and variance of the per-sample loss, and stops
+    as soon as the confidence interval is tight enough (rel_tol) or n_subsample samples were seen.
+    When a reference loss is given (the best validation loss so far) and it lies inside the
+    confidence interval, the estimate cannot tell whether the model improved and a full pass is
+    done instead.
+
+    Both the loss and the accuracy are per-sample means over the validation set.
+    """
+    def __init__(self, val_loader, device, n_subsample=1024, chunk_size=256, rel_tol=0.05, z=1.96, seed=0):
+        self.device = device
+        self.n_subsample = n_subsample
+        self.chunk_size = chunk_size
+        self.rel_tol = rel_tol
+        self.z = z
+        self.generator = torch.Generator().manual_seed(seed)
+        self.loss_fn = nn.CrossEntropyLoss(reduction='none')
+
+        inputs_all = []
+        targets_all = []
+        for (inputs, targets) in val_loader:
+            inputs_all.append(inputs)
+            targets_all.append(targets.long())
+        self.X = torch.cat(inputs_all, dim=0).to(device)
+        self.Y = torch.cat(targets_all, dim=0).to(device)
+
+        Y = self.Y.cpu()
+        self.class_indices = [(Y == c).nonzero(as_tuple=True)[0] for c in torch.unique(Y)]
+
+        self.n_full = 0
+        self.n_estimates = 0
+
+    def __len__(self):
+        return len(self.Y)
+
+    def stratified_order(self):
+        """Permutation of the validation set whose every prefix is (close to) class-proportional"""
+        keys = torch.empty(len(self.Y))
+        for idx in self.class_indices:
+            n_c = len(idx)
+            perm = idx[torch.randperm(n_c, generator=self.generator)]
+            keys[perm] = (torch.arange(n_c, dtype=torch.float) + torch.rand(n_c, generator=self.generator)) / n_c
+        return torch.argsort(keys)
+
+    def _evaluate(self, model, idx):
+        outputs = model(self.X[idx])
+        loss = self.loss_fn(outputs, self.Y[idx])
+        correct = (outputs.argmax(dim=1) == self.Y[idx]).float()
+        return loss, correct
+
+    def full(self, model):
+        """Exact validation loss and accuracy"""
+        self.n_full += 1
+        total_loss = 0
+        total_correct = 0
+        with torch.no_grad():
+            for i_min in range(0, len(self.Y), self.chunk_size):
+                idx = torch.arange(i_min, min(i_min + self.chunk_size, len(self.Y)), device=self.device)
+                loss, correct = self._evaluate(model, idx)
+                total_loss += loss.sum().item()
+                total_correct += correct.sum().item()
+        return total_correct / len(self.Y), total_loss / len(self.Y)
+
+    def estimate(self, model, reference=None):
+        """
+            Estimated validation accuracy and loss
+            reference: loss the estimate is compared against, a full pass is done when it lies inside the confidence interval
+            Returns:
+                acc, loss, half width of the loss confidence interval (0 for a full pass)
+        """
+        N = len(self.Y)
+        if self.n_subsample <= 0 or self.n_subsample >= N:
+            acc, loss = self.full(model)
+            return acc, loss, 0.0
+
+        self.n_estimates += 1
+        order = self.stratified_order().to(self.device)
+
+        n = 0
+        loss_sum = 0.0
+        loss_sq_sum = 0.0
+        correct_sum = 0.0
+        half_width = float('inf')
+        with torch.no_grad():
+            while n < self.n_subsample:
+                idx = order[n:min(n + self.chunk_size, self.n_subsample)]
+                loss, correct = self._evaluate(model, idx)
+                loss = loss.double()
+
+                n += len(idx)
+                loss_sum += loss.sum().item()
+                loss_sq_sum += (loss ** 2).sum().item()
+                correct_sum += correct.sum().item()
+
+                mean = loss_sum / n
+                var = max(loss_sq_sum / n - mean ** 2, 0.0) * n / max(n - 1, 1)
+                # finite population correction, the subsample is drawn without replacement
+                half_width = self.z * math.sqrt(var / n * (N - n) / (N - 1))
+                if half_width <= self.rel_tol * mean:
+                    break
+
+        mean = loss_sum / n
+        if reference is not None and abs(mean - reference) <= half_width:
+            acc, loss = self.full(model)
+            return acc, loss, 0.0
+
+        return correct_sum / n, mean, half_width
+
+
+def validation_estimator(trainer, device):
+    """The ValidationEstimator of a trainer, built from trainer.val_loader on first use only"""
+    if getattr(trainer, 'val_estimator', None) is None:
+        trainer.val_estimator = ValidationEstimator(trainer.val_loader, device, n_subsample=trainer.opt.val_subsample, seed=trainer.opt.seed)
+    return trainer.val_estimator
+
+
+def val_estimate(trainer, model, device):
+    """
+        Subsampled val of model used inside the training loop of a trainer, falls back to a full pass when
+        ambiguous. Only trainer.best_test_loss is updated, best_acc is left to the full evaluations (the
+        max of noisy estimates is biased upwards).
+        Returns:
+            acc, loss
+    """
+    model.eval()
+    acc, test_loss, _ = validation_estimator(trainer, device).estimate(model, reference=trainer.best_test_loss)
+    model.train()
+
+    if trainer.best_test_loss > test_loss:
+        trainer.best_test_loss = test_loss
+
+    return acc, test_loss
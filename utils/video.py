@@ -0,0 +1,241 @@
+import os
+import warnings
+import collections
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+import imageio
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+
+class ResultsVideo:
+    """Animated results of a teaching run, rendered from one persistent figure.
+
+    The panels are set up once with the whole data, so that the limits of the axes are the ones of
+    the last frame, and everything that does not change (axes, labels, training data) is drawn once.
+    Frame i then only draws, by blitting, what is new at iteration i: the last segment of every curve
+    and the i-th generated sample of the scatter plots, both kept in the background for the next
+    frames, and on top of them the image and the title of iteration i and the legends. Rendering a
+    frame costs the same whatever the length of the curves, and the frames are RGB arrays streamed
+    to the encoder, without intermediate image files.
+    """
+    def __init__(self, n_panels, figsize):
+        self.fig = Figure()
+        self.fig.set_size_inches(*figsize)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.axes = self.fig.subplots(1, n_panels)
+
+        self.curves = []
+        self.points = []
+        self.images = []
+        self.titles = []
+        self.legends = []
+
+        self.step = 0
+        self.background = None
+
+    # ---------------------
+    #  Panels
+    # ---------------------
+
+    def add_curves(self, ax, curves):
+        """Curves (values, color, label) growing by one point per frame"""
+        for values, color, label in curves:
+            values = np.asarray(values, dtype=np.float64).reshape(-1)
+            line, = ax.plot(values, color=color, label=label)
+            line.set_animated(True)
+            self.curves.append((line, values))
+
+    def add_points(self, ax, samples, labels, **kwargs):
+        """2d samples (and their labels) added one per frame to a scatter plot"""
+        points = ax.scatter(samples[:, 0], samples[:, 1], c=labels, **kwargs)
+        points.set_animated(True)
+        self.points.append((points, np.asarray(samples)[:, :2], np.asarray(labels)))
+
+    def add_image(self, ax, images, **kwargs):
+        """One image per frame, each scaled to its own range"""
+        image = ax.imshow(images[0], **kwargs)
+        image.set_animated(True)
+        self.images.append((image, images))
+
+    def add_title(self, ax, title_fn):
+        """Title of ax at frame i, title_fn(i)"""
+        ax.set_title(title_fn(0))
+        ax.title.set_animated(True)
+        self.titles.append((ax.title, title_fn))
+
+    # ---------------------
+    #  Rendering
+    # ---------------------
+
+    def _draw_step(self, i):
+        for line, values in self.curves:
+            if i < len(values):
+                line.set_data(np.arange(max(i - 1, 0), i + 1), values[max(i - 1, 0):i + 1])
+                self.fig.draw_artist(line)
+        for points, samples, labels in self.points:
+            if i < len(samples):
+                points.set_offsets(samples[i:i + 1])
+                points.set_array(labels[i:i + 1])
+                self.fig.draw_artist(points)
+
+    def _draw_frame(self, i):
+        for image, images in self.images:
+            image.set_data(images[i])
+            image.autoscale()
+            self.fig.draw_artist(image)
+        for title, title_fn in self.titles:
+            title.set_text(title_fn(i))
+            self.fig.draw_artist(title)
+        for legend in self.legends:
+            self.fig.draw_artist(legend)
+
+    def start(self):
+        """Draw the static part of the figure, before any iteration"""
+        # the legends are drawn last, over the curves
+        self.legends = [ax.get_legend() for ax in self.fig.axes if ax.get_legend() is not None]
+        for legend in self.legends:
+            legend.set_animated(True)
+        self.canvas.draw()
+        self.step = 0
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+
+    def render(self, start, stop):
+        """
+        RGB frames start to stop - 1, after the frames already rendered. The curves and points of the
+        iterations skipped since the last frame are drawn first, so a range renders the same pixels as
+        when all the frames are rendered in order.
+        """
+        if start > self.step:
+            self.canvas.restore_region(self.background)
+            for i in range(self.step, start):
+                self._draw_step(i)
+            self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        for i in range(start, stop):
+            self.canvas.restore_region(self.background)
+            self._draw_step(i)
+            self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+            self._draw_frame(i)
+            self.step = i + 1
+            yield np.asarray(self.canvas.buffer_rgba())[..., :3].copy()
+
+    def frames(self, start, stop):
+        """RGB frames start to stop - 1 of a new rendering"""
+        self.start()
+        return self.render(start, stop)
+
+
+def video_writer(path, fps=20):
+    """Encoder appending the frames to path as they come: GIF (one frame in memory) or MP4 (ffmpeg)"""
+    if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    if path.endswith('.gif'):
+        # the legacy Pillow GIF writer encodes every frame on append, the default one keeps all of them
+        return imageio.get_writer(path, format='GIF-PIL', mode='I', fps=fps)
+    return imageio.get_writer(path, fps=fps)
+
+
+class SharedArrays:
+    """numpy arrays copied once into shared memory, attached by name in the worker processes"""
+    def __init__(self, arrays):
+        self.blocks = []
+        self.specs = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            self.specs[name] = (block.name, array.shape, array.dtype.str)
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+def attach_arrays(specs):
+    """The arrays of SharedArrays.specs, and the blocks to keep open while they are used"""
+    blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in specs.values()]
+    arrays = {key: np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+              for (key, (_, shape, dtype)), block in zip(specs.items(), blocks)}
+    return arrays, blocks
+
+
+# video of the worker process, built at its first range and rendering the ranges it is given in increasing order
+_worker = {}
+
+
+def _init_worker(build, opt, specs, rc_params):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        matplotlib.rcParams.update(rc_params)
+    _worker.update(build=build, opt=opt, specs=specs, video=None)
+
+
+def _render_range(start, stop):
+    # built here rather than in the initializer, so that an error is raised by the task instead of restarting the worker
+    if _worker['video'] is None:
+        arrays, _worker['blocks'] = attach_arrays(_worker['specs'])
+        _worker['video'] = _worker['build'](_worker['opt'], **arrays)
+        _worker['video'].start()
+    return list(_worker['video'].render(start, stop))
+
+
+def pool_frames(build, opt, inputs, n_frames, n_workers, chunk_size=8):
+    """
+    Frames 0 to n_frames - 1 of build(opt, **inputs), rendered by n_workers processes.
+
+    The inputs are put once in shared memory, and every worker builds its own figure from them. The
+    frames are split into ranges of chunk_size frames, rendered by the first free worker and yielded in
+    order. A worker keeps its figure from one range to the next and only draws the curves and points of
+    the ranges rendered by the others, so the frames are the same as the serial ones. At most two
+    ranges per worker are pending, so that the frames do not pile up when the encoder is slower. The
+    workers are spawned, not forked from a process holding CUDA and the results flusher thread, so the
+    main script must be guarded by if __name__ == '__main__', like train.py.
+    """
+    shared = SharedArrays(inputs)
+    ctx = multiprocessing.get_context('spawn')
+    try:
+        with ctx.Pool(n_workers, initializer=_init_worker, initargs=(build, opt, shared.specs, dict(matplotlib.rcParams))) as pool:
+            ranges = [(start, min(start + chunk_size, n_frames)) for start in range(0, n_frames, chunk_size)]
+            pending = collections.deque()
+            next_range = 0
+            while next_range < len(ranges) or pending:
+                while next_range < len(ranges) and len(pending) < 2 * n_workers:
+                    pending.append(pool.apply_async(_render_range, ranges[next_range]))
+                    next_range += 1
+                for frame in pending.popleft().get():
+                    yield frame
+    finally:
+        shared.close()
+
+
+def video_workers(n_workers=0):
+    """Number of rendering processes, all the cores if n_workers <= 0"""
+    if n_workers > 0:
+        return n_workers
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def write_video(path, build, opt, inputs, n_frames, fps=20, n_workers=1, chunk_size=8):
+    """
+    Render and encode the frames of the video build(opt, **inputs)
+    :param build: function building the ResultsVideo from opt and the input arrays, defined at module level
+    :param n_workers: number of rendering processes, 1 renders in this process
+    """
+    if n_workers > 1 and multiprocessing.current_process().daemon:
+        # a daemonic process (e.g. a Pool worker) cannot start the workers, render here rather than fail the run
+        n_workers = 1
+    if n_workers > 1 and n_frames > chunk_size:
+        frames = pool_frames(build, opt, inputs, n_frames, n_workers, chunk_size)
+    else:
+        frames = build(opt, **inputs).frames(0, n_frames)
+    with video_writer(path, fps) as writer:
+        for frame in frames:
+            writer.append_data(frame)
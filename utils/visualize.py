@@ -7,8 +7,6 @@ matplotlib.rcParams['ps.fonttype'] = 42
 import matplotlib.pyplot as plt
 
 from matplotlib.colors import ListedColormap
-import imageio
-import glob
 import os
 
 from torchvision.utils import save_image
@@ -17,112 +15,73 @@ from matplotlib.ticker import FormatStrFormatter
 
 import seaborn as sns
 
+from utils.images import trace_images
+from utils.video import ResultsVideo, video_workers, write_video
+
 cm = plt.cm.RdBu
 cm_bright = ListedColormap(['#FF0000', '#0000FF'])
 
 
-def make_results_video(opt, X, Y, generated_samples, generated_labels, res_sgd, res_baseline, res_student, w_diff_sgd, w_diff_baseline, w_diff_student, epoch, seed, proj_matrix=None):
-    if proj_matrix is not None:
-        unproj_matrix = np.linalg.pinv(proj_matrix)
-        # a, b = plot_classifier(teacher, X.max(axis=0), X.min(axis=0))
-        generated_samples = generated_samples @ unproj_matrix
-        img_shape = (1, 28, 28)
-        generated_samples = np.reshape(generated_samples, (generated_samples.shape[0], *img_shape))
-        generated_samples = torch.from_numpy(generated_samples)
-    else:
-        generated_samples = torch.from_numpy(generated_samples)
+def video_path(opt, epoch, seed):
+    video_dir = os.path.join(opt.log_path, "video")
+    return os.path.join(video_dir, 'results_{}_{}_{}.{}'.format(opt.data_mode, epoch, seed, getattr(opt, 'video_format', 'gif')))
 
-    for i in range(len(res_student)-1):
 
-        generated_sample = generated_samples[i].squeeze()
-        generated_label = generated_labels[i]
+def video_images(generated_samples, proj_matrix=None):
+    """Generated samples as (n, h, w) images, unprojected to 28x28 if they were projected"""
+    generated_samples = trace_images(generated_samples, proj_matrix).images
+    return generated_samples.reshape((generated_samples.shape[0],) + tuple(d for d in generated_samples.shape[1:] if d != 1))
 
-        if generated_label == 0.0:
-            generated_label = opt.class_1
-        else:
-            generated_label = opt.class_2
 
-        fig, (ax1, ax2, ax3) = plt.subplots(1, 3)
-        fig.set_size_inches(20, 5.8)
-        #ax1.plot(a, b, '-k', label='Teacher Classifier')
-        # ax1.plot(a_student[i], b_student[i], '-r', label='Optimizer Classifier')
-        ax1.imshow(generated_sample, cmap='gray')
-        # ax1.scatter(generated_samples[:i+1, 0], generated_samples[:i+1, 1], c=generated_labels[:i+1], marker='x')
-        ax1.set_title("Data Generation - Label {}".format((generated_label)))
-        # ax1.set_xlim([X.min()-0.5, X.max()+0.5])
-        # ax1.set_ylim([X.min()-0.5, X.max()+0.5])
-        # ax1.legend(loc="upper right")
-
-        #ax2.plot(a, b, '-k', label='Teacher Classifier')
-        # ax2.plot(a_baseline[i], b_baseline[i], '-g', label='IMT Classifier')
-        # ax2.scatter(X[:, 0], X[:, 1], c=Y)
-        # ax2.scatter(selected_samples[:i+1, 0], selected_samples[:i+1, 1], c=selected_labels[:i+1, 0], marker='x')
-        # ax2.set_title("Data Selection (IMT)")
-        # ax2.set_xlim([X.min()-0.5, X.max()+0.5])
-        # ax2.set_ylim([X.min()-0.5, X.max()+0.5])
-        # ax2.legend(loc="upper right")
-
-        ax2.plot(res_sgd[:i+1], c='g', label="SGD %s" % opt.data_mode)
-        ax2.plot(res_baseline[:i+1], c='b', label="IMT %s" % opt.data_mode)
-        ax2.plot(res_student[:i+1], c='r', label="Student %s" % opt.data_mode)
-        # ax2.axhline(y=teacher_acc, color='k', linestyle='-', label="teacher accuracy")
-        ax2.set_title("Test accuracy " + str(opt.data_mode) + " (class : " + str(opt.class_1) + ", " + str(opt.class_2) + ")")
-        ax2.set_xlabel("Iteration")
-        ax2.set_ylabel("Accuracy")
-        ax2.legend(loc="lower right")
-
-        ax3.plot(w_diff_sgd[:i+1], 'g', label="SGD %s" % opt.data_mode)
-        ax3.plot(w_diff_baseline[:i+1], 'b', label="IMT %s" % opt.data_mode)
-        ax3.plot(w_diff_student[:i+1], 'r', label="Student %s" % opt.data_mode)
-        ax3.legend(loc="lower left")
-        ax3.set_title("w diff " + str(opt.data_mode) + " (class : " + str(opt.class_1) + ", " + str(opt.class_2) + ")")
-        ax3.set_xlabel("Iteration")
-        ax3.set_ylabel("Distance between $w^t$ and $w^*$")
-        #ax3.set_aspect('equal')
-
-        video_dir = os.path.join(opt.log_path, "video")
-        if not os.path.exists(video_dir):
-            os.makedirs(video_dir)
-
-        plt.savefig(video_dir + "/file%03d.png" % i)
+def video_inputs(**inputs):
+    """Inputs of a video builder as numpy arrays (tensors and lists of floats included), to be shared with the rendering processes"""
+    return {name: (value.detach().cpu().numpy() if torch.is_tensor(value) else np.asarray(value)) for name, value in inputs.items()}
 
-        plt.close()
 
-    # os.chdir(video_dir)
-    images = []
-    for file_name in sorted(glob.glob(video_dir + "/*.png")):
-        # print(file_name)
-        images.append(imageio.imread(file_name))
-        # os.remove(file_name)
-    gif_path = os.path.join(video_dir, 'results_{}_{}_{}.gif'.format(opt.data_mode, epoch, seed))
-    imageio.mimsave(gif_path, images, fps=20)
-    # optimize(gif_path)
+def write_results_video(opt, build, inputs, n_frames, epoch, seed):
+    """Render the video build(opt, **inputs) with opt.video_workers processes (0: all the cores)"""
+    write_video(video_path(opt, epoch, seed), build, opt, inputs, n_frames, n_workers=video_workers(getattr(opt, 'video_workers', 1)))
+
+
+def add_accuracy_panel(opt, video, ax, curves):
+    video.add_curves(ax, [(values, color, "%s %s" % (name, opt.data_mode)) for values, color, name in curves])
+    ax.set_title("Test accuracy " + str(opt.data_mode) + " (class : " + str(opt.class_1) + ", " + str(opt.class_2) + ")")
+    ax.set_xlabel("Iteration")
+    ax.set_ylabel("Accuracy")
+    ax.legend(loc="lower right")
 
-    '''
-    os.chdir(CONF.PATH.OUTPUT)
-    subprocess.call([
-        'ffmpeg', '-framerate', '8', '-i', 'file%02d.png', '-r', '30', '-pix_fmt', 'yuv420p',
-        'video_name.mp4'
-    ])
-    for file_name in glob.glob("*.png"):
-        os.remove(file_name)
-    '''
+
+def add_w_diff_panel(opt, video, ax, curves):
+    video.add_curves(ax, [(values, color, "%s %s" % (name, opt.data_mode)) for values, color, name in curves])
+    ax.legend(loc="lower left")
+    ax.set_title("w diff " + str(opt.data_mode) + " (class : " + str(opt.class_1) + ", " + str(opt.class_2) + ")")
+    ax.set_xlabel("Iteration")
+    ax.set_ylabel("Distance between $w^t$ and $w^*$")
+
+
+def build_results_video(opt, images, labels, res_sgd, res_baseline, res_student, w_diff_sgd, w_diff_baseline, w_diff_student):
+    video = ResultsVideo(3, (20, 5.8))
+    ax1, ax2, ax3 = video.axes
+    video.add_image(ax1, images, cmap='gray')
+    video.add_title(ax1, lambda i: "Data Generation - Label {}".format(labels[i]))
+    add_accuracy_panel(opt, video, ax2, [(res_sgd, 'g', "SGD"), (res_baseline, 'b', "IMT"), (res_student, 'r', "Student")])
+    add_w_diff_panel(opt, video, ax3, [(w_diff_sgd, 'g', "SGD"), (w_diff_baseline, 'b', "IMT"), (w_diff_student, 'r', "Student")])
+    return video
+
+
+def make_results_video(opt, X, Y, generated_samples, generated_labels, res_sgd, res_baseline, res_student, w_diff_sgd, w_diff_baseline, w_diff_student, epoch, seed, proj_matrix=None):
+    images = video_images(generated_samples, proj_matrix)
+    labels = np.where(np.reshape(generated_labels, (len(generated_labels), -1))[:, 0] == 0.0, opt.class_1, opt.class_2)
+    inputs = video_inputs(images=images, labels=labels, res_sgd=res_sgd, res_baseline=res_baseline, res_student=res_student,
+                          w_diff_sgd=w_diff_sgd, w_diff_baseline=w_diff_baseline, w_diff_student=w_diff_student)
+    write_results_video(opt, build_results_video, inputs, len(res_student) - 1, epoch, seed)
 
 
 def make_results_img(opt, X, Y, generated_samples, generated_labels, res_sgd, res_baseline, res_student, w_diff_sgd, w_diff_baseline, w_diff_student, epoch, seed, proj_matrix=None):
 
     print("generated samples", generated_samples.shape)
 
-    if proj_matrix is not None:
-        unproj_matrix = np.linalg.pinv(proj_matrix)
-        generated_samples = generated_samples @ unproj_matrix
-        img_shape = (1, 28, 28)
-        generated_samples = np.reshape(generated_samples, (generated_samples.shape[0], *img_shape))
-        generated_samples = torch.from_numpy(generated_samples)
-    else:
-        generated_samples = torch.from_numpy(generated_samples)
-
-    generated_sample = generated_samples[-1].squeeze()
+    generated_sample = torch.from_numpy(trace_images(generated_samples, proj_matrix).images[-1]).squeeze()
     generated_label = generated_labels[-1]
 
     if generated_label == 0.0:
@@ -292,74 +251,22 @@ def make_results_img_2d(opt, X, Y, generated_samples, generated_labels, res_sgd,
     plt.savefig(img_path)
     plt.close()
 
-def make_results_video_2d(opt, X, Y, generated_samples, generated_labels, res_sgd, res_baseline, res_student, w_diff_sgd, w_diff_baseline, w_diff_student, epoch, seed):
-    # a, b = plot_classifier(teacher, X.max(axis=0), X.min(axis=0))
-    for i in range(len(res_student)):
-        fig, (ax1, ax2, ax3) = plt.subplots(1, 3)
-        fig.set_size_inches(20, 5.8)
-        #ax1.plot(a, b, '-k', label='Teacher Classifier')
-        # ax1.plot(a_student[i], b_student[i], '-r', label='Optimizer Classifier')
-        ax1.scatter(X[:, 0], X[:, 1], c=Y, cmap=cm_bright, edgecolors='k')
-        ax1.scatter(generated_samples[:i+1, 0], generated_samples[:i+1, 1], c=generated_labels[:i+1, 0], cmap=cm_bright, marker='^')
-        ax1.set_title("Data Generation (Ours)")
-        # ax1.set_xlim([X.min()-0.5, X.max()+0.5])
-        # ax1.set_ylim([X.min()-0.5, X.max()+0.5])
-        # ax1.legend(loc="upper right")
-
-        #ax2.plot(a, b, '-k', label='Teacher Classifier')
-        # ax2.plot(a_baseline[i], b_baseline[i], '-g', label='IMT Classifier')
-        # ax2.scatter(X[:, 0], X[:, 1], c=Y)
-        # ax2.scatter(selected_samples[:i+1, 0], selected_samples[:i+1, 1], c=selected_labels[:i+1, 0], marker='x')
-        # ax2.set_title("Data Selection (IMT)")
-        # ax2.set_xlim([X.min()-0.5, X.max()+0.5])
-        # ax2.set_ylim([X.min()-0.5, X.max()+0.5])
-        # ax2.legend(loc="upper right")
-
-        ax2.plot(res_sgd[:i+1], c='g', label="SGD %s" % opt.data_mode)
-        ax2.plot(res_baseline[:i+1], c='b', label="IMT %s" % opt.data_mode)
-        ax2.plot(res_student[:i+1], c='r', label="Student %s" % opt.data_mode)
-        # ax2.axhline(y=teacher_acc, color='k', linestyle='-', label="teacher accuracy")
-        ax2.set_title("Test accuracy " + str(opt.data_mode) + " (class : " + str(opt.class_1) + ", " + str(opt.class_2) + ")")
-        ax2.set_xlabel("Iteration")
-        ax2.set_ylabel("Accuracy")
-        ax2.legend(loc="lower right")
-
-        ax3.plot(w_diff_sgd[:i+1], 'g', label="SGD %s" % opt.data_mode)
-        ax3.plot(w_diff_baseline[:i+1], 'b', label="IMT %s" % opt.data_mode)
-        ax3.plot(w_diff_student[:i+1], 'r', label="Student %s" % opt.data_mode)
-        ax3.legend(loc="lower left")
-        ax3.set_title("w diff " + str(opt.data_mode) + " (class : " + str(opt.class_1) + ", " + str(opt.class_2) + ")")
-        ax3.set_xlabel("Iteration")
-        ax3.set_ylabel("Distance between $w^t$ and $w^*$")
-        #ax3.set_aspect('equal')
-
-        video_dir = os.path.join(opt.log_path, "video")
-        if not os.path.exists(video_dir):
-            os.makedirs(video_dir)
-
-        plt.savefig(video_dir + "/file%03d.jpg" % i)
-
-        plt.close()
+def build_results_video_2d(opt, X, Y, generated_samples, generated_labels, res_sgd, res_baseline, res_student, w_diff_sgd, w_diff_baseline, w_diff_student):
+    video = ResultsVideo(3, (20, 5.8))
+    ax1, ax2, ax3 = video.axes
+    ax1.scatter(X[:, 0], X[:, 1], c=Y, cmap=cm_bright, edgecolors='k')
+    video.add_points(ax1, generated_samples, generated_labels[:, 0], cmap=cm_bright, marker='^')
+    ax1.set_title("Data Generation (Ours)")
+    add_accuracy_panel(opt, video, ax2, [(res_sgd, 'g', "SGD"), (res_baseline, 'b', "IMT"), (res_student, 'r', "Student")])
+    add_w_diff_panel(opt, video, ax3, [(w_diff_sgd, 'g', "SGD"), (w_diff_baseline, 'b', "IMT"), (w_diff_student, 'r', "Student")])
+    return video
 
-    # os.chdir(video_dir)
-    images = []
-    for file_name in sorted(glob.glob(video_dir + "/*.jpg")):
-        # print(file_name)
-        images.append(imageio.imread(file_name))
-        # os.remove(file_name)
-    gif_path = os.path.join(video_dir, 'results_{}_{}_{}.gif'.format(opt.data_mode, epoch, seed))
-    imageio.mimsave(gif_path, images, fps=20)
-    # optimize(gif_path)
 
-    '''
-    os.chdir(CONF.PATH.OUTPUT)
-    subprocess.call([
-        'ffmpeg', '-framerate', '8', '-i', 'file%02d.jpg', '-r', '30', '-pix_fmt', 'yuv420p',
-        'video_name.mp4'
-    ])
-    for file_name in glob.glob("*.jpg"):
-        os.remove(file_name)
-    '''
+def make_results_video_2d(opt, X, Y, generated_samples, generated_labels, res_sgd, res_baseline, res_student, w_diff_sgd, w_diff_baseline, w_diff_student, epoch, seed):
+    inputs = video_inputs(X=X, Y=Y, generated_samples=generated_samples, generated_labels=generated_labels,
+                          res_sgd=res_sgd, res_baseline=res_baseline, res_student=res_student,
+                          w_diff_sgd=w_diff_sgd, w_diff_baseline=w_diff_baseline, w_diff_student=w_diff_student)
+    write_results_video(opt, build_results_video_2d, inputs, len(res_student), epoch, seed)
 
 
 def plot_generated_samples_2d(opt, X, Y, a_star, b_star, a_student, b_student, generated_samples, generated_labels, epoch, seed):
@@ -443,10 +350,10 @@ def plot_generated_samples(opt, X, Y, generated_samples, generated_labels, epoch
     if not os.path.exists(save_folder):
         os.makedirs(save_folder)
 
+    images = trace_images(generated_samples)
     iterations = [0, 40, 80, 120, 160, 200, 240, 280]
     for i in range(298):
 
-        generated_sample = generated_samples[i, :].squeeze()
         generated_label = generated_labels[i]
 
         if generated_label == 0.0:
@@ -462,99 +369,33 @@ def plot_generated_samples(opt, X, Y, generated_samples, generated_labels, epoch
         # img_path = os.path.join(save_folder, 'paper_generated_samples_{}_{}_{}_{}_{}.jpg'.format(opt.data_mode, epoch, seed, i, generated_label))
         # plt.savefig(img_path)
         # plt.close()
-        im = torch.from_numpy(generated_sample)
+        # same pixels as save_image, converted to uint8 once for the whole trace
+        im = images.uint8[i].squeeze()
+        im = np.repeat(im[..., None], 3, axis=2) if im.ndim == 2 else im.transpose(1, 2, 0)
         img_path = os.path.join(save_folder, 'paper_generated_samples_{}_{}_{}_{}_{}.jpg'.format(opt.data_mode, epoch, seed, i, generated_label))
-        save_image(im, img_path)
-
-
-def make_results_video_blackbox(opt, X, Y, generated_samples, generated_labels, res_sgd, res_student, w_diff_sgd, w_diff_student, epoch, seed, proj_matrix=None):
-    if proj_matrix is not None:
-        unproj_matrix = np.linalg.pinv(proj_matrix)
-        # a, b = plot_classifier(teacher, X.max(axis=0), X.min(axis=0))
-        generated_samples = generated_samples @ unproj_matrix
-        img_shape = (1, 28, 28)
-        generated_samples = np.reshape(generated_samples, (generated_samples.shape[0], *img_shape))
-        generated_samples = torch.from_numpy(generated_samples)
-    else:
-        generated_samples = torch.from_numpy(generated_samples)
+        Image.fromarray(im).save(img_path)
 
-    for i in range(len(res_student)-1):
 
-        generated_sample = generated_samples[i].squeeze()
-        generated_label = generated_labels[i]
-
-        fig, (ax1, ax2) = plt.subplots(1, 2)
-        fig.set_size_inches(13.3, 5.8)
-        #ax1.plot(a, b, '-k', label='Teacher Classifier')
-        # ax1.plot(a_student[i], b_student[i], '-r', label='Optimizer Classifier')
-        ax1.imshow(generated_sample, cmap='gray')
-        # ax1.scatter(generated_samples[:i+1, 0], generated_samples[:i+1, 1], c=generated_labels[:i+1], marker='x')
-        ax1.set_title("Data Generation (Ours)")
-        # ax1.set_xlim([X.min()-0.5, X.max()+0.5])
-        # ax1.set_ylim([X.min()-0.5, X.max()+0.5])
-        # ax1.legend(loc="upper right")
-
-        #ax2.plot(a, b, '-k', label='Teacher Classifier')
-        # ax2.plot(a_baseline[i], b_baseline[i], '-g', label='IMT Classifier')
-        # ax2.scatter(X[:, 0], X[:, 1], c=Y)
-        # ax2.scatter(selected_samples[:i+1, 0], selected_samples[:i+1, 1], c=selected_labels[:i+1, 0], marker='x')
-        # ax2.set_title("Data Selection (IMT)")
-        # ax2.set_xlim([X.min()-0.5, X.max()+0.5])
-        # ax2.set_ylim([X.min()-0.5, X.max()+0.5])
-        # ax2.legend(loc="upper right")
-
-        ax2.plot(res_sgd[:i+1], c='g', label="SGD %s" % opt.data_mode)
-        ax2.plot(res_student[:i+1], c='r', label="Student %s" % opt.data_mode)
-        # ax2.axhline(y=teacher_acc, color='k', linestyle='-', label="teacher accuracy")
-        ax2.set_title("Test accuracy " + str(opt.data_mode) + " (class : " + str(opt.class_1) + ", " + str(opt.class_2) + ")")
-        ax2.set_xlabel("Iteration")
-        ax2.set_ylabel("Accuracy")
-        ax2.legend(loc="lower right")
-
-        video_dir = os.path.join(opt.log_path, "video")
-        if not os.path.exists(video_dir):
-            os.makedirs(video_dir)
-
-        plt.savefig(video_dir + "/file%03d.jpg" % i)
-
-        plt.close()
+def build_results_video_blackbox(opt, images, res_sgd, res_student):
+    video = ResultsVideo(2, (13.3, 5.8))
+    ax1, ax2 = video.axes
+    video.add_image(ax1, images, cmap='gray')
+    ax1.set_title("Data Generation (Ours)")
+    add_accuracy_panel(opt, video, ax2, [(res_sgd, 'g', "SGD"), (res_student, 'r', "Student")])
+    return video
 
-    # os.chdir(video_dir)
-    images = []
-    for file_name in sorted(glob.glob(video_dir + "/*.jpg")):
-        # print(file_name)
-        images.append(imageio.imread(file_name))
-        # os.remove(file_name)
-    gif_path = os.path.join(video_dir, 'results_{}_{}_{}.gif'.format(opt.data_mode, epoch, seed))
-    imageio.mimsave(gif_path, images, fps=20)
-    # optimize(gif_path)
 
-    '''
-    os.chdir(CONF.PATH.OUTPUT)
-    subprocess.call([
-        'ffmpeg', '-framerate', '8', '-i', 'file%02d.jpg', '-r', '30', '-pix_fmt', 'yuv420p',
-        'video_name.mp4'
-    ])
-    for file_name in glob.glob("*.jpg"):
-        os.remove(file_name)
-    '''
+def make_results_video_blackbox(opt, X, Y, generated_samples, generated_labels, res_sgd, res_student, w_diff_sgd, w_diff_student, epoch, seed, proj_matrix=None):
+    images = video_images(generated_samples, proj_matrix)
+    inputs = video_inputs(images=images, res_sgd=res_sgd, res_student=res_student)
+    write_results_video(opt, build_results_video_blackbox, inputs, len(res_student) - 1, epoch, seed)
 
 
 def make_results_img_blackbox(opt, X, Y, generated_samples, generated_labels, res_sgd, res_student, w_diff_sgd, w_diff_student, epoch, seed, proj_matrix=None):
 
     print("generated samples", generated_samples.shape)
 
-    if proj_matrix is not None:
-        unproj_matrix = np.linalg.pinv(proj_matrix)
-        # a, b = plot_classifier(teacher, X.max(axis=0), X.min(axis=0))
-        generated_samples = generated_samples @ unproj_matrix
-        img_shape = (1, 28, 28)
-        generated_samples = np.reshape(generated_samples, (generated_samples.shape[0], *img_shape))
-        generated_samples = torch.from_numpy(generated_samples)
-    else:
-        generated_samples = torch.from_numpy(generated_samples)
-
-    generated_sample = generated_samples[-1].squeeze()
+    generated_sample = torch.from_numpy(trace_images(generated_samples, proj_matrix).images[-1]).squeeze()
     generated_label = generated_labels[-1]
 
     fig, (ax1, ax2) = plt.subplots(1, 2)
@@ -663,64 +504,20 @@ def make_results_img_2d_blackbox(opt, X, Y, generated_samples, generated_labels,
     plt.close()
 
 
-def make_results_video_2d_blackbox(opt, X, Y, generated_samples, generated_labels, res_sgd, res_student, w_diff_sgd, w_diff_student, epoch, seed):
-    # a, b = plot_classifier(teacher, X.max(axis=0), X.min(axis=0))
-    for i in range(len(res_student)):
-        fig, (ax1, ax2) = plt.subplots(1, 2)
-        fig.set_size_inches(13.3, 5.8)
-        #ax1.plot(a, b, '-k', label='Teacher Classifier')
-        # ax1.plot(a_student[i], b_student[i], '-r', label='Optimizer Classifier')
-        ax1.scatter(X[:, 0], X[:, 1], c=Y, cmap=cm_bright, edgecolors='k')
-        ax1.scatter(generated_samples[:i+1, 0], generated_samples[:i+1, 1], c=generated_labels[:i+1, 0], cmap=cm_bright, marker='^')
-        ax1.set_title("Data Generation (Ours)")
-        # ax1.set_xlim([X.min()-0.5, X.max()+0.5])
-        # ax1.set_ylim([X.min()-0.5, X.max()+0.5])
-        # ax1.legend(loc="upper right")
-
-        #ax2.plot(a, b, '-k', label='Teacher Classifier')
-        # ax2.plot(a_baseline[i], b_baseline[i], '-g', label='IMT Classifier')
-        # ax2.scatter(X[:, 0], X[:, 1], c=Y)
-        # ax2.scatter(selected_samples[:i+1, 0], selected_samples[:i+1, 1], c=selected_labels[:i+1, 0], marker='x')
-        # ax2.set_title("Data Selection (IMT)")
-        # ax2.set_xlim([X.min()-0.5, X.max()+0.5])
-        # ax2.set_ylim([X.min()-0.5, X.max()+0.5])
-        # ax2.legend(loc="upper right")
-
-        ax2.plot(res_sgd[:i+1], c='g', label="SGD %s" % opt.data_mode)
-        ax2.plot(res_student[:i+1], c='r', label="Student %s" % opt.data_mode)
-        # ax2.axhline(y=teacher_acc, color='k', linestyle='-', label="teacher accuracy")
-        ax2.set_title("Test accuracy " + str(opt.data_mode) + " (class : " + str(opt.class_1) + ", " + str(opt.class_2) + ")")
-        ax2.set_xlabel("Iteration")
-        ax2.set_ylabel("Accuracy")
-        ax2.legend(loc="lower right")
-
-        video_dir = os.path.join(opt.log_path, "video")
-        if not os.path.exists(video_dir):
-            os.makedirs(video_dir)
-
-        plt.savefig(video_dir + "/file%03d.jpg" % i)
-
-        plt.close()
+def build_results_video_2d_blackbox(opt, X, Y, generated_samples, generated_labels, res_sgd, res_student):
+    video = ResultsVideo(2, (13.3, 5.8))
+    ax1, ax2 = video.axes
+    ax1.scatter(X[:, 0], X[:, 1], c=Y, cmap=cm_bright, edgecolors='k')
+    video.add_points(ax1, generated_samples, generated_labels[:, 0], cmap=cm_bright, marker='^')
+    ax1.set_title("Data Generation (Ours)")
+    add_accuracy_panel(opt, video, ax2, [(res_sgd, 'g', "SGD"), (res_student, 'r', "Student")])
+    return video
 
-    # os.chdir(video_dir)
-    images = []
-    for file_name in sorted(glob.glob(video_dir + "/*.jpg")):
-        # print(file_name)
-        images.append(imageio.imread(file_name))
-        # os.remove(file_name)
-    gif_path = os.path.join(video_dir, 'results_{}_{}_{}.gif'.format(opt.data_mode, epoch, seed))
-    imageio.mimsave(gif_path, images, fps=20)
-    # optimize(gif_path)
 
-    '''
-    os.chdir(CONF.PATH.OUTPUT)
-    subprocess.call([
-        'ffmpeg', '-framerate', '8', '-i', 'file%02d.jpg', '-r', '30', '-pix_fmt', 'yuv420p',
-        'video_name.mp4'
-    ])
-    for file_name in glob.glob("*.jpg"):
-        os.remove(file_name)
-    '''
+def make_results_video_2d_blackbox(opt, X, Y, generated_samples, generated_labels, res_sgd, res_student, w_diff_sgd, w_diff_student, epoch, seed):
+    inputs = video_inputs(X=X, Y=Y, generated_samples=generated_samples, generated_labels=generated_labels,
+                          res_sgd=res_sgd, res_student=res_student)
+    write_results_video(opt, build_results_video_2d_blackbox, inputs, len(res_student), epoch, seed)
 
 
 import torch.nn as nn
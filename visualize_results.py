@@ -21,6 +21,7 @@ from tqdm import tqdm
 
 from utils.data import plot_graphs, plot_graphs_optimized, plot_graphs_vae_cgan, plot_perceptual_loss
 from utils.visualize import plot_distribution
+from utils.store import ResultsStore
 
 sys.path.append('..') #Hack add ROOT DIR
 from baseconfig import CONF
@@ -33,21 +34,16 @@ def calc_results(opt, seeds, models, experiments):
         # f.write('blackbox implicit final results ')
         f.write('blackbox mixup rl final results ')
         f.writelines('\n')
+    model_name = "blackbox_implicit_" + opt.data_mode + "_" + str(opt.n_weight_update) + '_' + str(opt.n_z_update) + '_' + str(opt.epsilon)
+    # model_name = "blackbox_mixup_rl_" + opt.data_mode + "_" + str(opt.n_weight_update) + '_' + str(opt.n_z_update) + '_' + str(opt.epsilon)
+    # only the CSVs that changed since the last call are parsed
+    store = ResultsStore()
+    store.ingest_log_dir(CONF.PATH.LOG, model_name)
     for experiment in experiments:
         for model in models:
-            values = []
-            for seed in seeds:
-                model_name = "blackbox_implicit_" + opt.data_mode + "_" + str(opt.n_weight_update) + '_' + str(opt.n_z_update) + '_' + str(opt.epsilon)
-                # model_name = "blackbox_mixup_rl_" + opt.data_mode + "_" + str(opt.n_weight_update) + '_' + str(opt.n_z_update) + '_' + str(opt.epsilon)
-                log_dir = os.path.join(CONF.PATH.LOG, model_name, str(seed), str(model), str(experiment))
-                for file in os.listdir(log_dir):
-                    if file.endswith(".csv"):
-                        csv_file = os.path.join(log_dir, file)
-                        with open(csv_file, "r") as file:
-                            last_line = file.readlines()[-1]
-                            last_line = last_line.strip('\n').split(',')
-                            values.append(last_line[-1])
-            values_np = np.asarray(values).astype(float)
+            runs = store.runs(policy=model_name, seed=list(seeds), model=str(model), experiment=str(experiment))
+            values_np = store.final(-1, runs)
+            values = [str(v) for v in values_np]
             values_mean = np.mean(values_np)
             values_std = np.std(values_np)
             with open(results, 'a') as f: